@@ -1,11 +1,89 @@
 const express = require('express');
 const jwt = require('jsonwebtoken');
+const crypto = require('crypto');
+const fs = require('fs');
+const path = require('path');
 
 const app = express();
-const PORT = 3006;
+const PORT = parseInt(process.env.PORT || '3006', 10);
 const JWT_SECRET = 'your-secret-key'; // Change this in production
 
+// OAuth 2.1 Client Credentials: registered confidential clients
+const OAUTH_CLIENTS = {
+    'mcp-server': {
+        secret: process.env.MCP_SERVER_CLIENT_SECRET || 'mcp-server-secret',
+        scopes: ['email:read', 'email:write']
+    }
+};
+const CLIENT_TOKEN_TTL = 3600; // seconds
+
+// Asymmetric signing keys (RS256 / ES256), published on /.well-known/jwks.json.
+// Keys are generated at startup; rotated keys stay published so older tokens still verify.
+const KEY_TYPES = {
+    RS256: ['rsa', { modulusLength: 2048 }],
+    ES256: ['ec', { namedCurve: 'P-256' }]
+};
+const signingKeys = {}; // alg -> { kid, privateKey }
+const publishedKeys = []; // [{ kid, alg, publicKey }]
+
+const rotateSigningKey = (alg) => {
+    const [type, options] = KEY_TYPES[alg];
+    const { privateKey, publicKey } = crypto.generateKeyPairSync(type, options);
+    const kid = `${alg.toLowerCase()}-${crypto.randomBytes(6).toString('hex')}`;
+    signingKeys[alg] = { kid, privateKey };
+    publishedKeys.push({ kid, alg, publicKey });
+    console.log(`[API] New ${alg} signing key ${kid}`);
+    return kid;
+};
+Object.keys(KEY_TYPES).forEach(rotateSigningKey);
+
+// Sign with the shared secret (HS256) or the current asymmetric key for alg
+const signToken = (claims, alg, options) => {
+    if (alg === 'HS256') {
+        return jwt.sign(claims, JWT_SECRET, options);
+    }
+    const { kid, privateKey } = signingKeys[alg];
+    return jwt.sign(claims, privateKey, { ...options, algorithm: alg, keyid: kid });
+};
+
+// Resolve the verification key for jwt.verify from the token header
+const getVerificationKey = (header, callback) => {
+    if (header.alg === 'HS256') {
+        return callback(null, JWT_SECRET);
+    }
+    const published = publishedKeys.find((k) => k.kid === header.kid && k.alg === header.alg);
+    if (!published) {
+        return callback(new Error(`Unknown signing key ${header.kid}`));
+    }
+    callback(null, published.publicKey);
+};
+const TOKEN_SIGNING_ALG = process.env.TOKEN_SIGNING_ALG || 'HS256';
+
+// Tenant registry: tenant_id -> tenant record, reloaded when the file changes
+const TENANTS_FILE = process.env.TENANTS_FILE || path.join(__dirname, 'tenants.json');
+let tenants = new Map();
+
+const loadTenants = () => {
+    const { tenants: entries } = JSON.parse(fs.readFileSync(TENANTS_FILE, 'utf8'));
+    const next = new Map();
+    for (const tenant of entries) {
+        next.set(tenant.tenant_id, { status: 'active', ...tenant });
+    }
+    // Swap the whole map so requests never see a partially loaded registry
+    tenants = next;
+    console.log(`[API] Loaded ${tenants.size} tenants from ${TENANTS_FILE}`);
+};
+loadTenants();
+fs.watchFile(TENANTS_FILE, { interval: 2000 }, () => {
+    try {
+        loadTenants();
+    } catch (err) {
+        console.error(`[API] Tenant reload failed, keeping previous registry: ${err.message}`);
+    }
+});
+
 app.use(express.json());
+app.use(express.urlencoded({ extended: false }));
 
 // Thai Phung - Middleware and Endpoints for API Server
 // Middleware: Verify JWT Bearer token
@@ -17,7 +95,7 @@ const authenticateToken = (req, res, next) => {
         return res.status(401).json({ message: 'Authentication token required' });
     }
 
-    jwt.verify(token, JWT_SECRET, (err, user) => {
+    jwt.verify(token, getVerificationKey, { algorithms: ['HS256', ...Object.keys(KEY_TYPES)] }, (err, user) => {
         if (err) {
             return res.status(403).json({ message: 'Invalid or expired token' });
         }
@@ -28,15 +106,66 @@ const authenticateToken = (req, res, next) => {
 
 // Middleware: Verify x-cdl-tenant-id header
 const verifyTenantId = (req, res, next) => {
-    const tenantId = req.headers['x-cdl-tenant-id'];
+    const tenant = tenants.get(req.headers['x-cdl-tenant-id']);
 
-    if (tenantId !== 'test123') {
+    if (!tenant) {
         return res.status(403).json({ message: 'Invalid tenant ID' });
     }
+    if (tenant.status !== 'active') {
+        return res.status(403).json({ message: 'Tenant is suspended' });
+    }
 
+    req.tenant = tenant;
     next();
 };
 
+// Idempotency-Key support for writes: the first response for a (tenant, key)
+// is stored and replayed to retries, so a retried request is applied once.
+const IDEMPOTENCY_TTL = Number(process.env.IDEMPOTENCY_TTL || 86400) * 1000; // ms
+const idempotentResponses = new Map(); // `${tenant}:${key}` -> { fingerprint, status, body, expiresAt }
+
+const idempotent = (req, res, next) => {
+    const key = req.headers['idempotency-key'];
+    if (!key) {
+        return next();
+    }
+    const now = Date.now();
+    for (const [storedKey, entry] of idempotentResponses) {
+        // Map keeps insertion order, so expired entries are at the front
+        if (entry.expiresAt > now) break;
+        idempotentResponses.delete(storedKey);
+    }
+
+    const scopedKey = `${req.tenant.tenant_id}:${key}`;
+    const fingerprint = `${req.method} ${req.path} ${JSON.stringify(req.body)}`;
+    const stored = idempotentResponses.get(scopedKey);
+    if (stored) {
+        if (stored.fingerprint !== fingerprint) {
+            return res.status(422).json({ message: 'Idempotency-Key was already used for a different request' });
+        }
+        console.log(`[API] Replaying response for Idempotency-Key ${key}`);
+        res.set('Idempotent-Replayed', 'true');
+        return res.status(stored.status).json(stored.body);
+    }
+
+    const json = res.json.bind(res);
+    res.json = (body) => {
+        // Server errors are not stored, so the client can retry them
+        if (res.statusCode < 500) {
+            idempotentResponses.set(scopedKey, {
+                fingerprint, status: res.statusCode, body, expiresAt: now + IDEMPOTENCY_TTL
+            });
+        }
+        return json(body);
+    };
+    next();
+};
+
+// Mock email store: `${tenant}:${account_id}` -> email (unchanged accounts read as user@example.com)
+const DEFAULT_EMAIL = 'user@example.com';
+const emails = new Map();
+const getStoredEmail = (tenantId, accountId) => emails.get(`${tenantId}:${accountId}`) || DEFAULT_EMAIL;
+
 // Validate account_id format (5-10 digits)
 const validateAccountId = (accountId) => {
     return accountId && /^\d{5,10}$/.test(accountId);
@@ -47,10 +176,14 @@ const validateEmail = (email) => {
     return email && /^[^\s@]+@[^\s@]+\.[^\s@]+$/.test(email);
 };
 
-// [GET] /generate-token - Generate JWT token for testing
+// [GET] /generate-token?alg=RS256 - Generate JWT token for testing (HS256 by default)
 app.get('/generate-token', (req, res) => {
-    console.log('[API] GET /generate-token - Generating JWT token');
-    const token = jwt.sign({ userId: '123' }, JWT_SECRET, { expiresIn: '8h' });
+    const alg = req.query.alg || 'HS256';
+    console.log(`[API] GET /generate-token - Generating ${alg} JWT token`);
+    if (alg !== 'HS256' && !KEY_TYPES[alg]) {
+        return res.status(400).json({ message: `Unsupported alg ${alg}` });
+    }
+    const token = signToken({ userId: '123' }, alg, { expiresIn: '8h' });
     console.log('[API] Token generated successfully');
     res.status(200).json({
         message: 'Token generated successfully',
@@ -59,6 +192,95 @@ app.get('/generate-token', (req, res) => {
     });
 });
 
+// Read client credentials from HTTP Basic auth (preferred) or the form body
+const readClientCredentials = (req) => {
+    const authHeader = req.headers['authorization'] || '';
+    if (authHeader.startsWith('Basic ')) {
+        const decoded = Buffer.from(authHeader.slice(6), 'base64').toString('utf8');
+        const separator = decoded.indexOf(':');
+        if (separator > 0) {
+            return {
+                clientId: decodeURIComponent(decoded.slice(0, separator)),
+                clientSecret: decodeURIComponent(decoded.slice(separator + 1))
+            };
+        }
+    }
+    return { clientId: req.body.client_id, clientSecret: req.body.client_secret };
+};
+
+// [POST] /token - OAuth 2.1 Client Credentials Grant (used by the MCP Server)
+app.post('/token', verifyTenantId, (req, res) => {
+    const { grant_type, scope, resource } = req.body;
+    const tenantId = req.headers['x-cdl-tenant-id'];
+    console.log(`[API] POST /token - grant_type=${grant_type} tenant=${tenantId}`);
+
+    if (grant_type !== 'client_credentials') {
+        return res.status(400).json({
+            error: 'unsupported_grant_type',
+            error_description: 'Only client_credentials is supported'
+        });
+    }
+
+    const { clientId, clientSecret } = readClientCredentials(req);
+    const client = OAUTH_CLIENTS[clientId];
+    if (!client || client.secret !== clientSecret) {
+        console.log(`[API] Client authentication failed for ${clientId}`);
+        return res.status(401).json({
+            error: 'invalid_client',
+            error_description: 'Client authentication failed'
+        });
+    }
+
+    const requested = scope ? scope.split(' ').filter(Boolean) : client.scopes;
+    if (requested.some((s) => !client.scopes.includes(s))) {
+        return res.status(400).json({
+            error: 'invalid_scope',
+            error_description: 'Requested scope is not allowed for this client'
+        });
+    }
+
+    const claims = { sub: clientId, tenant_id: tenantId, scope: requested.join(' ') };
+    if (resource) {
+        claims.aud = resource;
+    }
+    const accessToken = signToken(claims, TOKEN_SIGNING_ALG, { expiresIn: CLIENT_TOKEN_TTL });
+    console.log(`[API] Access token issued to ${clientId} for tenant ${tenantId}`);
+    res.set('Cache-Control', 'no-store');
+    res.status(200).json({
+        access_token: accessToken,
+        token_type: 'Bearer',
+        expires_in: CLIENT_TOKEN_TTL,
+        scope: claims.scope
+    });
+});
+
+// [GET] /health - Liveness probe (used by the MCP server's shard health checks)
+app.get('/health', (req, res) => {
+    res.status(200).json({ status: 'ok' });
+});
+
+// [GET] /.well-known/jwks.json - Public keys for RS256 / ES256 tokens
+app.get('/.well-known/jwks.json', (req, res) => {
+    const keys = publishedKeys.map(({ kid, alg, publicKey }) => ({
+        ...publicKey.export({ format: 'jwk' }),
+        kid,
+        alg,
+        use: 'sig'
+    }));
+    res.set('Cache-Control', 'public, max-age=300');
+    res.status(200).json({ keys });
+});
+
+// [POST] /jwks/rotate?alg=RS256 - Test helper: start signing with a new key
+app.post('/jwks/rotate', (req, res) => {
+    const alg = req.query.alg || 'RS256';
+    if (!KEY_TYPES[alg]) {
+        return res.status(400).json({ message: `Unsupported alg ${alg}` });
+    }
+    const kid = rotateSigningKey(alg);
+    res.status(200).json({ message: 'Signing key rotated', alg, kid });
+});
+
 // [GET] /get_email/:account_id
 app.get('/get_email/:account_id', authenticateToken, verifyTenantId, (req, res) => {
     const { account_id } = req.params;
@@ -76,12 +298,12 @@ app.get('/get_email/:account_id', authenticateToken, verifyTenantId, (req, res)
     res.status(200).json({
         message: 'Email retrieved successfully',
         account_id,
-        email: 'user@example.com'
+        email: getStoredEmail(req.tenant.tenant_id, account_id)
     });
 });
 
 // [POST] /change_email
-app.post('/change_email', authenticateToken, verifyTenantId, (req, res) => {
+app.post('/change_email', authenticateToken, verifyTenantId, idempotent, (req, res) => {
     const { account_id, new_email } = req.body;
     console.log(`[API] POST /change_email - Request received for account ${account_id}`);
 
@@ -100,14 +322,54 @@ app.post('/change_email', authenticateToken, verifyTenantId, (req, res) => {
     }
 
     console.log(`[API] Email changed successfully: ${account_id} -> ${new_email}`);
-    // Mock response - replace with actual database update
+    // Mock update - replace with actual database update
+    const old_email = getStoredEmail(req.tenant.tenant_id, account_id);
+    emails.set(`${req.tenant.tenant_id}:${account_id}`, new_email);
     res.status(200).json({
         message: 'Email changed successfully',
         account_id,
+        old_email,
         new_email
     });
 });
 
+// [POST] /change_emails - Apply a batch of email changes; each item succeeds or fails on its own
+const CHANGE_EMAILS_MAX_BATCH = Number(process.env.CHANGE_EMAILS_MAX_BATCH || 1000);
+
+app.post('/change_emails', authenticateToken, verifyTenantId, idempotent, (req, res) => {
+    const { changes } = req.body;
+    if (!Array.isArray(changes) || changes.length === 0) {
+        return res.status(400).json({ message: 'changes must be a non-empty array' });
+    }
+    if (changes.length > CHANGE_EMAILS_MAX_BATCH) {
+        return res.status(400).json({ message: `Too many changes: ${changes.length} (max ${CHANGE_EMAILS_MAX_BATCH})` });
+    }
+    console.log(`[API] POST /change_emails - Request received for ${changes.length} accounts`);
+
+    const results = changes.map((change) => {
+        const { account_id, new_email } = change || {};
+        if (!validateAccountId(account_id)) {
+            return { account_id, status: 'error', message: 'Invalid account_id. Must be 5-10 digits' };
+        }
+        if (!validateEmail(new_email)) {
+            return { account_id, status: 'error', message: 'Invalid email format' };
+        }
+        // Mock update - replace with actual database update
+        const old_email = getStoredEmail(req.tenant.tenant_id, account_id);
+        emails.set(`${req.tenant.tenant_id}:${account_id}`, new_email);
+        return { account_id, status: 'success', old_email, new_email };
+    });
+
+    const succeeded = results.filter((r) => r.status === 'success').length;
+    console.log(`[API] Batch processed: ${succeeded} changed, ${results.length - succeeded} failed`);
+    res.status(200).json({
+        message: 'Batch processed',
+        succeeded,
+        failed: results.length - succeeded,
+        results
+    });
+});
+
 app.listen(PORT, () => {
     console.log(`API Server running on http://localhost:${PORT}`);
 });
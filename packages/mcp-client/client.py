@@ -4,6 +4,7 @@ Thai Phung - MCP Client tool
 
 import asyncio
 import base64
+import os
 import subprocess
 import json
 from fastmcp import Client, FastMCP
@@ -12,10 +13,49 @@ from fastmcp.client.transports import StreamableHttpTransport
 from PIL import Image
 from io import BytesIO
 
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.trace import SpanKind
+except ImportError:  # tracing is optional
+    trace = None
+
 # Cache for JWT token and tenant ID
 cache = {"jwt_token": None, "tenant_id": None}
 
 MCP_SERVER_URL = "http://127.0.0.1:3005/mcp"
+# "console" prints client spans to stderr (needs opentelemetry-sdk)
+MCP_TRACE_EXPORTER = os.environ.get("MCP_TRACE_EXPORTER", "").lower()
+
+
+def setup_tracing():
+    """Console span exporter when MCP_TRACE_EXPORTER is set and the SDK is installed"""
+    if trace is None or not MCP_TRACE_EXPORTER:
+        return
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import SimpleSpanProcessor, ConsoleSpanExporter
+    except ImportError:
+        print("⚠️  MCP_TRACE_EXPORTER is set but opentelemetry-sdk is not installed")
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": "mcp-client"}))
+    provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter()))
+    trace.set_tracer_provider(provider)
+
+
+async def traced_call_tool(client, name: str, arguments: dict = None):
+    """call_tool in a client span; the trace context travels in the request _meta"""
+    if trace is None:
+        return await client.call_tool(name, arguments)
+    tracer = trace.get_tracer("mcp_client")
+    with tracer.start_as_current_span(
+        f"tools/call {name}",
+        kind=SpanKind.CLIENT,
+        attributes={"mcp.method.name": "tools/call", "gen_ai.tool.name": name},
+    ):
+        meta = {}
+        propagate.inject(meta)
+        return await client.call_tool(name, arguments, meta=meta or None)
 
 
 def print_logo():
@@ -100,7 +140,8 @@ async def list_mcp_info(client):
 async def call_get_email(client, account_id: str):
     """Call get_email tool"""
 
-    result = await client.call_tool(
+    result = await traced_call_tool(
+        client,
         "get_email",
         {
             "account_id": account_id
@@ -112,12 +153,16 @@ async def call_get_email(client, account_id: str):
 async def call_get_chart(client):
     """Call get_email tool"""
 
-    result = await client.call_tool(
-        "get_chart",
-    )
+    result = await traced_call_tool(client, "get_chart")
     # print(json.dumps(result.data, indent=2))
     # print(f"\n✅ Result: .... {result.content[0].data}\n")
-    base64_data = result.content[0].data
+    content = result.content[0]
+    if content.type == "resource_link":
+        # The server returns a reference; fetch the image bytes on demand
+        contents = await client.read_resource(content.uri)
+        base64_data = contents[0].blob
+    else:
+        base64_data = content.data
     image_bytes = base64.b64decode(base64_data)
 
     img = Image.open(BytesIO(image_bytes))
@@ -127,7 +172,8 @@ async def call_get_chart(client):
 async def call_change_email(client, account_id: str, new_email: str):
     """Call change_email tool with confirmation workflow"""
     # Step 1: Call with new_email
-    result = await client.call_tool(
+    result = await traced_call_tool(
+        client,
         "change_email",
         {
             "account_id": account_id,
@@ -136,17 +182,23 @@ async def call_change_email(client, account_id: str, new_email: str):
     )
     print(f"\n📝 step 1:  {result}")
 
-    # Step 2: If confirmation needed, ask user
-    if "confirm" in str(result).lower():
-        confirmation = input("Enter Y to confirm, N to cancel: ").strip()
-        result = await client.call_tool(
+    # Step 2: Answer the server's questions; the server holds the change,
+    # so each answer only sends back its token
+    content = result.structured_content or {}
+    while content.get("status") == "pending" and content.get("confirmation_token"):
+        if content.get("step") == "reconfirm":
+            answer = input(f"{content['message']} ").strip()
+        else:
+            answer = input("Enter Y to confirm, N to cancel: ").strip()
+        result = await traced_call_tool(
+            client,
             "change_email",
             {
-            "account_id": account_id,
-            "new_email": new_email,
-            "user_confirmation": confirmation,
+            "confirmation_token": content["confirmation_token"],
+            "user_confirmation": answer,
             }
         )
+        content = result.structured_content or {}
         print(f"\n✅ Result: {result}\n")
 
 
@@ -197,6 +249,7 @@ async def main():
 
         os.system("chcp 65001 > nul")
     print_logo()
+    setup_tracing()
 
     # Ask if user wants to get JWT token
     get_token = (
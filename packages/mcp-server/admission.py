@@ -0,0 +1,145 @@
+"""
+Thai Phung - Adaptive concurrency limit and load shedding for MCP tool calls
+
+`AdaptiveLimiter` caps the tool calls executing at once. The cap follows
+upstream latency (AIMD): every ADAPTIVE_WINDOW seconds the limiter compares
+the window's mean upstream latency with a slowly tracked baseline. If latency
+rose past ADAPTIVE_LATENCY_TOLERANCE x baseline, or upstream requests failed,
+the limit is cut multiplicatively, more the further latency overshoots. If
+calls were using the limit and latency stayed normal, it grows by one.
+Calls over the limit are shed at once with an "overloaded" error and a retry
+hint, instead of queueing behind a slow API Server until they time out.
+"""
+
+import os
+import time
+from typing import Optional
+
+# Configuration
+ADAPTIVE_LIMIT_ENABLED = os.environ.get("ADAPTIVE_LIMIT_ENABLED", "1") == "1"
+ADAPTIVE_INITIAL_LIMIT = int(os.environ.get("ADAPTIVE_INITIAL_LIMIT", "100"))
+ADAPTIVE_MIN_LIMIT = int(os.environ.get("ADAPTIVE_MIN_LIMIT", "10"))
+ADAPTIVE_MAX_LIMIT = int(os.environ.get("ADAPTIVE_MAX_LIMIT", "1000"))
+ADAPTIVE_WINDOW = float(os.environ.get("ADAPTIVE_WINDOW", "1"))
+ADAPTIVE_LATENCY_TOLERANCE = float(os.environ.get("ADAPTIVE_LATENCY_TOLERANCE", "2"))
+ADAPTIVE_BACKOFF = float(os.environ.get("ADAPTIVE_BACKOFF", "0.9"))
+# Fraction of a window's excess latency folded into the baseline, so a
+# lasting change in upstream speed becomes the new normal
+ADAPTIVE_BASELINE_DRIFT = float(os.environ.get("ADAPTIVE_BASELINE_DRIFT", "0.05"))
+ADAPTIVE_MIN_RETRY_AFTER = float(os.environ.get("ADAPTIVE_MIN_RETRY_AFTER", "0.5"))
+
+
+class Overloaded:
+    """Why a call was shed and when the caller may retry (same shape as QuotaExceeded)"""
+
+    __slots__ = ("limit", "retry_after")
+
+    error = "overloaded"
+
+    def __init__(self, limit: int, retry_after: float):
+        self.limit = limit
+        self.retry_after = retry_after
+
+    @property
+    def message(self) -> str:
+        return f"Server overloaded, retry after {self.retry_after:g}s"
+
+    def to_dict(self) -> dict:
+        return {
+            "status": "error",
+            "error": self.error,
+            "limit": self.limit,
+            "retry_after": self.retry_after,
+            "message": self.message,
+        }
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit driven by observed upstream latency and errors"""
+
+    def __init__(
+        self,
+        initial_limit: int = ADAPTIVE_INITIAL_LIMIT,
+        min_limit: int = ADAPTIVE_MIN_LIMIT,
+        max_limit: int = ADAPTIVE_MAX_LIMIT,
+        window: float = ADAPTIVE_WINDOW,
+        tolerance: float = ADAPTIVE_LATENCY_TOLERANCE,
+        backoff: float = ADAPTIVE_BACKOFF,
+        baseline_drift: float = ADAPTIVE_BASELINE_DRIFT,
+        min_retry_after: float = ADAPTIVE_MIN_RETRY_AFTER,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.window = window
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.baseline_drift = baseline_drift
+        self.min_retry_after = min_retry_after
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        # Smoothed upstream latency, used for the retry hint
+        self.latency = 0.0
+        self.shed = 0
+        self.decreases = 0
+        self._window_start = time.monotonic()
+        self._samples = 0
+        self._latency_sum = 0.0
+        self._failures = 0
+        self._peak_in_flight = 0
+
+    def try_acquire(self) -> Optional[Overloaded]:
+        """Admit a call (None) or shed it (Overloaded)"""
+        if self.in_flight >= int(self.limit):
+            self.shed += 1
+            retry_after = round(max(self.min_retry_after, self.latency), 3)
+            return Overloaded(int(self.limit), retry_after)
+        self.in_flight += 1
+        if self.in_flight > self._peak_in_flight:
+            self._peak_in_flight = self.in_flight
+        return None
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+    def observe(self, latency: float, ok: bool) -> None:
+        """Record one upstream request (ok=False for errors, timeouts and 5xx)"""
+        self._samples += 1
+        self._latency_sum += latency
+        if not ok:
+            self._failures += 1
+        self.latency = latency if not self.latency else 0.8 * self.latency + 0.2 * latency
+        now = time.monotonic()
+        if now - self._window_start >= self.window:
+            self._adjust()
+            self._window_start = now
+
+    def _adjust(self) -> None:
+        mean = self._latency_sum / self._samples
+        if self.baseline is None or mean < self.baseline:
+            self.baseline = mean
+        threshold = self.baseline * self.tolerance
+        if self._failures > 0 or mean > threshold:
+            # Gradient: the further latency is past the threshold, the deeper the cut
+            factor = self.backoff if mean <= threshold else max(0.5, min(self.backoff, threshold / mean))
+            self.limit = max(self.min_limit, self.limit * factor)
+            self.decreases += 1
+        elif self._peak_in_flight >= int(self.limit) * 0.8:
+            # Only grow a limit that calls are actually pressing against
+            self.limit = min(self.max_limit, self.limit + 1)
+        if mean > self.baseline:
+            self.baseline += (mean - self.baseline) * self.baseline_drift
+        self._samples = 0
+        self._latency_sum = 0.0
+        self._failures = 0
+        self._peak_in_flight = self.in_flight
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "baseline": self.baseline,
+            "latency": self.latency,
+            "shed": self.shed,
+            "decreases": self.decreases,
+        }
@@ -0,0 +1,103 @@
+"""
+Thai Phung - Preloaded chart assets for the MCP Server
+
+Chart images are read and base64-encoded once at startup. Each asset keeps
+its raw bytes, encoded payload and SHA-256 content hash, and is reloaded
+only when the file's mtime (or size) changes. The raw bytes are an
+`EncodedBytes`, so whoever serves them can send the stored base64 instead of
+encoding again.
+"""
+
+import base64
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+from typing import Optional
+
+# Configuration
+ASSET_DIR = os.environ.get("ASSET_DIR", os.path.dirname(os.path.abspath(__file__)))
+# Minimum seconds between stat() checks of one asset
+ASSET_CHECK_INTERVAL = float(os.environ.get("ASSET_CHECK_INTERVAL", "1"))
+
+
+class EncodedBytes(bytes):
+    """Bytes that carry their base64 encoding (slices are plain bytes)"""
+
+    b64 = ""
+
+
+class Asset:
+    """An asset file loaded into memory together with its encodings"""
+
+    __slots__ = ("name", "path", "mime_type", "data", "b64", "sha256", "size", "mtime_ns", "checked_at")
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.checked_at = 0.0
+        self.mtime_ns = -1
+        self.size = -1
+        self.data = b""
+        self.b64 = ""
+        self.sha256 = ""
+
+    def load(self, stat: os.stat_result) -> None:
+        with open(self.path, "rb") as f:
+            data = f.read()
+        self.b64 = base64.b64encode(data).decode("ascii")
+        self.data = EncodedBytes(data)
+        self.data.b64 = self.b64
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+
+    def is_stale(self, stat: os.stat_result) -> bool:
+        return stat.st_mtime_ns != self.mtime_ns or stat.st_size != self.size
+
+
+class AssetRegistry:
+    """Named assets, loaded up front and refreshed when their file changes"""
+
+    def __init__(self, base_dir: str = ASSET_DIR, check_interval: float = ASSET_CHECK_INTERVAL):
+        self.base_dir = base_dir
+        self.check_interval = check_interval
+        self._assets: dict[str, Asset] = {}
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def register(self, name: str, filename: Optional[str] = None) -> Asset:
+        """Register and immediately load an asset (filename defaults to name)"""
+        path = os.path.join(self.base_dir, filename or name)
+        asset = Asset(name, path)
+        asset.load(os.stat(path))
+        asset.checked_at = time.monotonic()
+        self._assets[name] = asset
+        return asset
+
+    def get(self, name: str) -> Asset:
+        """Return the asset, reloading it first if the file changed on disk"""
+        asset = self._assets[name]
+        now = time.monotonic()
+        if now - asset.checked_at < self.check_interval:
+            return asset
+
+        with self._lock:
+            if now - asset.checked_at < self.check_interval:
+                return asset
+            stat = os.stat(asset.path)
+            if asset.is_stale(stat):
+                reloaded = Asset(name, asset.path)
+                reloaded.load(stat)
+                reloaded.checked_at = now
+                # Swap in a fully loaded object so readers never see a partial update
+                self._assets[name] = asset = reloaded
+                self.reloads += 1
+            else:
+                asset.checked_at = now
+        return asset
+
+    def names(self) -> list[str]:
+        return list(self._assets)
@@ -0,0 +1,202 @@
+"""
+Thai Phung - Append-only JSONL audit log for email changes
+
+Tools call `audit_log.record(...)`, which only puts the record on a queue.
+A background thread writes everything queued as one batch, then flushes and
+fsyncs once per batch (group commit). A batch closes AUDIT_FLUSH_INTERVAL
+after its first record, or at AUDIT_MAX_BATCH records. The file is rotated
+by size or age; rotated files get a UTC timestamp suffix and are never
+reopened.
+
+Records are durable once their batch is fsynced, i.e. up to
+AUDIT_FLUSH_INTERVAL after the tool returned.
+
+A record can carry a dedupe key (for email changes: idempotency key and
+account). A key seen among the last AUDIT_DEDUPE_SIZE is not recorded again,
+so a change the API Server answers again as an idempotent replay is audited
+once.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from mcp_logging import get_logger
+
+log = get_logger("audit")
+
+# Configuration
+AUDIT_LOG_ENABLED = os.environ.get("AUDIT_LOG_ENABLED", "1") == "1"
+AUDIT_LOG_FILE = os.environ.get("AUDIT_LOG_FILE", "audit.jsonl")
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", "0.05"))
+AUDIT_MAX_BATCH = int(os.environ.get("AUDIT_MAX_BATCH", "1000"))
+AUDIT_ROTATE_BYTES = int(os.environ.get("AUDIT_ROTATE_BYTES", str(100 * 1024 * 1024)))
+AUDIT_ROTATE_INTERVAL = float(os.environ.get("AUDIT_ROTATE_INTERVAL", "86400"))
+AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", "100000"))
+# Dedupe keys remembered to skip repeated records
+AUDIT_DEDUPE_SIZE = int(os.environ.get("AUDIT_DEDUPE_SIZE", "100000"))
+
+_STOP = object()
+
+
+class AuditLog:
+    """Queue + background group-commit writer for one JSONL file"""
+
+    def __init__(
+        self,
+        path: str = AUDIT_LOG_FILE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL,
+        max_batch: int = AUDIT_MAX_BATCH,
+        rotate_bytes: int = AUDIT_ROTATE_BYTES,
+        rotate_interval: float = AUDIT_ROTATE_INTERVAL,
+        queue_size: int = AUDIT_QUEUE_SIZE,
+        enabled: bool = AUDIT_LOG_ENABLED,
+        dedupe_size: int = AUDIT_DEDUPE_SIZE,
+    ):
+        self.enabled = enabled
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.rotate_bytes = rotate_bytes
+        self.rotate_interval = rotate_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._opened_at = 0.0
+        self.dedupe_size = dedupe_size
+        # Recent dedupe keys; only touched by record() (the caller's thread)
+        self._seen: OrderedDict[str, None] = OrderedDict()
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.write_failures = 0
+        self.duplicates = 0
+
+    def record(self, event: str, dedupe_key: Optional[str] = None, **fields) -> None:
+        """Queue one audit record (never blocks the caller); skipped if dedupe_key was recorded recently"""
+        if not self.enabled:
+            return
+        if dedupe_key is not None:
+            if dedupe_key in self._seen:
+                self.duplicates += 1
+                return
+            self._seen[dedupe_key] = None
+            while len(self._seen) > self.dedupe_size:
+                self._seen.popitem(last=False)
+        entry = {"ts": time.time(), "event": event, **fields}
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            log.error("audit.dropped", audit_event=event, queue_size=self._queue.maxsize)
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        self._open()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Write and fsync everything queued, then close the file"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        self._file = None
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    entry = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stop = True
+                    break
+                batch.append(entry)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch: list) -> None:
+        lines = []
+        for entry in batch:
+            created = entry["ts"]
+            entry["ts"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(created)) + f".{int(created % 1 * 1000):03d}Z"
+            lines.append(json.dumps(entry, default=str, ensure_ascii=False) + "\n")
+        data = "".join(lines).encode()
+        try:
+            if self._file.closed:
+                # A reopen after rotation failed; try again before writing
+                self._open()
+            if self._should_rotate():
+                self._rotate()
+            view = memoryview(data)
+            while view:
+                view = view[self._file.write(view):]
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except (OSError, ValueError) as e:
+            # ValueError: I/O on the closed file
+            self.write_failures += 1
+            log.error("audit.write_failed", path=self.path, records=len(batch), error=str(e))
+            return
+        self.written += len(batch)
+        self.batches += 1
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Unbuffered append-only handle: a batch goes out in as few write() calls as the OS allows
+        self._file = open(self.path, "ab", buffering=0)
+        self._opened_at = time.time()
+
+    def _should_rotate(self) -> bool:
+        if self.rotate_bytes and self._file.tell() >= self.rotate_bytes:
+            return True
+        return bool(self.rotate_interval) and time.time() - self._opened_at >= self.rotate_interval
+
+    def _rotate(self) -> None:
+        self._file.close()
+        stem, suffix = os.path.splitext(self.path)
+        stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        target = f"{stem}-{stamp}{suffix}"
+        n = 1
+        while os.path.exists(target):
+            target = f"{stem}-{stamp}.{n}{suffix}"
+            n += 1
+        try:
+            os.rename(self.path, target)
+            self.rotations += 1
+            log.info("audit.rotated", path=self.path, rotated_to=target)
+        finally:
+            # Keep appending (to the old file if the rename failed)
+            self._open()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+            "write_failures": self.write_failures,
+            "duplicates": self.duplicates,
+        }
@@ -0,0 +1,230 @@
+"""
+Thai Phung - Micro-benchmarks for the authentication path
+
+Times each piece of the per-call auth path in-process (no network):
+verify_jwt_token, validate_auth, get_request_context and the complete
+AuthMiddleware.on_call_tool around a no-op tool. Tokens cover valid, expired,
+malformed, bad-signature and wrong-tenant cases, with the verified-token cache
+both warm ("cached") and cleared before every call ("uncached").
+
+    python bench_auth.py --output auth.json
+    python bench_auth.py --baseline auth.json --max-regression 20
+"""
+
+import os
+
+# Quiet logs and no quotas: measure the auth work, not log I/O or rejections
+os.environ.setdefault("MCP_LOG_LEVEL", "ERROR")
+for _name in ("TENANT_RATE_LIMIT", "TENANT_MAX_IN_FLIGHT", "PRINCIPAL_RATE_LIMIT", "PRINCIPAL_MAX_IN_FLIGHT"):
+    os.environ.setdefault(_name, "0")
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from typing import Callable
+
+import jwt
+from fastmcp.exceptions import ToolError
+from fastmcp.server.http import _current_http_request
+from fastmcp.server.middleware import MiddlewareContext
+from fastmcp.tools.tool import ToolResult
+from mcp.types import CallToolRequestParams
+from starlette.requests import Request
+
+import server
+
+TENANT_ID = "test123"
+
+
+def make_tokens() -> dict[str, str]:
+    now = int(time.time())
+    return {
+        "valid": jwt.encode({"userId": "bench", "exp": now + 3600}, server.JWT_SECRET, algorithm="HS256"),
+        "expired": jwt.encode({"userId": "bench", "exp": now - 60}, server.JWT_SECRET, algorithm="HS256"),
+        "bad_signature": jwt.encode({"userId": "bench", "exp": now + 3600}, "wrong-secret", algorithm="HS256"),
+        "malformed": "not-a.jwt",
+    }
+
+
+def make_request(token: str, tenant_id: str) -> Request:
+    """Starlette request carrying the MCP auth headers"""
+    headers = [
+        (b"host", b"localhost:3005"),
+        (b"content-type", b"application/json"),
+        (b"accept", b"application/json, text/event-stream"),
+        (b"mcp-session-id", b"bench"),
+        (b"x-jwt-token", token.encode()),
+        (b"x-tenant-id", tenant_id.encode()),
+    ]
+    return Request({"type": "http", "method": "POST", "path": "/mcp", "headers": headers})
+
+
+def build_cases() -> list[tuple[str, Callable, bool]]:
+    """(name, callable, is_async) for every benchmark"""
+    tokens = make_tokens()
+    cases = []
+
+    for kind, token in tokens.items():
+        cases.append((f"verify_jwt_token[{kind},cached]", lambda t=token: server.verify_jwt_token(t), False))
+
+        def uncached(t=token):
+            server.token_cache.clear()
+            return server.verify_jwt_token(t)
+
+        cases.append((f"verify_jwt_token[{kind},uncached]", uncached, False))
+
+    for kind, token, tenant in (
+        ("valid", tokens["valid"], TENANT_ID),
+        ("expired", tokens["expired"], TENANT_ID),
+        ("malformed", tokens["malformed"], TENANT_ID),
+        ("wrong_tenant", tokens["valid"], "unknown-tenant"),
+        ("missing_token", "", TENANT_ID),
+    ):
+        cases.append((
+            f"validate_auth[{kind}]",
+            lambda t=token, tn=tenant: server.validate_auth(t, tn, "get_email"),
+            False,
+        ))
+
+    cases.append(("get_request_context", server.get_request_context, False))
+
+    # Full middleware around a no-op tool, and the no-op alone for reference
+    middleware = server.AuthMiddleware()
+    result = ToolResult(structured_content={"status": "success"})
+
+    async def noop(context):
+        return result
+
+    context = MiddlewareContext(
+        message=CallToolRequestParams(name="get_email", arguments={}), method="tools/call"
+    )
+    cases.append(("noop_tool", lambda: noop(context), True))
+    for kind, token, tenant in (
+        ("valid", tokens["valid"], TENANT_ID),
+        ("expired", tokens["expired"], TENANT_ID),
+        ("malformed", tokens["malformed"], TENANT_ID),
+        ("wrong_tenant", tokens["valid"], "unknown-tenant"),
+    ):
+        request = make_request(token, tenant)
+
+        async def call(request=request):
+            _current_http_request.set(request)
+            try:
+                return await middleware.on_call_tool(context, noop)
+            except ToolError:
+                return None
+
+        cases.append((f"auth_middleware[{kind}]", call, True))
+
+    # Synchronous cases (get_request_context) see the valid request; the
+    # middleware cases set their own request inside the benchmark task
+    _current_http_request.set(make_request(tokens["valid"], TENANT_ID))
+    return cases
+
+
+def time_sync(fn: Callable, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return time.perf_counter() - start
+
+
+def time_async(loop: asyncio.AbstractEventLoop, fn: Callable, number: int) -> float:
+    async def run() -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            await fn()
+        return time.perf_counter() - start
+
+    return loop.run_until_complete(run())
+
+
+def measure(loop, fn: Callable, is_async: bool, repeat: int, target: float) -> dict:
+    """timeit-style: calibrate the loop count to ~target seconds, then repeat"""
+    timer = (lambda n: time_async(loop, fn, n)) if is_async else (lambda n: time_sync(fn, n))
+    number = 1
+    while True:
+        elapsed = timer(number)
+        if elapsed >= target / 10 or number >= 10_000_000:
+            break
+        number *= 10
+    number = max(1, int(number * target / max(elapsed, 1e-9)))
+    per_call = [timer(number) / number * 1e9 for _ in range(repeat)]
+    return {
+        "ns_per_call": statistics.median(per_call),
+        "min_ns": min(per_call),
+        "stdev_ns": statistics.stdev(per_call) if len(per_call) > 1 else 0.0,
+        "calls_per_second": 1e9 / statistics.median(per_call),
+        "loops": number,
+    }
+
+
+def compare(results: dict, baseline: dict, max_regression) -> bool:
+    """Print the change vs baseline; return False if a case got slower than allowed"""
+    ok = True
+    print(f"\n{'benchmark':<44} {'baseline ns':>12} {'current ns':>12} {'change':>9}")
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        before, after = base["ns_per_call"], stats["ns_per_call"]
+        change = (after - before) / before * 100.0 if before else 0.0
+        flag = ""
+        if max_regression is not None and change > max_regression:
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{name:<44} {before:>12.0f} {after:>12.0f} {change:>8.1f}%{flag}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark (median reported)")
+    parser.add_argument("--target", type=float, default=0.2, help="Seconds per timed run")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against a previous --output file")
+    parser.add_argument("--max-regression", type=float, help="Exit 1 if a case is this %% slower than the baseline")
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    results = {}
+    print(f"{'benchmark':<44} {'ns/call':>10} {'min ns':>10} {'calls/s':>12}")
+    for name, fn, is_async in build_cases():
+        if args.filter not in name:
+            continue
+        stats = measure(loop, fn, is_async, args.repeat, args.target)
+        results[name] = stats
+        print(f"{name:<44} {stats['ns_per_call']:>10.0f} {stats['min_ns']:>10.0f} {stats['calls_per_second']:>12.0f}")
+    loop.close()
+
+    if "noop_tool" in results:
+        base = results["noop_tool"]["ns_per_call"]
+        print("\nAuthMiddleware overhead over a no-op tool:")
+        for name, stats in results.items():
+            if name.startswith("auth_middleware["):
+                print(f"  {name:<42} {stats['ns_per_call'] - base:>10.0f} ns")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "python": sys.version.split()[0],
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        if not compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
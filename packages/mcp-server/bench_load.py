@@ -0,0 +1,334 @@
+"""
+Thai Phung - Concurrent load test for the MCP Server
+
+Starts bench_upstream.py (upstream stand-in) and server.py, opens N
+streamable-HTTP MCP sessions with X-JWT-TOKEN / X-TENANT-ID headers (one
+principal per session) and drives a weighted mix of get_email, change_email
+(request + confirm, timed together) and get_chart calls at a fixed target rate. Calls are scheduled open-loop,
+and latency is measured from each call's scheduled start, so a slow server
+shows up as latency instead of quietly lowering the offered load.
+
+Prints throughput, p50/p95/p99 latency and error rates per tool, optionally
+saves them as JSON and compares them with a previous run:
+
+    python bench_load.py --sessions 32 --rate 200 --duration 30 --output baseline.json
+    python bench_load.py --sessions 32 --rate 200 --duration 30 --baseline baseline.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import httpx
+from fastmcp import Client
+from fastmcp.client.transports import StreamableHttpTransport
+
+from bench_workers import HERE, TENANT_ID, make_token, start_server, wait_until_ready
+
+DEFAULT_MIX = "get_email=70,change_email=20,get_chart=10"
+# Summary keys where a higher value is better (everything else: lower is better)
+HIGHER_IS_BETTER = {"throughput"}
+COMPARED_KEYS = ("throughput", "error_rate", "p50", "p95", "p99")
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    """Parse "tool=weight,tool=weight" into a dict"""
+    mix = {}
+    for item in spec.split(","):
+        tool, _, weight = item.partition("=")
+        if tool.strip():
+            mix[tool.strip()] = float(weight or 1)
+    return mix
+
+
+def make_arguments(tool: str, rng: random.Random, accounts: int, seq: int) -> dict:
+    account_id = str(10000 + rng.randrange(accounts))
+    if tool == "get_email":
+        return {"account_id": account_id}
+    if tool == "change_email":
+        return {"account_id": account_id, "new_email": f"load{seq}@example.com"}
+    return {}
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: list[float], errors: int, seconds: float) -> dict:
+    values = sorted(latencies)
+    total = len(values) + errors
+    return {
+        "requests": total,
+        "ok": len(values),
+        "errors": errors,
+        "error_rate": errors / total if total else 0.0,
+        "throughput": len(values) / seconds if seconds else 0.0,
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else 0.0,
+    }
+
+
+class LoadRecorder:
+    """Latencies of successful calls and error counts per tool"""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.error_kinds: dict[str, int] = {}
+
+    def ok(self, tool: str, latency: float) -> None:
+        self.latencies.setdefault(tool, []).append(latency)
+
+    def error(self, tool: str, kind: str) -> None:
+        self.errors[tool] = self.errors.get(tool, 0) + 1
+        self.error_kinds[kind] = self.error_kinds.get(kind, 0) + 1
+
+    def report(self, seconds: float) -> dict:
+        tools = sorted(set(self.latencies) | set(self.errors))
+        every = [v for values in self.latencies.values() for v in values]
+        return {
+            "summary": summarize(every, sum(self.errors.values()), seconds),
+            "tools": {
+                tool: summarize(self.latencies.get(tool, []), self.errors.get(tool, 0), seconds)
+                for tool in tools
+            },
+            "error_kinds": dict(sorted(self.error_kinds.items())),
+        }
+
+
+async def call_once(
+    client: Client, tool: str, arguments: dict, scheduled: float, timeout: float, recorder: LoadRecorder
+) -> None:
+    try:
+        result = await asyncio.wait_for(
+            client.call_tool(tool, arguments, raise_on_error=False), timeout
+        )
+        # change_email is two round trips: request the change, then confirm its token
+        token = (result.structured_content or {}).get("confirmation_token")
+        if tool == "change_email" and token:
+            result = await asyncio.wait_for(
+                client.call_tool(
+                    tool, {"confirmation_token": token, "user_confirmation": "Y"}, raise_on_error=False
+                ),
+                timeout,
+            )
+    except asyncio.TimeoutError:
+        recorder.error(tool, "timeout")
+        return
+    except Exception as e:
+        recorder.error(tool, type(e).__name__)
+        return
+    latency = time.perf_counter() - scheduled
+    structured = result.structured_content or {}
+    if result.is_error:
+        recorder.error(tool, structured.get("error", "tool_error"))
+    elif structured.get("status") == "error":
+        recorder.error(tool, "status_error")
+    else:
+        recorder.ok(tool, latency)
+
+
+async def drive(
+    clients: list[Client],
+    mix: dict[str, float],
+    rate: float,
+    duration: float,
+    accounts: int,
+    timeout: float,
+    rng: random.Random,
+) -> tuple[LoadRecorder, float]:
+    """Open-loop load: one call every 1/rate seconds, round-robin over sessions"""
+    recorder = LoadRecorder()
+    tools, weights = list(mix), list(mix.values())
+    tasks = []
+    start = time.perf_counter()
+    seq = 0
+    while True:
+        scheduled = start + seq / rate
+        if scheduled - start >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tool = rng.choices(tools, weights)[0]
+        arguments = make_arguments(tool, rng, accounts, seq)
+        client = clients[seq % len(clients)]
+        tasks.append(asyncio.create_task(
+            call_once(client, tool, arguments, scheduled, timeout, recorder)
+        ))
+        seq += 1
+    await asyncio.gather(*tasks)
+    return recorder, time.perf_counter() - start
+
+
+async def wait_for_url(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def compare(current: dict, baseline: dict, max_regression: Optional[float]) -> bool:
+    """Print current vs baseline; return False if a metric regressed past max_regression %"""
+    ok = True
+    print(f"\n{'compare':<22} {'metric':>10} {'baseline':>12} {'current':>12} {'change':>9}")
+    sections = [("all", current["summary"], baseline.get("summary", {}))]
+    sections += [
+        (tool, stats, baseline.get("tools", {}).get(tool, {}))
+        for tool, stats in current["tools"].items()
+    ]
+    for name, stats, base in sections:
+        for key in COMPARED_KEYS:
+            if key not in base:
+                continue
+            before, after = base[key], stats[key]
+            if before:
+                change = (after - before) / before * 100.0
+            else:
+                change = 0.0 if not after else float("inf")
+            worse = -change if key in HIGHER_IS_BETTER else change
+            flag = ""
+            if max_regression is not None and key != "error_rate" and worse > max_regression:
+                flag = "  REGRESSION"
+                ok = False
+            print(f"{name:<22} {key:>10} {before:>12.4f} {after:>12.4f} {change:>8.1f}%{flag}")
+    return ok
+
+
+def print_report(report: dict) -> None:
+    print(f"\n{'tool':<16} {'requests':>9} {'ok/s':>9} {'err%':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = list(report["tools"].items()) + [("all", report["summary"])]
+    for tool, s in rows:
+        print(
+            f"{tool:<16} {s['requests']:>9} {s['throughput']:>9.1f} {s['error_rate'] * 100:>6.2f}% "
+            f"{s['p50'] * 1000:>9.2f} {s['p95'] * 1000:>9.2f} {s['p99'] * 1000:>9.2f}"
+        )
+    if report["error_kinds"]:
+        print("errors:", ", ".join(f"{k}={v}" for k, v in report["error_kinds"].items()))
+
+
+async def run(args: argparse.Namespace) -> dict:
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    url = f"http://localhost:{args.port}/mcp"
+    processes = []
+    try:
+        if not args.no_start:
+            upstream = f"http://localhost:{args.upstream_port}"
+            processes.append(subprocess.Popen(
+                [
+                    sys.executable, "bench_upstream.py",
+                    "--port", str(args.upstream_port),
+                    "--latency", str(args.upstream_latency),
+                    "--jitter", str(args.upstream_jitter),
+                    "--slow-fraction", str(args.upstream_slow_fraction),
+                    "--slow-latency", str(args.upstream_slow_latency),
+                ],
+                cwd=HERE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            ))
+            await wait_for_url(upstream)
+            processes.append(start_server(args.workers, args.port, {"API_BASE_URL": upstream}))
+        await wait_until_ready(args.port)
+
+        async with contextlib.AsyncExitStack() as stack:
+            clients = []
+            for i in range(args.sessions):
+                transport = StreamableHttpTransport(
+                    url,
+                    headers={"X-JWT-TOKEN": make_token(f"load-{i}"), "X-TENANT-ID": args.tenant},
+                )
+                clients.append(await stack.enter_async_context(Client(transport, timeout=args.timeout)))
+
+            if args.warmup > 0:
+                await drive(clients, mix, args.rate, args.warmup, args.accounts, args.timeout, rng)
+            recorder, elapsed = await drive(
+                clients, mix, args.rate, args.duration, args.accounts, args.timeout, rng
+            )
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait(timeout=15)
+
+    report = recorder.report(elapsed)
+    report["config"] = {
+        "sessions": args.sessions,
+        "rate": args.rate,
+        "duration": args.duration,
+        "mix": mix,
+        "workers": args.workers,
+        "upstream_latency": args.upstream_latency,
+        "upstream_slow_fraction": args.upstream_slow_fraction,
+        "accounts": args.accounts,
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=16, help="Concurrent MCP sessions")
+    parser.add_argument("--rate", type=float, default=100.0, help="Target calls/second (all sessions)")
+    parser.add_argument("--duration", type=float, default=20.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Unmeasured seconds before the run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Tool weights (default {DEFAULT_MIX})")
+    parser.add_argument("--accounts", type=int, default=1000, help="Distinct account IDs to spread calls over")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-call timeout (seconds)")
+    parser.add_argument("--workers", type=int, default=1, help="server.py --workers")
+    parser.add_argument("--port", type=int, default=3105)
+    parser.add_argument("--upstream-port", type=int, default=3106)
+    parser.add_argument("--upstream-latency", type=float, default=0.005)
+    parser.add_argument("--upstream-jitter", type=float, default=0.002)
+    parser.add_argument("--upstream-slow-fraction", type=float, default=0.0, help="Share of slow upstream requests")
+    parser.add_argument("--upstream-slow-latency", type=float, default=0.5)
+    parser.add_argument("--tenant", default=TENANT_ID)
+    parser.add_argument("--no-start", action="store_true", help="Use a server already running on --port")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against a previous --output file")
+    parser.add_argument(
+        "--max-regression", type=float, help="Exit 1 if throughput or a latency percentile is this %% worse than the baseline"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"sessions: {args.sessions}  rate: {args.rate:g}/s  duration: {args.duration:g}s  "
+        f"mix: {args.mix}  workers: {args.workers}"
+    )
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
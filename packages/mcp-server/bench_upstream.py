@@ -0,0 +1,126 @@
+"""
+Thai Phung - Local upstream stand-in for the MCP Server benchmarks
+
+Implements the API Server endpoints the tools call (/get_email,
+/change_email, /change_emails, /token) with configurable latency, without JWT or tenant
+checks, so a benchmark measures the MCP server rather than the upstream.
+
+    python bench_upstream.py --port 3106 --latency 0.005 --jitter 0.002
+
+--slow-fraction / --slow-latency make a share of requests much slower, like
+an occasional slow upstream instance (the tail that hedging targets).
+"""
+
+import argparse
+import asyncio
+import random
+import re
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+ACCOUNT_ID_PATTERN = re.compile(r"^\d{5,10}$")
+EMAIL_PATTERN = re.compile(r"^[^\s@]+@[^\s@]+\.[^\s@]+$")
+
+
+def create_app(
+    latency: float = 0.0, jitter: float = 0.0, slow_fraction: float = 0.0, slow_latency: float = 0.0
+) -> Starlette:
+    emails: dict[str, str] = {}
+
+    async def delay() -> None:
+        if slow_fraction and random.random() < slow_fraction:
+            await asyncio.sleep(slow_latency)
+        elif latency or jitter:
+            await asyncio.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+
+    async def root(request: Request) -> JSONResponse:
+        return JSONResponse({"message": "ok"})
+
+    async def get_email(request: Request) -> JSONResponse:
+        await delay()
+        account_id = request.path_params["account_id"]
+        if not ACCOUNT_ID_PATTERN.match(account_id):
+            return JSONResponse({"message": "Invalid account_id. Must be 5-10 digits"}, 400)
+        return JSONResponse({
+            "message": "Email retrieved successfully",
+            "account_id": account_id,
+            "email": emails.get(account_id, "user@example.com"),
+        })
+
+    async def change_email(request: Request) -> JSONResponse:
+        await delay()
+        body = await request.json()
+        account_id, new_email = body.get("account_id", ""), body.get("new_email", "")
+        if not ACCOUNT_ID_PATTERN.match(account_id):
+            return JSONResponse({"message": "Invalid account_id. Must be 5-10 digits"}, 400)
+        if not EMAIL_PATTERN.match(new_email):
+            return JSONResponse({"message": "Invalid email format"}, 400)
+        old_email = emails.get(account_id, "user@example.com")
+        emails[account_id] = new_email
+        return JSONResponse({
+            "message": "Email changed successfully",
+            "account_id": account_id,
+            "old_email": old_email,
+            "new_email": new_email,
+        })
+
+    async def change_emails(request: Request) -> JSONResponse:
+        await delay()
+        results = []
+        for change in (await request.json()).get("changes", []):
+            account_id, new_email = change.get("account_id", ""), change.get("new_email", "")
+            if not ACCOUNT_ID_PATTERN.match(account_id):
+                results.append({"account_id": account_id, "status": "error", "message": "Invalid account_id. Must be 5-10 digits"})
+            elif not EMAIL_PATTERN.match(new_email):
+                results.append({"account_id": account_id, "status": "error", "message": "Invalid email format"})
+            else:
+                old_email = emails.get(account_id, "user@example.com")
+                emails[account_id] = new_email
+                results.append({
+                    "account_id": account_id, "status": "success", "old_email": old_email, "new_email": new_email,
+                })
+        succeeded = sum(1 for r in results if r["status"] == "success")
+        return JSONResponse({
+            "message": "Batch processed",
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "results": results,
+        })
+
+    async def token(request: Request) -> JSONResponse:
+        await delay()
+        return JSONResponse({
+            "access_token": f"bench-{int(time.time())}",
+            "token_type": "Bearer",
+            "expires_in": 3600,
+        })
+
+    return Starlette(routes=[
+        Route("/", root),
+        Route("/get_email/{account_id}", get_email),
+        Route("/change_email", change_email, methods=["POST"]),
+        Route("/change_emails", change_emails, methods=["POST"]),
+        Route("/token", token, methods=["POST"]),
+    ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=3106)
+    parser.add_argument("--latency", type=float, default=0.0, help="Added delay per request (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter on the delay (seconds)")
+    parser.add_argument("--slow-fraction", type=float, default=0.0, help="Share of requests that are slow (0-1)")
+    parser.add_argument("--slow-latency", type=float, default=0.5, help="Delay of a slow request (seconds)")
+    args = parser.parse_args()
+    app = create_app(args.latency, args.jitter, args.slow_fraction, args.slow_latency)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
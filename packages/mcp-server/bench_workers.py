@@ -0,0 +1,138 @@
+"""
+Thai Phung - Throughput benchmark for multi-worker mode
+
+Starts `server.py --workers N` for each requested worker count, drives it
+with concurrent MCP sessions for a fixed duration and prints calls/second
+and the speedup over the first run.
+
+    python bench_workers.py --workers 1 2 4 --concurrency 64 --duration 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import httpx
+import jwt
+from fastmcp import Client
+from fastmcp.client.transports import StreamableHttpTransport
+
+from server import JWT_SECRET
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TENANT_ID = "test123"
+
+
+def make_token(user_id: str = "bench") -> str:
+    """Mint a short-lived JWT with the server's secret (no API server needed)"""
+    return jwt.encode(
+        {"userId": user_id, "exp": int(time.time()) + 3600}, JWT_SECRET, algorithm="HS256"
+    )
+
+
+def start_server(workers: int, port: int, env_overrides: Optional[dict] = None) -> subprocess.Popen:
+    env = dict(os.environ, MCP_LOG_LEVEL=os.environ.get("MCP_LOG_LEVEL", "WARNING"))
+    # One principal drives all sessions: lift the quotas unless set explicitly
+    for name in ("TENANT_RATE_LIMIT", "TENANT_MAX_IN_FLIGHT", "PRINCIPAL_RATE_LIMIT", "PRINCIPAL_MAX_IN_FLIGHT"):
+        env.setdefault(name, "0")
+    env.update(env_overrides or {})
+    return subprocess.Popen(
+        [sys.executable, "server.py", "--workers", str(workers), "--port", str(port)],
+        cwd=HERE,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_until_ready(port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                response = await client.get(f"http://localhost:{port}/metrics")
+                if response.status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start within {timeout}s")
+
+
+async def run_load(port: int, tool: str, arguments: dict, concurrency: int, duration: float) -> dict:
+    """Closed-loop load: `concurrency` sessions calling `tool` back to back"""
+    token = make_token()
+    url = f"http://localhost:{port}/mcp"
+    ok = 0
+    errors = 0
+
+    async def session_loop(deadline: float) -> None:
+        nonlocal ok, errors
+        transport = StreamableHttpTransport(
+            url, headers={"X-JWT-TOKEN": token, "X-TENANT-ID": TENANT_ID}
+        )
+        async with Client(transport) as client:
+            while time.monotonic() < deadline:
+                try:
+                    result = await client.call_tool(tool, arguments, raise_on_error=False)
+                    if result.is_error:
+                        errors += 1
+                    else:
+                        ok += 1
+                except Exception:
+                    errors += 1
+
+    # Warm up each worker's pools before measuring
+    await asyncio.gather(*(session_loop(time.monotonic() + 1.0) for _ in range(concurrency)))
+    ok = errors = 0
+
+    start = time.monotonic()
+    await asyncio.gather(*(session_loop(start + duration) for _ in range(concurrency)))
+    elapsed = time.monotonic() - start
+    return {"calls": ok, "errors": errors, "seconds": elapsed, "throughput": ok / elapsed}
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=3105)
+    parser.add_argument("--tool", default="get_chart", help="get_chart (no upstream) or get_email")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    arguments = {"account_id": "12345"} if args.tool == "get_email" else {}
+    print(f"CPU cores: {os.cpu_count()}  tool: {args.tool}  concurrency: {args.concurrency}")
+    print(f"{'workers':>8} {'calls':>8} {'errors':>7} {'calls/s':>10} {'speedup':>8}")
+
+    results = []
+    for workers in args.workers:
+        server = start_server(workers, args.port)
+        try:
+            await wait_until_ready(args.port)
+            result = await run_load(args.port, args.tool, arguments, args.concurrency, args.duration)
+        finally:
+            server.terminate()
+            server.wait(timeout=15)
+        result["workers"] = workers
+        baseline = results[0]["throughput"] if results else result["throughput"]
+        result["speedup"] = result["throughput"] / baseline if baseline else 0.0
+        results.append(result)
+        print(
+            f"{workers:>8} {result['calls']:>8} {result['errors']:>7} "
+            f"{result['throughput']:>10.1f} {result['speedup']:>7.2f}x"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"cpu_count": os.cpu_count(), "tool": args.tool, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+"""
+Thai Phung - Hedged requests for idempotent upstream reads
+
+`Hedger.run` starts the request and, if it has not answered within the
+HEDGE_PERCENTILE of recent latencies, sends a second copy (to another
+replica when one is configured). The first answer wins and the other
+attempt is cancelled. An attempt that fails does not win while the other is
+still running.
+
+Hedges are drawn from a budget of HEDGE_BUDGET_RATIO x requests over a
+sliding window (the same accounting as the upstream retry budget), so
+hedging adds at most that fraction of load, even when the whole upstream is
+slow rather than one instance.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from resilience import RetryBudget
+
+# Configuration
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.005"))
+HEDGE_MAX_DELAY = float(os.environ.get("HEDGE_MAX_DELAY", "2"))
+# No hedging until this many latencies have been observed
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "50"))
+# Latencies kept for the percentile (most recent first out)
+HEDGE_WINDOW_SAMPLES = int(os.environ.get("HEDGE_WINDOW_SAMPLES", "1000"))
+HEDGE_BUDGET_RATIO = float(os.environ.get("HEDGE_BUDGET_RATIO", "0.05"))
+HEDGE_BUDGET_MIN_PER_SECOND = float(os.environ.get("HEDGE_BUDGET_MIN_PER_SECOND", "0"))
+HEDGE_BUDGET_WINDOW = float(os.environ.get("HEDGE_BUDGET_WINDOW", "10"))
+
+# Recompute the percentile after this many new samples
+_REFRESH_EVERY = 20
+
+T = TypeVar("T")
+
+
+class Hedger:
+    """Percentile-delayed hedging with a budget, for one kind of request"""
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float = HEDGE_PERCENTILE,
+        min_delay: float = HEDGE_MIN_DELAY,
+        max_delay: float = HEDGE_MAX_DELAY,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+        window_samples: int = HEDGE_WINDOW_SAMPLES,
+        budget_ratio: float = HEDGE_BUDGET_RATIO,
+        budget_min_per_second: float = HEDGE_BUDGET_MIN_PER_SECOND,
+        budget_window: float = HEDGE_BUDGET_WINDOW,
+    ):
+        self.name = name
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.budget = RetryBudget(budget_ratio, budget_min_per_second, budget_window)
+        self._samples: deque = deque(maxlen=window_samples)
+        self._since_refresh = 0
+        self._delay: Optional[float] = None
+        self.requests = 0
+        self.hedged = 0
+        # Hedges that answered first
+        self.hedge_wins = 0
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None while there are too few samples"""
+        return self._delay
+
+    def observe(self, latency: float) -> None:
+        self._samples.append(latency)
+        self._since_refresh += 1
+        if len(self._samples) >= self.min_samples and (
+            self._delay is None or self._since_refresh >= _REFRESH_EVERY
+        ):
+            ordered = sorted(self._samples)
+            index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+            self._delay = max(self.min_delay, min(self.max_delay, ordered[index]))
+            self._since_refresh = 0
+
+    async def run(
+        self,
+        primary: Callable[[], Awaitable[T]],
+        hedge: Callable[[], Awaitable[T]],
+    ) -> T:
+        """Result of primary(), or of hedge() if that answers first"""
+        self.requests += 1
+        self.budget.record_request()
+        start = time.perf_counter()
+        first = asyncio.ensure_future(primary())
+        tasks = [first]
+        try:
+            delay = self._delay
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+            if first.done() or delay is None or not self.budget.try_withdraw():
+                return await first
+            self.hedged += 1
+            tasks.append(asyncio.ensure_future(hedge()))
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in tasks:
+                    if task in done and task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                if not pending:
+                    # Both failed: report the primary's error
+                    return first.result()
+        finally:
+            # The primary's latency, or how long it had run when the hedge won
+            self.observe(time.perf_counter() - start)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "delay": self._delay,
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "budget_exhausted": self.budget.exhausted,
+        }
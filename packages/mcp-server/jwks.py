@@ -0,0 +1,133 @@
+"""
+Thai Phung - JWKS key set for asymmetric JWT verification
+
+Public keys are fetched from a JWKS URL, kept in memory by `kid` and
+refreshed by a background task, so verifying a token never waits on the
+network. A token signed with an unknown `kid` (key rotation) triggers one
+coalesced, rate-limited refetch; everything else is a dict lookup.
+"""
+
+import asyncio
+import os
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+import jwt
+
+from mcp_logging import get_logger
+from singleflight import SingleFlight
+from upstream import UpstreamError, get_gateway
+
+log = get_logger("jwks")
+
+# Configuration
+# e.g. http://localhost:3006/.well-known/jwks.json (empty: JWKS disabled)
+JWKS_URL = os.environ.get("JWKS_URL", "")
+JWKS_REFRESH_INTERVAL = float(os.environ.get("JWKS_REFRESH_INTERVAL", "300"))
+# Minimum seconds between fetches triggered by an unknown kid
+JWKS_MIN_REFETCH_INTERVAL = float(os.environ.get("JWKS_MIN_REFETCH_INTERVAL", "30"))
+
+ASYMMETRIC_ALGORITHMS = ("RS256", "RS384", "RS512", "ES256", "ES384", "ES512", "PS256")
+
+
+class JWKSKeySet:
+    """In-memory JWKS, refreshed in the background and on unknown kids"""
+
+    def __init__(
+        self,
+        url: str = JWKS_URL,
+        refresh_interval: float = JWKS_REFRESH_INTERVAL,
+        min_refetch_interval: float = JWKS_MIN_REFETCH_INTERVAL,
+    ):
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.min_refetch_interval = min_refetch_interval
+        parts = urlsplit(url)
+        self._base_url = f"{parts.scheme}://{parts.netloc}"
+        self._path = parts.path + (f"?{parts.query}" if parts.query else "") or "/"
+        self._keys: dict[str, jwt.PyJWK] = {}
+        self._flight = SingleFlight("jwks")
+        self._task: Optional[asyncio.Task] = None
+        self.fetched_at = 0.0
+        self.fetches = 0
+        self.fetch_failures = 0
+        self.refetches_skipped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.url)
+
+    def get_key(self, kid: Optional[str]) -> Optional[jwt.PyJWK]:
+        """Key for kid; a token without kid matches only a single-key set"""
+        if kid is None:
+            if len(self._keys) == 1:
+                return next(iter(self._keys.values()))
+            return None
+        return self._keys.get(kid)
+
+    async def refresh(self) -> None:
+        """Fetch the JWKS once (concurrent callers share the fetch)"""
+        await self._flight.do("jwks", self._fetch)
+
+    async def _fetch(self) -> None:
+        self.fetches += 1
+        try:
+            status, body = await get_gateway(self._base_url).get(self._path, endpoint="jwks", observe=False)
+            if status != 200:
+                raise UpstreamError(f"JWKS fetch returned HTTP {status}")
+            keys = {}
+            for jwk in jwt.PyJWKSet.from_dict(body).keys:
+                if jwk.key_id:
+                    keys[jwk.key_id] = jwk
+        except (httpx.HTTPError, UpstreamError, jwt.PyJWKSetError) as e:
+            # Keep serving the previous keys; the next refresh retries
+            self.fetch_failures += 1
+            log.warning("jwks.fetch_failed", url=self.url, error=str(e))
+            return
+        finally:
+            self.fetched_at = time.monotonic()
+        # Swap the whole dict so concurrent lookups never see a partial set
+        self._keys = keys
+        log.info("jwks.refreshed", url=self.url, kids=sorted(keys))
+
+    async def ensure_kid(self, kid: Optional[str]) -> bool:
+        """Make sure kid is loaded, refetching at most once per min interval"""
+        if self.get_key(kid) is not None:
+            return True
+        if time.monotonic() - self.fetched_at < self.min_refetch_interval:
+            self.refetches_skipped += 1
+            return False
+        log.info("jwks.unknown_kid", kid=kid)
+        await self.refresh()
+        return self.get_key(kid) is not None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    async def start(self) -> None:
+        """Load the keys and start the background refresh task"""
+        if not self.enabled or self._task is not None:
+            return
+        await self.refresh()
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._keys),
+            "fetches": self.fetches,
+            "fetch_failures": self.fetch_failures,
+            "refetches_skipped": self.refetches_skipped,
+        }
@@ -0,0 +1,184 @@
+"""
+Thai Phung - Non-blocking structured logging for the MCP Server
+
+Tool calls and middleware hand log records to a queue; a background
+QueueListener thread redacts credentials, renders one JSON object per line
+and writes it to stderr. The hot path only pays for a level check, an
+optional sampling decision and a queue put.
+
+    log = get_logger("server")
+    log.info("get_email.called", account_id=account_id)
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+from typing import Any, Optional
+
+# Configuration
+MCP_LOG_LEVEL = os.environ.get("MCP_LOG_LEVEL", "INFO").upper()
+# Per-event sampling, e.g. "get_email.called=0.1,upstream.request=0.01"
+MCP_LOG_SAMPLE = os.environ.get("MCP_LOG_SAMPLE", "")
+
+REDACTED = "[REDACTED]"
+# Field / header names whose values are never written to the log
+SENSITIVE_KEYS = {
+    "x-jwt-token",
+    "authorization",
+    "jwt_token",
+    "token",
+    "access_token",
+    "client_secret",
+    "cookie",
+}
+_BEARER_PATTERN = re.compile(r"(?i)\b(bearer|basic)\s+[A-Za-z0-9._~+/=-]+")
+_JWT_PATTERN = re.compile(r"\beyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*")
+
+ROOT_LOGGER = "mcp_server"
+
+
+def redact(value: Any, key: Optional[str] = None) -> Any:
+    """Return a copy of value with credentials removed"""
+    if key is not None and key.lower() in SENSITIVE_KEYS:
+        return REDACTED
+    if isinstance(value, dict):
+        return {k: redact(v, str(k)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        value = _BEARER_PATTERN.sub(lambda m: f"{m.group(1)} {REDACTED}", value)
+        return _JWT_PATTERN.sub(REDACTED, value)
+    return value
+
+
+def parse_sample_rates(spec: str) -> dict[str, float]:
+    """Parse "event=rate,event=rate" into a dict"""
+    rates = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        event, rate = item.split("=", 1)
+        try:
+            rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of records for configured events (warnings always pass)"""
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.msg)
+        return rate is None or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One redacted JSON object per record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(redact(fields))
+        if record.exc_info:
+            entry["exc"] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _EnqueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers all formatting to the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class EventLogger:
+    """Thin wrapper: log.info("event.name", key=value, ...)"""
+
+    __slots__ = ("_logger",)
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def _log(self, level: int, event: str, fields: dict, exc_info: bool = False) -> None:
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={"fields": fields}, exc_info=exc_info)
+
+    def is_enabled(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def debug(self, event: str, **fields) -> None:
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields) -> None:
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields) -> None:
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields) -> None:
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields) -> None:
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: str = MCP_LOG_LEVEL, sample: str = MCP_LOG_SAMPLE) -> None:
+    """Attach the queue handler and start the background writer (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level)
+    root.propagate = False
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    enqueue = _EnqueueHandler(log_queue)
+    rates = parse_sample_rates(sample)
+    if rates:
+        enqueue.addFilter(SamplingFilter(rates))
+    root.addHandler(enqueue)
+
+    writer = logging.StreamHandler(sys.stderr)
+    writer.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, writer)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the background writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> EventLogger:
+    """Structured logger under the "mcp_server" namespace (sets up logging on first use)"""
+    setup_logging()
+    return EventLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
@@ -0,0 +1,234 @@
+"""
+Thai Phung - In-process metrics for the MCP Server
+
+Minimal counters, gauges and histograms rendered in the Prometheus text
+exposition format (served on /metrics by server.py). Metrics are
+per-process; with several workers each worker reports its own series.
+"""
+
+import math
+import threading
+from typing import Callable, Iterable, Optional
+
+# Latency buckets in seconds (tool calls and upstream requests)
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+            for key, v in items
+        ]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            base = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{base} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{base} {state[-1]}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Value read from a callback at scrape time (e.g. cache stats)"""
+
+    def __init__(self, name: str, help: str, type_name: str, callback: Callable[[], float]):
+        super().__init__(name, help)
+        self.type_name = type_name
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        return [f"{self.name} {_format_value(float(self.callback()))}"]
+
+
+class Registry:
+    """Ordered collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        buckets: Optional[Iterable[float]] = None,
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets or DEFAULT_BUCKETS))
+
+    def callback(
+        self, name: str, help: str, callback: Callable[[], float], type_name: str = "gauge"
+    ) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, type_name, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Tool calls (recorded by MetricsMiddleware in server.py)
+TOOL_CALLS = REGISTRY.counter(
+    "mcp_tool_calls_total", "MCP tool calls by tool and outcome", ("tool", "outcome")
+)
+TOOL_DURATION = REGISTRY.histogram(
+    "mcp_tool_duration_seconds", "MCP tool call latency including middleware", ("tool",)
+)
+TOOL_IN_FLIGHT = REGISTRY.gauge("mcp_tool_in_flight", "MCP tool calls currently executing")
+AUTH_FAILURES = REGISTRY.counter(
+    "mcp_auth_failures_total", "Rejected tool calls by validate_auth reason", ("reason",)
+)
+QUOTA_REJECTIONS = REGISTRY.counter(
+    "mcp_quota_rejections_total",
+    "Tool calls rejected by rate / concurrency quotas",
+    ("scope", "limit"),
+)
+
+# Upstream API calls (recorded by upstream.UpstreamGateway)
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    "mcp_upstream_requests_total",
+    "Upstream API requests by endpoint and HTTP status",
+    ("method", "endpoint", "status"),
+)
+UPSTREAM_DURATION = REGISTRY.histogram(
+    "mcp_upstream_duration_seconds",
+    "Upstream API request latency",
+    ("method", "endpoint"),
+)
+UPSTREAM_RETRIES = REGISTRY.counter(
+    "mcp_upstream_retries_total",
+    "Upstream request attempts that were retried",
+    ("method", "endpoint"),
+)
+UPSTREAM_SHORT_CIRCUITS = REGISTRY.counter(
+    "mcp_upstream_short_circuits_total",
+    "Upstream requests failed fast because the endpoint's circuit was open",
+    ("method", "endpoint"),
+)
+UPSTREAM_CIRCUIT_STATE = REGISTRY.gauge(
+    "mcp_upstream_circuit_state",
+    "Circuit breaker state per upstream endpoint (0 closed, 1 half-open, 2 open)",
+    ("base_url", "method", "endpoint"),
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
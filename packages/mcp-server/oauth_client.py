@@ -0,0 +1,152 @@
+"""
+Thai Phung - OAuth 2.1 Client Credentials token manager for upstream calls
+
+When UPSTREAM_AUTH_MODE is "client_credentials" the MCP Server obtains its own
+access tokens from the Authorization Server instead of forwarding the caller's
+x-jwt-token. Tokens are cached in memory per (tenant, audience, scope),
+refreshed ahead of expiry, and each refresh is single-flight: concurrent
+callers share one in-flight token request.
+"""
+
+import asyncio
+import base64
+import os
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from mcp_logging import get_logger
+from singleflight import SingleFlight
+from upstream import get_gateway, UpstreamError
+
+log = get_logger("oauth")
+
+# Configuration
+UPSTREAM_AUTH_MODE = os.environ.get("UPSTREAM_AUTH_MODE", "forward")  # forward | client_credentials
+OAUTH_TOKEN_URL = os.environ.get("OAUTH_TOKEN_URL", "http://localhost:3006/token")
+OAUTH_CLIENT_ID = os.environ.get("OAUTH_CLIENT_ID", "mcp-server")
+OAUTH_CLIENT_SECRET = os.environ.get("OAUTH_CLIENT_SECRET", "mcp-server-secret")
+OAUTH_AUDIENCE = os.environ.get("OAUTH_AUDIENCE", "") or None
+OAUTH_SCOPE = os.environ.get("OAUTH_SCOPE", "email:read email:write")
+# Refresh when less than this many seconds (or 20% of the lifetime) remain
+OAUTH_REFRESH_SKEW = float(os.environ.get("OAUTH_REFRESH_SKEW", "60"))
+
+
+class TokenRequestError(Exception):
+    """Raised when the Authorization Server does not issue a token"""
+
+
+class CachedToken:
+    """An access token plus the times at which it should be refreshed / dropped"""
+
+    __slots__ = ("access_token", "expires_at", "refresh_at")
+
+    def __init__(self, access_token: str, expires_in: float, skew: float):
+        now = time.time()
+        self.access_token = access_token
+        self.expires_at = now + expires_in
+        self.refresh_at = self.expires_at - max(min(skew, expires_in / 2), expires_in * 0.2)
+
+    def is_expired(self, now: float) -> bool:
+        return now >= self.expires_at
+
+    def needs_refresh(self, now: float) -> bool:
+        return now >= self.refresh_at
+
+
+class ClientCredentialsTokenManager:
+    """Caches client-credentials access tokens with single-flight refresh"""
+
+    def __init__(
+        self,
+        token_url: str = OAUTH_TOKEN_URL,
+        client_id: str = OAUTH_CLIENT_ID,
+        client_secret: str = OAUTH_CLIENT_SECRET,
+        scope: Optional[str] = OAUTH_SCOPE,
+        refresh_skew: float = OAUTH_REFRESH_SKEW,
+    ):
+        parts = urlsplit(token_url)
+        self.token_origin = f"{parts.scheme}://{parts.netloc}"
+        self.token_path = parts.path or "/token"
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.refresh_skew = refresh_skew
+        self._tokens: dict[tuple, CachedToken] = {}
+        self._refreshes = SingleFlight("oauth_token")
+        self.token_requests = 0
+
+    async def get_token(self, tenant_id: str, audience: Optional[str] = None) -> str:
+        """Return a valid access token for the tenant/audience"""
+        key = (tenant_id, audience, self.scope)
+        now = time.time()
+        cached = self._tokens.get(key)
+
+        if cached is not None and not cached.needs_refresh(now):
+            return cached.access_token
+
+        refresh = self._refreshes.start(key, lambda: self._refresh(key))
+
+        # Still usable: hand out the current token while the refresh runs
+        if cached is not None and not cached.is_expired(now):
+            return cached.access_token
+
+        # shield() so one cancelled caller doesn't cancel the shared request
+        token = await asyncio.shield(refresh)
+        return token.access_token
+
+    async def _refresh(self, key: tuple) -> CachedToken:
+        try:
+            return await self._fetch(key)
+        except TokenRequestError as e:
+            # Logged here: nobody may be waiting for a background refresh
+            log.warning("oauth.refresh_failed", tenant_id=key[0], error=str(e))
+            raise
+
+    async def _fetch(self, key: tuple) -> CachedToken:
+        tenant_id, audience, scope = key
+        form = {"grant_type": "client_credentials"}
+        if scope:
+            form["scope"] = scope
+        if audience:
+            # RFC 8707 resource indicator
+            form["resource"] = audience
+
+        credentials = base64.b64encode(
+            f"{self.client_id}:{self.client_secret}".encode("utf-8")
+        ).decode("ascii")
+        self.token_requests += 1
+        try:
+            status_code, data = await get_gateway(self.token_origin).request(
+                "POST",
+                self.token_path,
+                headers={
+                    "Authorization": f"Basic {credentials}",
+                    "x-cdl-tenant-id": tenant_id,
+                },
+                data=form,
+                # Issuing a client-credentials token has no side effects
+                idempotent=True,
+                # Not tool traffic: keep it out of the adaptive concurrency limit
+                observe=False,
+            )
+        except (UpstreamError, httpx.HTTPError) as e:
+            # e.g. the Authorization Server is down (httpx.TransportError)
+            raise TokenRequestError(str(e) or type(e).__name__) from e
+
+        access_token = data.get("access_token")
+        if status_code != 200 or not access_token:
+            error = data.get("error_description") or data.get("error") or f"HTTP {status_code}"
+            raise TokenRequestError(f"Token request rejected: {error}")
+
+        token = CachedToken(
+            access_token, float(data.get("expires_in", 3600)), self.refresh_skew
+        )
+        self._tokens[key] = token
+        return token
+
+    def invalidate(self, tenant_id: str, audience: Optional[str] = None) -> None:
+        """Drop a cached token (e.g. after the upstream rejected it)"""
+        self._tokens.pop((tenant_id, audience, self.scope), None)
@@ -0,0 +1,505 @@
+"""
+Thai Phung - Server-side pending changes for the change_email confirmation flow
+
+The confirmation step of change_email stores the requested change under an
+opaque token with a TTL, and the client confirms or cancels with that token
+alone. Each record carries an idempotency key sent upstream as
+`Idempotency-Key`. A confirmed change runs its upstream call once:
+concurrent confirmations share the call, and later ones replay the stored
+result until the record expires.
+
+The token is the record sealed with Fernet (encrypted and authenticated), so
+with several workers a worker that did not issue it can rebuild the record;
+the idempotency key inside keeps the upstream write single. The current step
+and its deadline are sealed too: a follow-up prompt re-issues the token, so a
+rebuilt record resumes at the same question and expires with it. Batches
+(change_emails) are too large to seal, so their token seals the SHA-256 of
+the changes instead; the client sends the changes again with the token and
+any worker can check them against the digest (`changes_digest`).
+
+A cancel, and a confirmation that beats it, are claimed in a `DecisionStore`
+shared by the workers, first writer wins: a cancelled change is never
+rebuilt or sent by any worker, and a change that one worker is sending can no
+longer be cancelled on another. Tokens superseded by a follow-up prompt are
+recorded there too. `InMemoryDecisionStore` serves a single process;
+`SqliteDecisionStore` (`PENDING_CHANGE_STATE_FILE`) serves the workers of one
+host. Expired tokens are kept as local tombstones (their sealed deadline
+already tells the other workers).
+
+Nothing waits on a human: every step returns to the client at once and the
+next call resumes from the stored record. Records nobody comes back for are
+removed by a background sweep.
+"""
+
+import asyncio
+import base64
+import hashlib
+import heapq
+import json
+import os
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from singleflight import SingleFlight
+
+# Configuration
+PENDING_CHANGE_TTL = float(os.environ.get("PENDING_CHANGE_TTL", "300"))
+PENDING_CHANGE_MAX = int(os.environ.get("PENDING_CHANGE_MAX", "10000"))
+# Seconds to answer a follow-up prompt (e.g. change_email's "again T/F?")
+PENDING_CHANGE_PROMPT_TIMEOUT = float(os.environ.get("PENDING_CHANGE_PROMPT_TIMEOUT", "120"))
+PENDING_CHANGE_SWEEP_INTERVAL = float(os.environ.get("PENDING_CHANGE_SWEEP_INTERVAL", "30"))
+# Sealing secret shared by all workers (server.py falls back to JWT_SECRET)
+PENDING_CHANGE_SECRET = os.environ.get("PENDING_CHANGE_SECRET", "")
+# SQLite file of cancel/confirm decisions shared by the workers ("" = this process only)
+PENDING_CHANGE_STATE_FILE = os.environ.get("PENDING_CHANGE_STATE_FILE", "")
+
+PENDING = "pending"
+COMPLETED = "completed"
+
+# Decisions
+CONFIRMED = "confirmed"
+CANCELLED = "cancelled"
+SUPERSEDED = "superseded"
+
+CANCELLED_RESULT = {"status": "cancelled", "message": "This change was cancelled."}
+
+
+def changes_digest(changes: list) -> str:
+    """SHA-256 of a change_emails batch ([{"account_id", "new_email"}, ...]), as sealed in its token"""
+    canonical = json.dumps(
+        [[change["account_id"], change["new_email"]] for change in changes], separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def change_key(idempotency_key: str) -> str:
+    """Decision key of one change (shared by every token it is issued under)"""
+    return f"change:{idempotency_key}"
+
+
+def token_key(token: str) -> str:
+    """Decision key of one token"""
+    return "token:" + hashlib.sha256(token.encode()).hexdigest()
+
+
+class DecisionStore(ABC):
+    """Backend interface for decisions every worker must agree on
+
+    claim() is first-writer-wins, so a cancel and a confirmation of the same
+    change racing on two workers cannot both succeed.
+    """
+
+    @abstractmethod
+    def claim(self, key: str, decision: str, ttl: float) -> str:
+        """Record decision for ttl seconds unless key already has one; return the one in force"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """The decision recorded for key, or None"""
+
+    @abstractmethod
+    def prune(self) -> None:
+        """Forget decisions past their ttl"""
+
+
+class InMemoryDecisionStore(DecisionStore):
+    """Decisions of a single process"""
+
+    def __init__(self):
+        # key -> (decision, forget_at), in insertion order
+        self._decisions: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+    def claim(self, key: str, decision: str, ttl: float) -> str:
+        self.prune()
+        current = self.get(key)
+        if current is not None:
+            return current
+        self._decisions.pop(key, None)
+        self._decisions[key] = (decision, time.time() + ttl)
+        return decision
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._decisions.get(key)
+        if entry is None or time.time() >= entry[1]:
+            return None
+        return entry[0]
+
+    def prune(self) -> None:
+        now = time.time()
+        while self._decisions and now >= next(iter(self._decisions.values()))[1]:
+            self._decisions.popitem(last=False)
+
+
+class SqliteDecisionStore(DecisionStore):
+    """Decisions in a SQLite file shared by the workers of one host
+
+    Each claim is a single upsert on a local WAL database, so it is cheap
+    enough to run on the event loop.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened lazily: workers import this module before they fork or spawn
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS decisions "
+                "(key TEXT PRIMARY KEY, decision TEXT NOT NULL, forget_at REAL NOT NULL)"
+            )
+            self._db = db
+        return self._db
+
+    def claim(self, key: str, decision: str, ttl: float) -> str:
+        db = self._connect()
+        now = time.time()
+        # Only an expired decision can be replaced
+        db.execute(
+            "INSERT INTO decisions VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE "
+            "SET decision = excluded.decision, forget_at = excluded.forget_at "
+            "WHERE decisions.forget_at <= ?",
+            (key, decision, now + ttl, now),
+        )
+        row = db.execute("SELECT decision FROM decisions WHERE key = ?", (key,)).fetchone()
+        return row[0]
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT decision FROM decisions WHERE key = ? AND forget_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def prune(self) -> None:
+        self._connect().execute("DELETE FROM decisions WHERE forget_at <= ?", (time.time(),))
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def default_decisions() -> DecisionStore:
+    """Shared decisions when PENDING_CHANGE_STATE_FILE is set, else this process only"""
+    if PENDING_CHANGE_STATE_FILE:
+        return SqliteDecisionStore(PENDING_CHANGE_STATE_FILE)
+    return InMemoryDecisionStore()
+
+
+@dataclass
+class PendingChange:
+    """One requested email change (or a batch of them) waiting for confirmation"""
+
+    token: str
+    tenant_id: str
+    principal: str
+    account_id: Optional[str]
+    new_email: Optional[str]
+    idempotency_key: str
+    expires_at: float
+    # changes_digest() of a change_emails batch (sealed in the token)
+    digest: Optional[str] = None
+    # [{"account_id", "new_email"}, ...] of the batch; None on a worker that
+    # rebuilt the record until the client sends the changes again
+    changes: Optional[list] = None
+    # Question the next answer belongs to ("confirmation", or a follow-up prompt)
+    step: str = "confirmation"
+    state: str = PENDING
+    result: Optional[dict] = None
+
+    def expires_in(self) -> int:
+        return max(0, int(self.expires_at - time.time()))
+
+
+class PendingChangeStore:
+    """Process-local pending changes keyed by confirmation token (TTL + size bound)"""
+
+    def __init__(
+        self,
+        secret: str,
+        ttl: float = PENDING_CHANGE_TTL,
+        max_entries: int = PENDING_CHANGE_MAX,
+        prompt_timeout: float = PENDING_CHANGE_PROMPT_TIMEOUT,
+        sweep_interval: float = PENDING_CHANGE_SWEEP_INTERVAL,
+        decisions: Optional[DecisionStore] = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prompt_timeout = prompt_timeout
+        self.sweep_interval = sweep_interval
+        self._task: Optional[asyncio.Task] = None
+        self._decisions = decisions if decisions is not None else default_decisions()
+        self._fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest()))
+        self._entries: OrderedDict[str, PendingChange] = OrderedDict()
+        # Confirmations being sent upstream, by idempotency key
+        self._flights = SingleFlight("pending_changes")
+        # (expires_at, token) heap for _purge; stale items are skipped
+        self._deadlines: list[tuple[float, str]] = []
+        # Expired or evicted token -> when it can be forgotten (the sealed
+        # token no longer decrypts by then); in insertion order, so also in that order
+        self._tombstones: OrderedDict[str, float] = OrderedDict()
+        self.created = 0
+        self.restored = 0
+        self.executed = 0
+        self.replayed = 0
+        self.expired = 0
+        # Expired before anyone confirmed or cancelled them
+        self.abandoned = 0
+
+    def create(self, tenant_id: str, principal: str, account_id: str, new_email: str) -> PendingChange:
+        record = PendingChange(
+            token="",
+            tenant_id=tenant_id,
+            principal=principal,
+            account_id=account_id,
+            new_email=new_email,
+            idempotency_key=str(uuid.uuid4()),
+            expires_at=time.time() + self.ttl,
+        )
+        record.token = self._seal(record)
+        self._add(record)
+        self.created += 1
+        return record
+
+    def create_batch(self, tenant_id: str, principal: str, changes: list) -> PendingChange:
+        record = PendingChange(
+            token="",
+            tenant_id=tenant_id,
+            principal=principal,
+            account_id=None,
+            new_email=None,
+            idempotency_key=str(uuid.uuid4()),
+            expires_at=time.time() + self.ttl,
+            digest=changes_digest(changes),
+            changes=changes,
+        )
+        record.token = self._seal(record)
+        self._add(record)
+        self.created += 1
+        return record
+
+    def get(self, token: str, tenant_id: str, principal: str) -> Optional[PendingChange]:
+        """The live record for token, only for the tenant and principal that created it"""
+        record = self._entries.get(token)
+        if record is None:
+            if token in self._tombstones or self._decisions.get(token_key(token)) is not None:
+                return None
+            record = self._restore(token)
+            if record is None:
+                return None
+        elif time.time() >= record.expires_at and not self.in_flight(record):
+            self._expire(record)
+            return None
+        if record.state == PENDING and self._decisions.get(change_key(record.idempotency_key)) == CANCELLED:
+            # Cancelled on another worker
+            self._entries.pop(record.token, None)
+            self._bury(record.token)
+            return None
+        if record.tenant_id != tenant_id or record.principal != principal:
+            return None
+        return record
+
+    def _seal(self, record: PendingChange) -> str:
+        sealed = json.dumps([
+            record.tenant_id,
+            record.principal,
+            record.account_id,
+            record.new_email,
+            record.idempotency_key,
+            record.step,
+            record.expires_at,
+            record.digest,
+        ])
+        return self._fernet.encrypt(sealed.encode()).decode()
+
+    def _restore(self, token: str) -> Optional[PendingChange]:
+        """Rebuild a record issued by another worker (or before it was evicted)"""
+        try:
+            sealed = self._fernet.decrypt(token.encode(), ttl=int(self.ttl))
+            (
+                tenant_id, principal, account_id, new_email, idempotency_key, step, expires_at, digest
+            ) = json.loads(sealed)
+        except (InvalidToken, ValueError, TypeError):
+            return None
+        if time.time() >= expires_at:
+            return None
+        record = PendingChange(
+            token=token,
+            tenant_id=tenant_id,
+            principal=principal,
+            account_id=account_id,
+            new_email=new_email,
+            idempotency_key=idempotency_key,
+            expires_at=expires_at,
+            digest=digest,
+            step=step,
+        )
+        self._add(record)
+        self.restored += 1
+        return record
+
+    def _add(self, record: PendingChange) -> None:
+        self._purge()
+        while len(self._entries) >= self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.expired += 1
+            if evicted.step != "confirmation" or evicted.state != PENDING or self.in_flight(evicted):
+                # Only an untouched confirmation can be rebuilt from its token;
+                # anything further along would come back with its progress lost
+                self._bury(evicted.token)
+        self._entries[record.token] = record
+        heapq.heappush(self._deadlines, (record.expires_at, record.token))
+
+    def prompt(self, record: PendingChange, step: str) -> None:
+        """Wait for the answer to a follow-up question, for prompt_timeout seconds
+
+        The record gets a new token sealing the step and its deadline; the
+        previous token is marked superseded so no worker rebuilds it at the
+        earlier step.
+        """
+        self._entries.pop(record.token, None)
+        self._bury(record.token)
+        self._decisions.claim(token_key(record.token), SUPERSEDED, self.ttl)
+        record.step = step
+        record.expires_at = time.time() + self.prompt_timeout
+        record.token = self._seal(record)
+        self._add(record)
+
+    def discard(self, record: PendingChange) -> bool:
+        """Cancel a pending record on every worker; False if it was already confirmed
+
+        A completed record, one in flight here, or one whose confirmation was
+        claimed on another worker is kept.
+        """
+        if record.state != PENDING or self.in_flight(record):
+            return False
+        if self._decisions.claim(change_key(record.idempotency_key), CANCELLED, self.ttl) != CANCELLED:
+            return False
+        self._entries.pop(record.token, None)
+        self._bury(record.token)
+        return True
+
+    async def confirm(
+        self,
+        record: PendingChange,
+        send: Callable[[PendingChange], Awaitable[tuple[dict, bool]]],
+    ) -> tuple[dict, bool]:
+        """Run send(record) at most once per record; return (result, replayed)
+
+        send returns (result, final). A final result is stored and replayed to
+        later confirmations. A non-final one (e.g. upstream unavailable) leaves
+        the record pending, so the client can confirm again; the retry reuses
+        the same idempotency key. A change cancelled meanwhile (on any worker)
+        is not sent and returns CANCELLED_RESULT.
+        """
+        if record.state == COMPLETED:
+            self.replayed += 1
+            return dict(record.result), True
+        replayed = self.in_flight(record)
+        if not replayed and self._decisions.claim(
+            change_key(record.idempotency_key), CONFIRMED, self.ttl
+        ) == CANCELLED:
+            self._entries.pop(record.token, None)
+            self._bury(record.token)
+            return dict(CANCELLED_RESULT), False
+        if replayed:
+            self.replayed += 1
+        else:
+            self.executed += 1
+        # Concurrent confirmations join the first one's upstream call (which a
+        # cancelled caller does not cancel)
+        result = await self._flights.do(record.idempotency_key, lambda: self._execute(record, send))
+        return dict(result), replayed
+
+    def in_flight(self, record: PendingChange) -> bool:
+        """Whether the record's confirmation is being sent upstream right now"""
+        return self._flights.in_flight(record.idempotency_key)
+
+    def confirmed(self, record: PendingChange) -> bool:
+        """Whether the record was confirmed here or on another worker (so it can no longer be cancelled)"""
+        return (
+            record.state == COMPLETED
+            or self.in_flight(record)
+            or self._decisions.get(change_key(record.idempotency_key)) == CONFIRMED
+        )
+
+    async def _execute(self, record: PendingChange, send) -> dict:
+        result, final = await send(record)
+        if final:
+            record.state = COMPLETED
+            record.result = result
+            # Keep the outcome long enough to answer retried confirmations
+            record.expires_at = time.time() + self.ttl
+            if record.token in self._entries:
+                heapq.heappush(self._deadlines, (record.expires_at, record.token))
+        return result
+
+    def _bury(self, token: str) -> None:
+        """Never rebuild token again (until it could not be rebuilt anyway)"""
+        self._tombstones.pop(token, None)
+        self._tombstones[token] = time.time() + self.ttl
+
+    def _purge(self) -> None:
+        now = time.time()
+        while self._tombstones and now >= next(iter(self._tombstones.values())):
+            self._tombstones.popitem(last=False)
+        held = []
+        while self._deadlines and now >= self._deadlines[0][0]:
+            item = heapq.heappop(self._deadlines)
+            record = self._entries.get(item[1])
+            if record is None or record.expires_at != item[0]:
+                # Removed, or rescheduled under a later deadline
+                continue
+            if self.in_flight(record):
+                held.append(item)
+                continue
+            self._expire(record)
+        for item in held:
+            heapq.heappush(self._deadlines, item)
+
+    def _expire(self, record: PendingChange) -> None:
+        del self._entries[record.token]
+        self._bury(record.token)
+        self.expired += 1
+        if record.state == PENDING:
+            self.abandoned += 1
+
+    def sweep(self) -> int:
+        """Remove every expired record; returns how many were removed"""
+        now = time.time()
+        expired = [r for r in self._entries.values() if now >= r.expires_at and not self.in_flight(r)]
+        for record in expired:
+            self._expire(record)
+        self._decisions.prune()
+        return len(expired)
+
+    async def start(self) -> None:
+        """Start the background sweep of abandoned records"""
+        if self._task is None and self.sweep_interval > 0:
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,174 @@
+"""
+Thai Phung - Per-tenant and per-principal quotas for MCP tool calls
+
+Each tenant, and each principal within a tenant, gets a token bucket
+(sustained calls/second plus a burst) and a cap on concurrently executing
+calls. `QuotaLimiter.acquire()` is synchronous and O(1), so a rejected call
+is answered without touching the tool body or the upstream pool.
+
+Defaults come from the environment; a tenant's `limits` in tenants.json
+overrides them, e.g. {"rate_limit": 50, "burst": 100, "max_in_flight": 20}.
+A limit of 0 disables that check.
+"""
+
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Configuration
+TENANT_RATE_LIMIT = float(os.environ.get("TENANT_RATE_LIMIT", "100"))
+TENANT_BURST = float(os.environ.get("TENANT_BURST", "200"))
+TENANT_MAX_IN_FLIGHT = int(os.environ.get("TENANT_MAX_IN_FLIGHT", "50"))
+PRINCIPAL_RATE_LIMIT = float(os.environ.get("PRINCIPAL_RATE_LIMIT", "20"))
+PRINCIPAL_BURST = float(os.environ.get("PRINCIPAL_BURST", "40"))
+PRINCIPAL_MAX_IN_FLIGHT = int(os.environ.get("PRINCIPAL_MAX_IN_FLIGHT", "10"))
+# Retry hint for calls rejected because too many are already in flight
+QUOTA_BUSY_RETRY_AFTER = float(os.environ.get("QUOTA_BUSY_RETRY_AFTER", "0.5"))
+# Upper bound on tracked buckets (least recently used ones are dropped)
+QUOTA_MAX_KEYS = int(os.environ.get("QUOTA_MAX_KEYS", "100000"))
+
+# tenants.json `limits` keys -> default
+LIMIT_DEFAULTS = {
+    "rate_limit": TENANT_RATE_LIMIT,
+    "burst": TENANT_BURST,
+    "max_in_flight": TENANT_MAX_IN_FLIGHT,
+    "principal_rate_limit": PRINCIPAL_RATE_LIMIT,
+    "principal_burst": PRINCIPAL_BURST,
+    "principal_max_in_flight": PRINCIPAL_MAX_IN_FLIGHT,
+}
+
+
+class TokenBucket:
+    """Lazily refilled token bucket (rate tokens/second, up to burst)"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def configure(self, rate: float, burst: float) -> None:
+        """Apply changed limits (e.g. after a tenants.json reload)"""
+        if rate != self.rate or burst != self.burst:
+            self.rate = rate
+            self.burst = burst
+            self.tokens = min(self.tokens, burst)
+
+    def take(self, now: float) -> float:
+        """Take one token; return 0.0 on success, else seconds until one is available"""
+        # A now read before the bucket was created must not drain it
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def refund(self) -> None:
+        self.tokens = min(self.burst, self.tokens + 1.0)
+
+
+class QuotaExceeded:
+    """Why a call was rejected and when the caller may retry"""
+
+    __slots__ = ("scope", "limit", "retry_after")
+
+    def __init__(self, scope: str, limit: str, retry_after: float):
+        self.scope = scope  # "tenant" | "principal"
+        self.limit = limit  # "rate" | "in_flight"
+        self.retry_after = retry_after
+
+    @property
+    def error(self) -> str:
+        return "rate_limited" if self.limit == "rate" else "too_many_in_flight"
+
+    @property
+    def message(self) -> str:
+        what = "Rate limit exceeded" if self.limit == "rate" else "Too many concurrent calls"
+        return f"{what} for this {self.scope}, retry after {self.retry_after:g}s"
+
+    def to_dict(self) -> dict:
+        return {
+            "status": "error",
+            "error": self.error,
+            "scope": self.scope,
+            "retry_after": self.retry_after,
+            "message": self.message,
+        }
+
+
+def _limit(limits: dict, name: str) -> float:
+    value = limits.get(name)
+    return LIMIT_DEFAULTS[name] if value is None else value
+
+
+class QuotaLimiter:
+    """Token buckets and in-flight counters keyed by tenant and principal"""
+
+    def __init__(self, max_keys: int = QUOTA_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[tuple, TokenBucket] = OrderedDict()
+        self._in_flight: dict[tuple, int] = {}
+        self.rejections = 0
+
+    def _bucket(self, key: tuple, rate: float, burst: float, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, max(burst, 1.0), now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            bucket.configure(rate, max(burst, 1.0))
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def acquire(self, tenant_id: str, principal: str, limits: dict) -> Optional[QuotaExceeded]:
+        """Admit one call (call release() when it finishes), or say why not"""
+        tenant_key = ("tenant", tenant_id)
+        principal_key = ("principal", tenant_id, principal)
+
+        # Concurrency first: a rejected call must not consume rate tokens
+        for scope, key, cap in (
+            ("tenant", tenant_key, _limit(limits, "max_in_flight")),
+            ("principal", principal_key, _limit(limits, "principal_max_in_flight")),
+        ):
+            if cap and self._in_flight.get(key, 0) >= cap:
+                self.rejections += 1
+                return QuotaExceeded(scope, "in_flight", QUOTA_BUSY_RETRY_AFTER)
+
+        now = time.monotonic()
+        taken = []
+        for scope, key, rate, burst in (
+            ("tenant", tenant_key, _limit(limits, "rate_limit"), _limit(limits, "burst")),
+            ("principal", principal_key, _limit(limits, "principal_rate_limit"), _limit(limits, "principal_burst")),
+        ):
+            if not rate:
+                continue
+            bucket = self._bucket(key, rate, burst, now)
+            wait = bucket.take(now)
+            if wait:
+                # Give back what the earlier scope already took
+                for previous in taken:
+                    previous.refund()
+                self.rejections += 1
+                return QuotaExceeded(scope, "rate", math.ceil(wait * 1000) / 1000)
+            taken.append(bucket)
+
+        for key in (tenant_key, principal_key):
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+        return None
+
+    def release(self, tenant_id: str, principal: str) -> None:
+        for key in (("tenant", tenant_id), ("principal", tenant_id, principal)):
+            count = self._in_flight.get(key, 0) - 1
+            if count > 0:
+                self._in_flight[key] = count
+            else:
+                self._in_flight.pop(key, None)
+
+    def in_flight(self, tenant_id: str) -> int:
+        return self._in_flight.get(("tenant", tenant_id), 0)
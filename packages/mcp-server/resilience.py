@@ -0,0 +1,148 @@
+"""
+Thai Phung - Circuit breaker, retry policy and retry budget for upstream calls
+
+Used by upstream.UpstreamGateway:
+
+- `CircuitBreaker` (one per endpoint) opens after consecutive failures and
+  fails calls fast until a half-open probe succeeds.
+- `RetryPolicy` gives exponential backoff delays with full jitter.
+- `RetryBudget` caps retries to a fraction of recent requests, so a broken
+  upstream sees at most (1 + ratio) times the normal load, not max_attempts times.
+"""
+
+import os
+import random
+import time
+from collections import deque
+
+# Configuration
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "10"))
+UPSTREAM_RETRY_ATTEMPTS = int(os.environ.get("UPSTREAM_RETRY_ATTEMPTS", "3"))
+UPSTREAM_RETRY_BASE_DELAY = float(os.environ.get("UPSTREAM_RETRY_BASE_DELAY", "0.05"))
+UPSTREAM_RETRY_MAX_DELAY = float(os.environ.get("UPSTREAM_RETRY_MAX_DELAY", "1"))
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.environ.get("RETRY_BUDGET_MIN_PER_SECOND", "1"))
+RETRY_BUDGET_WINDOW = float(os.environ.get("RETRY_BUDGET_WINDOW", "10"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# Gauge values for mcp_upstream_circuit_state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures -> half-open probe after a timeout"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+        self.short_circuits = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now (half-open admits one probe at a time)"""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now - self.opened_at < self.reset_timeout:
+                self.short_circuits += 1
+                return False
+            self.state = HALF_OPEN
+        # A probe that never reported back (e.g. cancelled) stops blocking after the timeout
+        if self.probe_started_at and now - self.probe_started_at < self.reset_timeout:
+            self.short_circuits += 1
+            return False
+        self.probe_started_at = now
+        return True
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker will admit a probe"""
+        if self.state == CLOSED:
+            return 0.0
+        started = self.opened_at if self.state == OPEN else self.probe_started_at
+        return max(0.0, self.reset_timeout - (time.monotonic() - started))
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self.probe_started_at = 0.0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.probe_started_at = 0.0
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter"""
+
+    def __init__(
+        self,
+        max_attempts: int = UPSTREAM_RETRY_ATTEMPTS,
+        base_delay: float = UPSTREAM_RETRY_BASE_DELAY,
+        max_delay: float = UPSTREAM_RETRY_MAX_DELAY,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, retry: int) -> float:
+        """Sleep before retry number `retry` (1-based)"""
+        return random.uniform(0.0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+
+
+class RetryBudget:
+    """Allow retries up to ratio * requests (plus a small floor) over a sliding window"""
+
+    def __init__(
+        self,
+        ratio: float = RETRY_BUDGET_RATIO,
+        min_per_second: float = RETRY_BUDGET_MIN_PER_SECOND,
+        window: float = RETRY_BUDGET_WINDOW,
+    ):
+        self.ratio = ratio
+        self.min_retries = min_per_second * window
+        self.window = window
+        # One [second, requests, retries] slot per second of the window
+        self._slots: deque = deque()
+        self._requests = 0
+        self._retries = 0
+        self.exhausted = 0
+
+    def _slot(self) -> list:
+        now = int(time.monotonic())
+        while self._slots and self._slots[0][0] <= now - self.window:
+            _, requests, retries = self._slots.popleft()
+            self._requests -= requests
+            self._retries -= retries
+        if not self._slots or self._slots[-1][0] != now:
+            self._slots.append([now, 0, 0])
+        return self._slots[-1]
+
+    def record_request(self) -> None:
+        self._slot()[1] += 1
+        self._requests += 1
+
+    def try_withdraw(self) -> bool:
+        """Take one retry from the budget, or refuse if it is spent"""
+        slot = self._slot()
+        if self._retries >= self.min_retries + self.ratio * self._requests:
+            self.exhausted += 1
+            return False
+        slot[2] += 1
+        self._retries += 1
+        return True
@@ -0,0 +1,137 @@
+"""
+Thai Phung - Read-through result cache for MCP tools
+
+`ResultCache` is the backend interface (async so an external store such as
+Redis can implement it later); `InMemoryResultCache` is the in-process
+TTL + LRU backend. Keys are always scoped by tenant and principal so cached
+data never crosses tenants, and entries carry tags so a write can invalidate
+every principal's view of the same account.
+
+Invalidating a tag also bumps its generation. A read-through fetch notes the
+generation before calling upstream and skips set() if it changed meanwhile,
+so a lookup that raced a write cannot put the old value back.
+"""
+
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Iterable, Optional
+from urllib.parse import quote
+
+# Configuration
+EMAIL_CACHE_ENABLED = os.environ.get("EMAIL_CACHE_ENABLED", "1") == "1"
+EMAIL_CACHE_TTL = float(os.environ.get("EMAIL_CACHE_TTL", "60"))
+EMAIL_CACHE_SIZE = int(os.environ.get("EMAIL_CACHE_SIZE", "10000"))
+EMAIL_CACHE_WRITE_THROUGH = os.environ.get("EMAIL_CACHE_WRITE_THROUGH", "1") == "1"
+
+
+def email_cache_key(tenant_id: str, principal: str, account_id: str) -> str:
+    """Cache key for a get_email result as seen by one principal of one tenant"""
+    return f"email:{quote(tenant_id, safe='')}:{quote(principal, safe='')}:{quote(account_id, safe='')}"
+
+
+def email_account_tag(tenant_id: str, account_id: str) -> str:
+    """Tag shared by every principal's cached view of one account"""
+    return f"email-account:{quote(tenant_id, safe='')}:{quote(account_id, safe='')}"
+
+
+class ResultCache(ABC):
+    """Backend interface for cached tool results"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[dict]:
+        """Return the cached value, or None on a miss"""
+
+    @abstractmethod
+    async def set(self, key: str, value: dict, ttl: float, tags: Iterable[str] = ()) -> None:
+        """Store a value for ttl seconds under the given tags"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """Remove one entry"""
+
+    @abstractmethod
+    async def invalidate_tag(self, tag: str) -> None:
+        """Remove every entry stored under the tag and bump its generation"""
+
+    @abstractmethod
+    async def tag_generation(self, tag: str) -> int:
+        """Counter that changes whenever the tag is invalidated"""
+
+
+class InMemoryResultCache(ResultCache):
+    """Process-local TTL + LRU cache"""
+
+    def __init__(self, max_size: int = EMAIL_CACHE_SIZE):
+        self.max_size = max_size
+        # key -> (expires_at, value, tags)
+        self._entries: OrderedDict[str, tuple[float, dict, tuple]] = OrderedDict()
+        self._tags: dict[str, set] = {}
+        # Generations of recently invalidated tags, bounded like the entries.
+        # Values come from one clock, and a tag dropped from the dict reports
+        # the highest dropped value, so its generation never appears to go back.
+        self._generations: OrderedDict[str, int] = OrderedDict()
+        self._clock = 0
+        self._dropped_generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value, _ = entry
+        if time.time() >= expires_at:
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(value)
+
+    async def set(self, key: str, value: dict, ttl: float, tags: Iterable[str] = ()) -> None:
+        self._remove(key)
+        tags = tuple(tags)
+        self._entries[key] = (time.time() + ttl, dict(value), tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    async def delete(self, key: str) -> None:
+        self._remove(key)
+
+    async def invalidate_tag(self, tag: str) -> None:
+        for key in list(self._tags.get(tag, ())):
+            self._remove(key)
+        self._clock += 1
+        self._generations.pop(tag, None)
+        self._generations[tag] = self._clock
+        while len(self._generations) > self.max_size:
+            _, generation = self._generations.popitem(last=False)
+            self._dropped_generation = max(self._dropped_generation, generation)
+
+    async def tag_generation(self, tag: str) -> int:
+        return self._generations.get(tag, self._dropped_generation)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
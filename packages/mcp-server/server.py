@@ -3,86 +3,525 @@ Thai Phung - MCP Server tool
 """
 
 import jwt
-import subprocess
-import json
-import sys
-from fastmcp import FastMCP, Context
-from typing import Optional
+import os
+import math
+import base64
+import argparse
+import re
+import random
+import time
+import asyncio
+import logging
+import tempfile
+from contextlib import asynccontextmanager
+from fastmcp import FastMCP
+from typing import Awaitable, Callable, Optional
 from fastmcp.server.dependencies import get_http_headers
 from fastmcp.server.middleware import Middleware, MiddlewareContext
-from fastmcp.exceptions import ToolError
-from fastmcp.utilities.types import Image, Audio, File
+from fastmcp.exceptions import ToolError, ResourceError
+from fastmcp.resources import Resource
+from fastmcp.tools.tool import ToolResult
+from mcp.types import (
+    BlobResourceContents,
+    CallToolResult,
+    ImageContent,
+    ReadResourceRequest,
+    ReadResourceResult,
+    ResourceLink,
+    Resource as MCPResource,
+    ServerResult,
+    TextContent,
+    TextResourceContents,
+)
 import contextvars
+from upstream import CircuitOpenError, UpstreamGateway, get_gateway, close_gateways, set_latency_observer
+from token_cache import VerifiedTokenCache, token_digest
+from singleflight import SingleFlight
+from assets import AssetRegistry
+from result_cache import (
+    InMemoryResultCache,
+    email_cache_key,
+    email_account_tag,
+    EMAIL_CACHE_ENABLED,
+    EMAIL_CACHE_TTL,
+    EMAIL_CACHE_WRITE_THROUGH,
+)
+import uvicorn
+from starlette.requests import Request
+from starlette.responses import Response
+from mcp_logging import get_logger
+from metrics import (
+    REGISTRY,
+    TOOL_CALLS,
+    TOOL_DURATION,
+    TOOL_IN_FLIGHT,
+    AUTH_FAILURES,
+    QUOTA_REJECTIONS,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+)
+from oauth_client import (
+    ClientCredentialsTokenManager,
+    UPSTREAM_AUTH_MODE,
+    OAUTH_AUDIENCE,
+)
+from jwks import JWKSKeySet, ASYMMETRIC_ALGORITHMS
+from tenants import Tenant, TenantRegistry
+from shards import ShardRouter
+from hedging import HEDGE_ENABLED, Hedger
+from quotas import QuotaExceeded, QuotaLimiter
+from admission import ADAPTIVE_LIMIT_ENABLED, AdaptiveLimiter, Overloaded
+from audit import AuditLog
+from pending_changes import PENDING_CHANGE_SECRET, PendingChange, PendingChangeStore, changes_digest
+from tracing import set_attributes, span, trace_carrier
+
+log = get_logger("server")
 
 # Context variable to store request authentication data
 auth_context_var = contextvars.ContextVar("auth_context", default=(None, None))
+# Tenant record of the current call, looked up once by AuthMiddleware
+tenant_context_var: contextvars.ContextVar[Optional[Tenant]] = contextvars.ContextVar(
+    "tenant_context", default=None
+)
 
 # Configuration
 JWT_SECRET = "your-secret-key"
-API_BASE_URL = "http://localhost:3006"
+# Accepted JWT algorithms; RS256/ES256 keys come from JWKS_URL
+JWT_ALGORITHMS = tuple(
+    a.strip() for a in os.environ.get("JWT_ALGORITHMS", "HS256").split(",") if a.strip()
+)
+API_BASE_URL = os.environ.get("API_BASE_URL", "http://localhost:3006")
+# Other API servers with the same data as API_BASE_URL (targets of hedged reads)
+API_REPLICA_URLS = tuple(
+    u.strip().rstrip("/") for u in os.environ.get("API_REPLICA_URLS", "").split(",") if u.strip()
+)
+HOST = "localhost"
 PORT = 3005
+MCP_WORKERS = int(os.environ.get("MCP_WORKERS", "1"))
+GET_EMAILS_MAX_BATCH = int(os.environ.get("GET_EMAILS_MAX_BATCH", "100"))
+GET_EMAILS_CONCURRENCY = int(os.environ.get("GET_EMAILS_CONCURRENCY", "8"))
+CHANGE_EMAILS_MAX_BATCH = int(os.environ.get("CHANGE_EMAILS_MAX_BATCH", "500"))
+
+ACCOUNT_ID_PATTERN = re.compile(r"^\d{5,10}$")
+EMAIL_PATTERN = re.compile(r"^[^\s@]+@[^\s@]+\.[^\s@]+$")
+# Changes listed in the change_emails confirmation prompt
+CHANGE_EMAILS_PREVIEW = 5
+CHART_FILES = ("image01.png", "image02.png")
+CHART_CHUNK_SIZE = int(os.environ.get("CHART_CHUNK_SIZE", str(64 * 1024)))
+
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """Warm up the upstream clients and JWKS, start the shard checks, pending-change sweep and audit writer; stop them on shutdown"""
+    await get_gateway(API_BASE_URL).warm_up()
+    await shard_router.start()
+    await jwks.start()
+    await pending_changes.start()
+    audit_log.start()
+    try:
+        yield {}
+    finally:
+        await asyncio.to_thread(audit_log.stop)
+        await pending_changes.stop()
+        await jwks.stop()
+        await shard_router.stop()
+        await close_gateways()
+
 
 # Initialize FastMCP server
-mcp = FastMCP(name="ThaiInternalMCP", version="0.1.0")
+mcp = FastMCP(name="ThaiInternalMCP", version="0.1.0", lifespan=lifespan)
 
 # Global context for authentication
 auth_context = {}
 
+# Verified JWT claims cache (hit/miss counters via token_cache.stats())
+token_cache = VerifiedTokenCache()
+
+# Public keys for RS256/ES256 tokens, refreshed in the background
+jwks = JWKSKeySet()
+if not jwks.enabled and any(a in ASYMMETRIC_ALGORITHMS for a in JWT_ALGORITHMS):
+    log.warning("jwks.not_configured", algorithms=JWT_ALGORITHMS)
+
+# Upstream tokens for UPSTREAM_AUTH_MODE=client_credentials
+token_manager = ClientCredentialsTokenManager()
+
+# Registered tenants (TENANTS_FILE), hot-reloaded when the file changes
+tenant_registry = TenantRegistry()
+tenant_registry.load()
+
+# Tenant -> upstream shard routing (SHARDS_FILE), health-checked and hot-reloaded
+shard_router = ShardRouter()
+shard_router.load()
+
+# Second attempts for slow get_email lookups (HEDGE_ENABLED)
+email_hedger = Hedger("get_email")
+
+# Per-tenant / per-principal rate and concurrency quotas
+quota_limiter = QuotaLimiter()
+
+# Server-wide concurrency limit, adapted to upstream latency
+adaptive_limiter = AdaptiveLimiter()
+set_latency_observer(adaptive_limiter.observe)
+
+# Coalesces concurrent get_email calls per (tenant, account_id)
+email_flight = SingleFlight("get_email")
+
+# Read-through cache of get_email results, scoped by tenant and principal
+email_cache = InMemoryResultCache()
+
+# Append-only record of every email change (AUDIT_LOG_FILE), written in the background
+audit_log = AuditLog()
+
+# change_email requests awaiting confirmation, keyed by confirmation token
+pending_changes = PendingChangeStore(PENDING_CHANGE_SECRET or JWT_SECRET)
+
+# Chart images, loaded and base64-encoded once at startup
+chart_assets = AssetRegistry()
+for _chart in CHART_FILES:
+    chart_assets.register(_chart)
+
+# Short metric labels for validate_auth failure messages
+AUTH_FAILURE_REASONS = {
+    "JWT token is required": "missing_token",
+    "Invalid or expired JWT token": "invalid_token",
+    "Invalid tenant ID": "invalid_tenant",
+    "Tenant is suspended": "tenant_suspended",
+    "Tool is not allowed for this tenant": "tool_not_allowed",
+}
+
+# Cache / coalescing counters exported on /metrics
+for _name, _help, _read in (
+    ("mcp_token_cache_hits_total", "Verified-token cache hits", lambda: token_cache.hits),
+    ("mcp_token_cache_negative_hits_total", "Verified-token cache hits on rejected tokens", lambda: token_cache.negative_hits),
+    ("mcp_token_cache_misses_total", "Verified-token cache misses", lambda: token_cache.misses),
+    ("mcp_email_cache_hits_total", "get_email result cache hits", lambda: email_cache.hits),
+    ("mcp_email_cache_misses_total", "get_email result cache misses", lambda: email_cache.misses),
+    ("mcp_get_email_lookups_total", "get_email upstream lookups requested", lambda: email_flight.calls),
+    ("mcp_get_email_coalesced_total", "get_email lookups served by another in-flight call", lambda: email_flight.coalesced),
+    ("mcp_jwks_fetches_total", "JWKS fetches (background and unknown kid)", lambda: jwks.fetches),
+    ("mcp_jwks_fetch_failures_total", "Failed JWKS fetches", lambda: jwks.fetch_failures),
+    ("mcp_tenant_registry_reloads_total", "Tenant registry hot reloads", lambda: tenant_registry.reloads),
+    ("mcp_tenant_registry_reload_failures_total", "Rejected tenant registry reloads", lambda: tenant_registry.reload_failures),
+    ("mcp_shard_reloads_total", "Shard routing table hot reloads", lambda: shard_router.reloads),
+    ("mcp_shard_reload_failures_total", "Rejected shard routing table reloads", lambda: shard_router.reload_failures),
+    ("mcp_shard_failovers_total", "Reads sent to a replica because the shard's primary was unhealthy", lambda: shard_router.failovers),
+    ("mcp_get_email_hedged_total", "get_email lookups that sent a hedged second attempt", lambda: email_hedger.hedged),
+    ("mcp_get_email_hedge_wins_total", "Hedged get_email attempts that answered first", lambda: email_hedger.hedge_wins),
+    ("mcp_get_email_hedge_budget_exhausted_total", "get_email hedges skipped because the budget was spent", lambda: email_hedger.budget.exhausted),
+    ("mcp_change_email_executed_total", "Confirmed email changes sent upstream", lambda: pending_changes.executed),
+    ("mcp_change_email_replayed_total", "Repeated confirmations answered without an upstream call", lambda: pending_changes.replayed),
+    ("mcp_pending_changes_abandoned_total", "Pending changes that expired unanswered", lambda: pending_changes.abandoned),
+    ("mcp_audit_records_total", "Audit records written and fsynced", lambda: audit_log.written),
+    ("mcp_audit_fsyncs_total", "Audit log batches (one fsync each)", lambda: audit_log.batches),
+    ("mcp_audit_dropped_total", "Audit records dropped because the queue was full", lambda: audit_log.dropped),
+    ("mcp_audit_write_failures_total", "Audit batches that failed to write", lambda: audit_log.write_failures),
+    ("mcp_audit_duplicates_total", "Audit records skipped as already recorded", lambda: audit_log.duplicates),
+):
+    REGISTRY.callback(_name, _help, _read, "counter")
+REGISTRY.callback("mcp_tenants", "Registered tenants", lambda: len(tenant_registry))
+REGISTRY.callback("mcp_upstream_shards", "Upstream shards in the routing table", lambda: len(shard_router))
+REGISTRY.callback("mcp_upstream_shards_healthy", "Upstream shards whose primary passes health checks", shard_router.healthy_count)
+REGISTRY.callback("mcp_get_email_hedge_delay_seconds", "Current get_email hedge delay", lambda: email_hedger.delay() or 0)
+REGISTRY.callback("mcp_adaptive_limit", "Current adaptive concurrency limit", lambda: int(adaptive_limiter.limit))
+REGISTRY.callback("mcp_adaptive_in_flight", "Tool calls admitted by the adaptive limiter", lambda: adaptive_limiter.in_flight)
+REGISTRY.callback("mcp_load_shed_total", "Tool calls shed by the adaptive limiter", lambda: adaptive_limiter.shed, "counter")
+REGISTRY.callback("mcp_pending_changes", "change_email requests awaiting confirmation or replay", lambda: len(pending_changes))
+
+def request_meta(context: MiddlewareContext):
+    """`_meta` of the MCP request (the middleware message is rebuilt without it)"""
+    try:
+        return context.fastmcp_context.request_context.meta
+    except (AttributeError, LookupError, ValueError):
+        return None
+
+
+class TracingMiddleware(Middleware):
+    """Server span per tool call, continuing the client's trace (outermost middleware)"""
+
+    async def on_call_tool(self, context: MiddlewareContext, call_next):
+        tool = context.message.name
+        carrier = trace_carrier(request_meta(context), get_http_headers())
+        attributes = {"mcp.method.name": "tools/call", "gen_ai.tool.name": tool}
+        with span(f"tools/call {tool}", kind="server", attributes=attributes, carrier=carrier) as current:
+            result = await call_next(context)
+            if isinstance(result, RejectedCall):
+                set_attributes(current, **{"error.type": result.reason.error})
+            return result
+
+
+class MetricsMiddleware(Middleware):
+    """Per-tool call counts, latency and in-flight calls (wraps AuthMiddleware)"""
+
+    async def on_call_tool(self, context: MiddlewareContext, call_next):
+        tool = context.message.name
+        TOOL_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await call_next(context)
+            outcome = "rejected" if isinstance(result, RejectedCall) else "ok"
+            return result
+        finally:
+            TOOL_DURATION.observe(time.perf_counter() - start, tool=tool)
+            TOOL_CALLS.inc(tool=tool, outcome=outcome)
+            TOOL_IN_FLIGHT.dec()
+
+
+class RejectedCall(ToolResult):
+    """Error result for a call rejected by a quota or shed under load, with a retry-after hint"""
+
+    def __init__(self, reason: QuotaExceeded | Overloaded):
+        super().__init__(structured_content=reason.to_dict())
+        self.reason = reason
+
+    def to_mcp_result(self) -> CallToolResult:
+        return CallToolResult(
+            content=[TextContent(type="text", text=self.reason.message)],
+            structuredContent=self.structured_content,
+            isError=True,
+        )
+
+
+class AdmissionMiddleware(Middleware):
+    """Sheds tool calls beyond the adaptive concurrency limit (runs before auth)"""
+
+    async def on_call_tool(self, context: MiddlewareContext, call_next):
+        overloaded = adaptive_limiter.try_acquire()
+        if overloaded is not None:
+            log.info(
+                "admission.shed",
+                tool=context.message.name,
+                limit=overloaded.limit,
+                in_flight=adaptive_limiter.in_flight,
+                retry_after=overloaded.retry_after,
+            )
+            return RejectedCall(overloaded)
+        try:
+            return await call_next(context)
+        finally:
+            adaptive_limiter.release()
+
+
 class AuthMiddleware(Middleware):
     async def on_call_tool(self, context: MiddlewareContext, call_next):
 
         jwt_token, tenant_id = get_request_context()
-        print("- header: ", jwt_token, tenant_id)
+        log.debug("auth.check", tool=context.message.name, tenant_id=tenant_id)
 
-        # Authentication check
-        is_valid, message = validate_auth(jwt_token, tenant_id)
+        with span("mcp.auth", attributes={"mcp.tenant.id": tenant_id}) as auth_span:
+            # Authentication check
+            await ensure_jwt_key(jwt_token)
+            is_valid, message, tenant = validate_auth(jwt_token, tenant_id, context.message.name)
 
-        if not is_valid:
-            raise ToolError(f"Access denied: Authentication failed: {message}")
+            if not is_valid:
+                log.warning("auth.denied", tool=context.message.name, tenant_id=tenant_id, reason=message)
+                reason = AUTH_FAILURE_REASONS.get(message, "other")
+                AUTH_FAILURES.inc(reason=reason)
+                set_attributes(auth_span, **{"error.type": reason})
+                raise ToolError(f"Access denied: Authentication failed: {message}")
+
+            # Quotas are checked before any tool work, so a noisy tenant is
+            # turned away without taking upstream connections from others
+            principal = get_principal(jwt_token)
+            exceeded = quota_limiter.acquire(tenant.tenant_id, principal, tenant.limits)
+            set_attributes(auth_span, **{"mcp.quota.scope": exceeded and exceeded.scope})
+        if exceeded is not None:
+            log.info(
+                "quota.rejected",
+                tool=context.message.name,
+                tenant_id=tenant_id,
+                scope=exceeded.scope,
+                limit=exceeded.limit,
+                retry_after=exceeded.retry_after,
+            )
+            QUOTA_REJECTIONS.inc(scope=exceeded.scope, limit=exceeded.limit)
+            return RejectedCall(exceeded)
 
         # Set context for tools to use
         token = auth_context_var.set((jwt_token, tenant_id))
+        tenant_token = tenant_context_var.set(tenant)
         try:
             # Allow other tools to proceed
-            return await call_next(context)
+            with span(f"tool {context.message.name}"):
+                return await call_next(context)
         finally:
+            tenant_context_var.reset(tenant_token)
             auth_context_var.reset(token)
+            quota_limiter.release(tenant.tenant_id, principal)
+
+    async def on_read_resource(self, context: MiddlewareContext, call_next):
+        # Chart bytes are fetched by reference, so resource reads need the same headers
+        jwt_token, tenant_id = get_request_context()
+        await ensure_jwt_key(jwt_token)
+        is_valid, message, _ = validate_auth(jwt_token, tenant_id)
+
+        if not is_valid:
+            log.warning("auth.denied", resource=str(context.message.uri), tenant_id=tenant_id, reason=message)
+            AUTH_FAILURES.inc(reason=AUTH_FAILURE_REASONS.get(message, "other"))
+            raise ResourceError(f"Access denied: Authentication failed: {message}")
 
+        return await call_next(context)
+
+mcp.add_middleware(TracingMiddleware())
+mcp.add_middleware(MetricsMiddleware())
+if ADAPTIVE_LIMIT_ENABLED:
+    mcp.add_middleware(AdmissionMiddleware())
 mcp.add_middleware(AuthMiddleware())
 
-def verify_jwt_token(token: str) -> bool:
-    """Verify JWT token validity"""
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> Response:
+    """Prometheus text exposition of this process's metrics"""
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+def decode_jwt_token(token: str) -> Optional[dict]:
+    """Return verified JWT claims (cached per token), or None if invalid"""
+    found, claims = token_cache.get(token)
+    if found:
+        return claims
+
     try:
-        jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        return True
+        header = jwt.get_unverified_header(token)
+        algorithm = header.get("alg")
+        if algorithm not in JWT_ALGORITHMS:
+            raise jwt.InvalidAlgorithmError(f"Algorithm {algorithm} is not allowed")
+        if algorithm in ASYMMETRIC_ALGORITHMS:
+            key = jwks.get_key(header.get("kid"))
+            if key is None:
+                # Unknown kid - may be published by the next JWKS refresh, don't cache
+                return None
+        else:
+            key = JWT_SECRET
+        claims = jwt.decode(token, key, algorithms=[algorithm])
+    except jwt.ImmatureSignatureError:
+        # Not valid yet (nbf/iat in the future) - may become valid, don't cache
+        return None
+    except (jwt.InvalidTokenError, jwt.InvalidKeyError):
+        token_cache.put_invalid(token)
+        return None
+
+    token_cache.put_valid(token, claims)
+    return claims
+
+
+async def ensure_jwt_key(token: str) -> None:
+    """Load the signing key of an RS256/ES256 token before validate_auth
+
+    Keys normally come from the background JWKS refresh; a kid that is not
+    loaded yet (key rotation) triggers a rate-limited, coalesced refetch.
+    """
+    if not token or not jwks.enabled:
+        return
+    try:
+        header = jwt.get_unverified_header(token)
     except jwt.InvalidTokenError:
-        return False
+        return
+    algorithm = header.get("alg")
+    if algorithm in ASYMMETRIC_ALGORITHMS and algorithm in JWT_ALGORITHMS:
+        await jwks.ensure_kid(header.get("kid"))
+
+
+def verify_jwt_token(token: str) -> bool:
+    """Verify JWT token validity"""
+    return decode_jwt_token(token) is not None
+
+
+def get_principal(jwt_token: str) -> str:
+    """Principal ID from the verified JWT claims (sub / userId)"""
+    claims = decode_jwt_token(jwt_token) or {}
+    principal = claims.get("sub") or claims.get("userId")
+    if principal:
+        return str(principal)
+    # No subject claim: scope to the token itself so callers never share entries
+    return token_digest(jwt_token).hex()
 
 
 def get_request_context() -> tuple[str, str]:
     """Get JWT token and tenant ID from request headers"""
     # Get headers (returns empty dict if no request context)
     headers = get_http_headers()
-    print(headers)
+    if log.is_enabled(logging.DEBUG):
+        log.debug("request.headers", headers=headers)
     jwt_token = headers.get("x-jwt-token", "")
     tenant_id = headers.get("x-tenant-id", "")
     return jwt_token, tenant_id
 
 
+async def get_upstream_headers(jwt_token: str, tenant_id: str) -> dict:
+    """Build auth headers for an API call (forwarded JWT or client-credentials token)"""
+    if UPSTREAM_AUTH_MODE == "client_credentials":
+        bearer = await token_manager.get_token(tenant_id, OAUTH_AUDIENCE)
+    else:
+        bearer = jwt_token
+    return {
+        "Authorization": f"Bearer {bearer}",
+        "x-cdl-tenant-id": tenant_id,
+    }
+
+
+async def call_upstream(
+    jwt_token: str, tenant_id: str, send: Callable[[dict], Awaitable[tuple[int, dict]]]
+) -> tuple[int, dict]:
+    """send(auth headers); with a client-credentials token the upstream rejects
+    (401/403, e.g. after a key rotation), fetch a new token and send once more"""
+    status_code, data = await send(await get_upstream_headers(jwt_token, tenant_id))
+    if status_code in (401, 403) and UPSTREAM_AUTH_MODE == "client_credentials":
+        log.warning("oauth.token_rejected", tenant_id=tenant_id, status_code=status_code)
+        token_manager.invalidate(tenant_id, OAUTH_AUDIENCE)
+        status_code, data = await send(await get_upstream_headers(jwt_token, tenant_id))
+    return status_code, data
+
+
 def validate_auth(
-    jwt_token: Optional[str], tenant_id: Optional[str]
-) -> tuple[bool, str]:
-    """Validate JWT token and tenant ID"""
+    jwt_token: Optional[str], tenant_id: Optional[str], tool: Optional[str] = None
+) -> tuple[bool, str, Optional[Tenant]]:
+    """Validate JWT token and tenant ID; returns the tenant record on success"""
     if not jwt_token:
-        return False, "JWT token is required"
+        return False, "JWT token is required", None
 
     if not verify_jwt_token(jwt_token):
-        return False, "Invalid or expired JWT token"
+        return False, "Invalid or expired JWT token", None
+
+    tenant = tenant_registry.get(tenant_id)
+    if tenant is None:
+        return False, "Invalid tenant ID", None
+
+    if not tenant.is_active:
+        return False, "Tenant is suspended", None
+
+    if tool is not None and not tenant.allows_tool(tool):
+        return False, "Tool is not allowed for this tenant", None
 
-    if tenant_id != "test123":
-        return False, "Invalid tenant ID"
+    return True, "Authentication successful", tenant
 
-    return True, "Authentication successful"
+
+def get_tenant_base_urls(read: bool = False) -> list[str]:
+    """Upstream base URLs for the current tenant (primary first, then replicas):
+    its own API base URL, else its shard, else the default"""
+    tenant = tenant_context_var.get()
+    if tenant is not None:
+        if tenant.upstream_base_url:
+            return [tenant.upstream_base_url]
+        shard = shard_router.route(tenant.tenant_id)
+        if shard is not None:
+            return shard_router.base_urls(shard, read=read)
+    return [API_BASE_URL, *API_REPLICA_URLS]
+
+
+def get_tenant_gateway(read: bool = False) -> UpstreamGateway:
+    """Upstream gateway for the current tenant (read=True may fail over to a replica)"""
+    return get_gateway(get_tenant_base_urls(read)[0])
+
+
+async def hedged_get(path: str, endpoint: str, headers: dict) -> tuple[int, dict]:
+    """GET with a hedged second attempt on a replica (or the same upstream if it has none)"""
+    base_urls = get_tenant_base_urls(read=True)
+    primary = get_gateway(base_urls[0])
+    backup = get_gateway(random.choice(base_urls[1:])) if len(base_urls) > 1 else primary
+    return await email_hedger.run(
+        lambda: primary.get(path, endpoint=endpoint, headers=headers),
+        lambda: backup.get(path, endpoint=endpoint, headers=headers),
+    )
 
 
 @mcp.tool()
@@ -93,10 +532,7 @@ async def get_email(account_id: str,) -> dict:
     Args:
         account_id: Account ID (5-10 digits)
     """
-    print(
-        f"[MCP] get_email called - account_id: {account_id}",
-        file=sys.stderr,
-    )
+    log.info("get_email.called", account_id=account_id)
     # Retrieve auth context from middleware
     jwt_token, tenant_id = auth_context_var.get()
     
@@ -105,79 +541,211 @@ async def get_email(account_id: str,) -> dict:
         jwt_token, tenant_id = get_request_context()
 
     # Authentication check
-    # is_valid, message = validate_auth(jwt_token, tenant_id)
+    # is_valid, message, _ = validate_auth(jwt_token, tenant_id)
     # if not is_valid:
-    #     print(f"[MCP] Authentication failed: {message}", file=sys.stderr)
+    #     log.warning("auth.failed", reason=message)
     #     return f"Authentication failed: {message}"
 
-    # Call REST API using curl
-    try:
+    # Validate before the ID becomes part of an upstream URL path
+    if not ACCOUNT_ID_PATTERN.match(account_id):
+        return {"status": "error", "message": "Invalid account_id. Must be 5-10 digits"}
 
-        
-        result = subprocess.run(
-            [
-                "curl",
-                "-s",
-                "-X",
-                "GET",
-                f"{API_BASE_URL}/get_email/{account_id}",
-                "-H",
-                f"Authorization: Bearer {jwt_token}",
-                "-H",
-                f"x-cdl-tenant-id: {tenant_id}",
-            ],
-            capture_output=True,
-            text=True,
-            timeout=10,
+    return await lookup_email(account_id, jwt_token, tenant_id)
+
+
+@mcp.tool()
+async def get_emails(account_ids: list[str]) -> dict:
+    """
+    Get email addresses for several accounts in one call
+
+    Args:
+        account_ids: List of Account IDs (5-10 digits each)
+    """
+    log.info("get_emails.called", count=len(account_ids))
+    jwt_token, tenant_id = auth_context_var.get()
+    if not jwt_token:
+        jwt_token, tenant_id = get_request_context()
+
+    # Validate the whole batch before any upstream call
+    if not account_ids:
+        return {"status": "error", "message": "account_ids must not be empty"}
+    if len(account_ids) > GET_EMAILS_MAX_BATCH:
+        return {
+            "status": "error",
+            "message": f"Too many account_ids: {len(account_ids)} (max {GET_EMAILS_MAX_BATCH})",
+        }
+    invalid = [a for a in account_ids if not ACCOUNT_ID_PATTERN.match(a)]
+    if invalid:
+        return {
+            "status": "error",
+            "message": "Invalid account_id. Must be 5-10 digits",
+            "invalid_account_ids": invalid,
+        }
+
+    # Fan out with a bounded number of concurrent upstream calls
+    semaphore = asyncio.Semaphore(GET_EMAILS_CONCURRENCY)
+
+    async def lookup(account_id: str) -> dict:
+        async with semaphore:
+            return await lookup_email(account_id, jwt_token, tenant_id)
+
+    unique_ids = list(dict.fromkeys(account_ids))
+    lookups = await asyncio.gather(*(lookup(a) for a in unique_ids))
+
+    results = []
+    for account_id, result in zip(unique_ids, lookups):
+        item = {"account_id": account_id, "status": result["status"]}
+        if result["status"] == "success":
+            item["email"] = result["email"]
+        else:
+            item["message"] = result.get("message", "Unknown error")
+        results.append(item)
+
+    result = batch_result(results)
+    log.info("get_emails.finished", succeeded=result["succeeded"], failed=result["failed"])
+    return result
+
+
+def batch_result(results: list[dict]) -> dict:
+    """Result of a batch tool from its per-item results: success, partial or error overall"""
+    succeeded = sum(1 for r in results if r["status"] == "success")
+    failed = len(results) - succeeded
+    if failed == 0:
+        status = "success"
+    elif succeeded == 0:
+        status = "error"
+    else:
+        status = "partial"
+    return {
+        "status": status,
+        "succeeded": succeeded,
+        "failed": failed,
+        "results": results,
+    }
+
+
+async def lookup_email(account_id: str, jwt_token: str, tenant_id: str) -> dict:
+    """Cached, coalesced email lookup shared by get_email and get_emails"""
+    cache_key = email_cache_key(tenant_id, get_principal(jwt_token), account_id)
+    if EMAIL_CACHE_ENABLED:
+        cached = await email_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # Identical concurrent lookups share one upstream request. A forwarded
+    # caller JWT decides what upstream returns, so only callers with the same
+    # principal may share it; with the server's own token the whole tenant can
+    flight_key = (
+        (tenant_id, account_id) if UPSTREAM_AUTH_MODE == "client_credentials" else cache_key
+    )
+    tag = email_account_tag(tenant_id, account_id)
+
+    async def fetch() -> tuple[int, dict]:
+        # Generation when this upstream request started (shared with joiners)
+        generation = await email_cache.tag_generation(tag) if EMAIL_CACHE_ENABLED else 0
+        return generation, await fetch_email(account_id, jwt_token, tenant_id)
+
+    generation, result = await email_flight.do(flight_key, fetch)
+    if (
+        EMAIL_CACHE_ENABLED
+        and result.get("status") == "success"
+        # A change invalidated the account while we fetched: the result may be stale
+        and await email_cache.tag_generation(tag) == generation
+    ):
+        await email_cache.set(cache_key, result, EMAIL_CACHE_TTL, tags=[tag])
+    return dict(result)
+
+
+async def update_email_cache(
+    jwt_token: str, tenant_id: str, account_id: str, new_email: str
+) -> None:
+    """Drop every cached view of the account after a change, then write the new value through"""
+    if not EMAIL_CACHE_ENABLED:
+        return
+    tag = email_account_tag(tenant_id, account_id)
+    await email_cache.invalidate_tag(tag)
+    if EMAIL_CACHE_WRITE_THROUGH:
+        await email_cache.set(
+            email_cache_key(tenant_id, get_principal(jwt_token), account_id),
+            {"status": "success", "email": new_email, "account_id": account_id},
+            EMAIL_CACHE_TTL,
+            tags=[tag],
         )
 
-        if result.returncode == 0:
-            data = json.loads(result.stdout)
-            if "message" in data and "email" in data:
-                print(
-                    f"[MCP] Email retrieved successfully: {data['email']} for account {data['account_id']}",
-                    file=sys.stderr,
-                )
-                return {
-                    "status": "success",
-                    "email": data['email'],
-                    "account_id": data['account_id']
-                }
-            else:
-                error_msg = data.get("message", "Unknown error")
-                print(f"[MCP] API error: {error_msg}", file=sys.stderr)
-                return {"status": "error", "message": error_msg}
+
+def upstream_unavailable(error: CircuitOpenError) -> dict:
+    """Tool result for a call failed fast by an open circuit breaker"""
+    return {
+        "status": "error",
+        "error": "upstream_unavailable",
+        "retry_after": round(error.retry_after, 3),
+        "message": str(error),
+    }
+
+
+async def fetch_email(account_id: str, jwt_token: str, tenant_id: str) -> dict:
+    """Call GET /get_email on the API server and map the response to a tool result"""
+    # Call REST API through the pooled upstream gateway
+    try:
+        path = f"/get_email/{account_id}"
+
+        async def send(headers: dict) -> tuple[int, dict]:
+            if HEDGE_ENABLED:
+                return await hedged_get(path, "/get_email/{account_id}", headers)
+            return await get_tenant_gateway(read=True).get(
+                path, endpoint="/get_email/{account_id}", headers=headers
+            )
+
+        status_code, data = await call_upstream(jwt_token, tenant_id, send)
+
+        if "message" in data and "email" in data:
+            log.info("get_email.success", account_id=data['account_id'])
+            return {
+                "status": "success",
+                "email": data['email'],
+                "account_id": data['account_id']
+            }
         else:
-            print(f"[MCP] Curl error: {result.stderr}", file=sys.stderr)
-            return {"status": "error", "message": f"Failed to call API: {result.stderr}"}
+            error_msg = data.get("message", f"Unknown error (HTTP {status_code})")
+            log.warning("get_email.api_error", account_id=account_id, status_code=status_code, message=error_msg)
+            return {"status": "error", "message": error_msg}
+    except CircuitOpenError as e:
+        log.info("get_email.circuit_open", account_id=account_id, retry_after=e.retry_after)
+        return upstream_unavailable(e)
     except Exception as e:
-        print(f"[MCP] Connection error: {str(e)}", file=sys.stderr)
+        log.error("get_email.connection_error", account_id=account_id, error=str(e))
         return {"status": "error", "message": f"Failed to connect to API server: {str(e)}"}
 
 
 @mcp.tool()
 async def change_email(
-    account_id: str,
+    account_id: Optional[str] = None,
     new_email: Optional[str] = None,
     user_confirmation: Optional[str] = None,
-    ctx: Context = None,
+    confirmation_token: Optional[str] = None,
 ) -> dict:
     """
     Change email address for an account (Human-in-the-loop workflow)
 
     Workflow:
     Step 1: If new_email is not provided, request it from AI Agent
-    Step 2: If new_email is provided but no confirmation, ask user for Y/N confirmation
-    Step 3: If confirmed (Y), call REST API to change email
+    Step 2: If new_email is provided, store the change and return a confirmation_token
+    Step 3: Confirm (Y) with confirmation_token and user_confirmation only; a confirmed
+            change is sent to the REST API exactly once. Any other answer returns a
+            follow-up question ("again T/F?") answered the same way: T confirms, F cancels
 
     Args:
         account_id: Account ID (5-10 digits)
         new_email: New email address (optional, will be requested if not provided)
         user_confirmation: User confirmation Y/N (optional, will be requested)
+        confirmation_token: Token returned by step 2
     """
-    print(
-        f"[MCP] change_email called - account_id: {account_id}, new_email: {new_email}, confirmation: {user_confirmation}",
-        file=sys.stderr,
+    log.info(
+        "change_email.called",
+        account_id=account_id,
+        new_email=new_email,
+        confirmation=user_confirmation,
+        has_token=bool(confirmation_token),
     )
 
     # Retrieve auth context from middleware
@@ -186,117 +754,556 @@ async def change_email(
     # If middleware didn't run, try to get it directly
     if not jwt_token:
         jwt_token, tenant_id = get_request_context()
+    principal = get_principal(jwt_token)
 
-    # # Authentication check
-    # is_valid, message = validate_auth(jwt_token, tenant_id)
-    # if not is_valid:
-    #     print(f"[MCP] Authentication failed: {message}", file=sys.stderr)
-    #     return f"Authentication failed: {message}"
+    # Steps 1-2 create a pending change; step 3 refers to it by token only
+    if not confirmation_token:
+        # Step 1: Check if new_email is provided
+        if not new_email:
+            log.info("change_email.request_email", account_id=account_id)
+            return {
+                "status": "pending",
+                "step": "request_email",
+                "message": "Please provide the new email address to proceed with the email change."
+            }
+        if not account_id:
+            return {"status": "error", "message": "account_id is required"}
+        if not ACCOUNT_ID_PATTERN.match(account_id):
+            return {"status": "error", "message": "Invalid account_id. Must be 5-10 digits"}
 
-    # Step 1: Check if new_email is provided
-    if not new_email:
-        print(
-            "[MCP] Step 1: Requesting new email from AI Agent", file=sys.stderr
-        )
+        # Step 2: Hold the change server-side until the user confirms it
+        record = pending_changes.create(tenant_id, principal, account_id, new_email)
+        log.info("change_email.confirmation", account_id=account_id, new_email=new_email)
+        return confirmation_prompt(record)
+
+    record = pending_changes.get(confirmation_token, tenant_id, principal)
+    if record is None or record.digest is not None:
+        log.info("change_email.unknown_token", tenant_id=tenant_id)
+        return {
+            "status": "error",
+            "error": "invalid_confirmation_token",
+            "message": "Confirmation token is unknown or expired. Please request the email change again.",
+        }
+    if not user_confirmation:
+        return reconfirm_prompt(record) if record.step == "reconfirm" else confirmation_prompt(record)
+
+    # Step 3: Process the answer. Nothing waits for the human here: a follow-up
+    # question is returned at once and the next call resumes from the record
+    answer = user_confirmation.strip().upper()
+    if record.result is None and answer != ("T" if record.step == "reconfirm" else "Y"):
+        if pending_changes.confirmed(record):
+            # An earlier call with this token already confirmed it; asking
+            # again (or cancelling) would not stop the write
+            log.info("change_email.already_confirmed", account_id=record.account_id)
+            return already_confirmed(record)
+        if record.step == "reconfirm":
+            if not pending_changes.discard(record):
+                return already_confirmed(record)
+            log.info("change_email.cancelled", account_id=record.account_id)
+            return {"status": "cancelled", "message": "Email change cancelled by user."}
+        pending_changes.prompt(record, "reconfirm")
+        log.info("change_email.reconfirm", account_id=record.account_id)
+        return reconfirm_prompt(record)
+
+    result, replayed = await pending_changes.confirm(
+        record, lambda r: send_email_change(r, jwt_token)
+    )
+    if replayed:
+        log.info("change_email.replayed", account_id=record.account_id, status=result.get("status"))
+    return result
+
+
+def already_confirmed(record: PendingChange) -> dict:
+    """Answer to a cancel that came too late: the stored result, or that the change is being applied"""
+    if record.result is not None:
+        return dict(record.result)
+    return {
+        "status": "error",
+        "error": "already_confirmed",
+        "message": "This change was already confirmed and is being applied; it can no longer be cancelled. "
+                   "Confirm again with the same token to get its result.",
+    }
+
+
+def reconfirm_prompt(record: PendingChange) -> dict:
+    """Follow-up after a non-Y answer; T changes the email, anything else cancels"""
+    return {
+        "status": "pending",
+        "step": "reconfirm",
+        "message": "Are you sure you want to change the email again T/F?",
+        "account_id": record.account_id,
+        "new_email": record.new_email,
+        "confirmation_token": record.token,
+        "expires_in": record.expires_in(),
+    }
+
+
+def audit_email_change(
+    record: PendingChange, tool: str, account_id: str, old_email: Optional[str], new_email: str
+) -> None:
+    """Queue the audit record of one applied change (written by the background writer)
+
+    Deduped on idempotency key and account: an upstream answer that replays
+    an already applied change (e.g. a confirmation rebuilt after its record
+    was evicted) is not audited twice.
+    """
+    audit_log.record(
+        "email.changed",
+        dedupe_key=f"{record.idempotency_key}:{account_id}",
+        tool=tool,
+        tenant_id=record.tenant_id,
+        principal=record.principal,
+        account_id=account_id,
+        old_email=old_email,
+        new_email=new_email,
+        # "confirmation" (answered Y) or "reconfirm" (answered T to the follow-up)
+        confirmation_path=record.step,
+        idempotency_key=record.idempotency_key,
+    )
+
+
+def confirmation_prompt(record: PendingChange) -> dict:
+    """Step 2 result: what to confirm and the token that confirms it"""
+    return {
+        "status": "pending",
+        "step": "confirmation",
+        "message": f"Are you sure you want to change the email for account {record.account_id} to {record.new_email}? Please confirm (Y/N).",
+        "account_id": record.account_id,
+        "new_email": record.new_email,
+        "confirmation_token": record.token,
+        "expires_in": record.expires_in(),
+    }
+
+
+async def send_email_change(record: PendingChange, jwt_token: str) -> tuple[dict, bool]:
+    """POST a confirmed change upstream; returns (result, final)
+
+    The Idempotency-Key lets the API Server drop duplicates, so the POST is
+    retried like an idempotent request. Failures with no upstream answer
+    (or a 5xx) are not final: the client may confirm the same token again.
+    """
+    account_id, new_email, tenant_id = record.account_id, record.new_email, record.tenant_id
+    # Call REST API to change email through the pooled upstream gateway
+    try:
+        async def send(headers: dict) -> tuple[int, dict]:
+            headers["Idempotency-Key"] = record.idempotency_key
+            return await get_tenant_gateway().post(
+                "/change_email",
+                json={"account_id": account_id, "new_email": new_email},
+                headers=headers,
+                idempotent=True,
+            )
+
+        status_code, data = await call_upstream(jwt_token, tenant_id, send)
+
+        if (
+            "message" in data
+            and data["message"] == "Email changed successfully"
+        ):
+            log.info(
+                "change_email.success",
+                account_id=data['account_id'],
+                new_email=data['new_email'],
+            )
+            audit_email_change(record, "change_email", data['account_id'], data.get('old_email'), data['new_email'])
+            await update_email_cache(
+                jwt_token, tenant_id, data['account_id'], data['new_email']
+            )
+            return {
+                "status": "success",
+                "message": f"Email changed successfully! Account {data['account_id']} now has email: {data['new_email']}",
+                "account_id": data['account_id'],
+                "new_email": data['new_email']
+            }, True
+        else:
+            error_msg = data.get("message", f"Unknown error (HTTP {status_code})")
+            log.warning("change_email.api_error", account_id=account_id, status_code=status_code, message=error_msg)
+            return {"status": "error", "message": error_msg}, status_code < 500
+    except CircuitOpenError as e:
+        log.info("change_email.circuit_open", account_id=account_id, retry_after=e.retry_after)
+        return upstream_unavailable(e), False
+    except Exception as e:
+        log.error("change_email.connection_error", account_id=account_id, error=str(e))
+        return {"status": "error", "message": f"Failed to connect to API server: {str(e)}"}, False
+
+
+@mcp.tool()
+async def change_emails(
+    changes: Optional[list[dict[str, str]]] = None,
+    user_confirmation: Optional[str] = None,
+    confirmation_token: Optional[str] = None,
+) -> dict:
+    """
+    Change email addresses for many accounts with one confirmation (bulk change_email)
+
+    Workflow:
+    Step 1: Call with changes; the whole batch is validated and held server-side,
+            and a confirmation_token is returned
+    Step 2: Confirm (Y) or cancel (N) with confirmation_token, user_confirmation and the
+            same changes again (the token only carries their digest); the batch is sent
+            to the REST API batch endpoint once, with a result per item
+
+    Args:
+        changes: List of {"account_id": "12345", "new_email": "user@example.com"}
+        user_confirmation: User confirmation Y/N (optional, will be requested)
+        confirmation_token: Token returned by step 1
+    """
+    log.info(
+        "change_emails.called",
+        count=len(changes) if changes else 0,
+        confirmation=user_confirmation,
+        has_token=bool(confirmation_token),
+    )
+    jwt_token, tenant_id = auth_context_var.get()
+    if not jwt_token:
+        jwt_token, tenant_id = get_request_context()
+    principal = get_principal(jwt_token)
+
+    if not confirmation_token:
+        # Step 1: Validate the whole batch before holding it for confirmation
+        error = validate_email_changes(changes)
+        if error:
+            log.info("change_emails.invalid", count=len(changes or ()), message=error["message"])
+            return error
+        batch = batch_changes(changes)
+        record = pending_changes.create_batch(tenant_id, principal, batch)
+        log.info("change_emails.confirmation", count=len(batch))
+        return batch_confirmation_prompt(record)
+
+    record = pending_changes.get(confirmation_token, tenant_id, principal)
+    if record is None or record.digest is None:
+        log.info("change_emails.unknown_token", tenant_id=tenant_id)
         return {
-            "status": "pending",
-            "step": "request_email",
-            "message": "Please provide the new email address to proceed with the email change."
+            "status": "error",
+            "error": "invalid_confirmation_token",
+            "message": "Confirmation token is unknown or expired. Please submit the batch again.",
         }
+    # The token seals only the digest: any worker accepts the batch it was issued for
+    if changes:
+        batch = batch_changes(changes)
+        if changes_digest(batch) != record.digest:
+            log.info("change_emails.changes_mismatch", count=len(batch))
+            return {
+                "status": "error",
+                "error": "changes_mismatch",
+                "message": "changes differ from the batch this confirmation_token was issued for.",
+            }
+        record.changes = batch
 
-    # Step 2: Check if user confirmation is provided
+    # Step 2: Process confirmation
+    if user_confirmation and user_confirmation.upper() != "Y":
+        if not pending_changes.discard(record):
+            # Confirmed by an earlier call: the writes are applied or under way
+            log.info("change_emails.already_confirmed", count=len(record.changes or ()))
+            return already_confirmed(record)
+        log.info("change_emails.cancelled", count=len(record.changes or ()))
+        return {"status": "cancelled", "message": "Email changes cancelled by user."}
+    if record.changes is None:
+        return {
+            "status": "error",
+            "error": "changes_required",
+            "message": "Send the same changes again together with the confirmation_token.",
+        }
     if not user_confirmation:
-        print(
-            f"[MCP] Step 2: Requesting user confirmation for {new_email}",
-            file=sys.stderr,
-        )
+        return batch_confirmation_prompt(record)
+
+    result, replayed = await pending_changes.confirm(
+        record, lambda r: send_email_changes(r, jwt_token)
+    )
+    if replayed:
+        log.info("change_emails.replayed", count=len(record.changes), status=result.get("status"))
+    return result
+
+
+def validate_email_changes(changes: Optional[list]) -> Optional[dict]:
+    """Error result for an invalid batch (every bad item listed), or None"""
+    if not changes:
+        return {"status": "error", "message": "changes must not be empty"}
+    if len(changes) > CHANGE_EMAILS_MAX_BATCH:
+        return {
+            "status": "error",
+            "message": f"Too many changes: {len(changes)} (max {CHANGE_EMAILS_MAX_BATCH})",
+        }
+    invalid = []
+    seen = set()
+    for index, change in enumerate(changes):
+        account_id = str(change.get("account_id", ""))
+        new_email = str(change.get("new_email", ""))
+        if not ACCOUNT_ID_PATTERN.match(account_id):
+            reason = "Invalid account_id. Must be 5-10 digits"
+        elif not EMAIL_PATTERN.match(new_email):
+            reason = "Invalid email format"
+        elif account_id in seen:
+            reason = "Duplicate account_id in batch"
+        else:
+            seen.add(account_id)
+            continue
+        invalid.append({"index": index, "account_id": account_id, "message": reason})
+    if invalid:
         return {
-            "status": "pending",
-            "step": "confirmation",
-            "message": f"Are you sure you want to change the email for account {account_id} to {new_email}? Please confirm (Y/N).",
-            "account_id": account_id,
-            "new_email": new_email
+            "status": "error",
+            "message": f"{len(invalid)} of {len(changes)} changes are invalid; nothing was submitted",
+            "invalid": invalid,
         }
+    return None
 
-    # Step 3: Process confirmation
-    if user_confirmation.upper() != "Y":
-        if ctx:
-            result = await ctx.elicit(
-                message="Are you sure you want to change the email again T/F?",
-                response_type=str
-            )
-            if result.action == "T":
-                return {"status": "success", "message": "Email changed successfullly by user."}
-            else:
-                return {"status": "cancelled", "message": "Email change cancelled by user."}
-        print("[MCP] Step 3: Email change cancelled by user", file=sys.stderr)
-        return {"status": "cancelled", "message": "Email change cancelled by user."}
-
-    # Call REST API to change email using curl
+
+def batch_changes(changes: list) -> list[dict]:
+    """The account_id/new_email pairs of a change_emails batch, as held and digested"""
+    return [
+        {"account_id": str(c.get("account_id", "")), "new_email": str(c.get("new_email", ""))}
+        for c in changes
+    ]
+
+
+def batch_confirmation_prompt(record: PendingChange) -> dict:
+    """Step 1 result of change_emails: a preview of the batch and its token"""
+    count = len(record.changes)
+    return {
+        "status": "pending",
+        "step": "confirmation",
+        "message": f"Are you sure you want to change the email for {count} accounts? Please confirm (Y/N).",
+        "count": count,
+        "preview": record.changes[:CHANGE_EMAILS_PREVIEW],
+        "confirmation_token": record.token,
+        "expires_in": record.expires_in(),
+    }
+
+
+async def send_email_changes(record: PendingChange, jwt_token: str) -> tuple[dict, bool]:
+    """POST a confirmed batch to /change_emails; returns (result, final)
+
+    The API Server applies items independently and answers with a result per
+    item, so one bad item does not fail the batch. As with change_email, the
+    Idempotency-Key makes the POST safe to retry.
+    """
+    tenant_id = record.tenant_id
     try:
-        payload = json.dumps(
-            {"account_id": account_id, "new_email": new_email}
-        )
-        result = subprocess.run(
-            [
-                "curl",
-                "-s",
-                "-X",
-                "POST",
-                f"{API_BASE_URL}/change_email",
-                "-H",
-                f"Authorization: Bearer {jwt_token}",
-                "-H",
-                f"x-cdl-tenant-id: {tenant_id}",
-                "-H",
-                "Content-Type: application/json",
-                "-d",
-                payload,
-            ],
-            capture_output=True,
-            text=True,
-            timeout=10,
-        )
+        async def send(headers: dict) -> tuple[int, dict]:
+            headers["Idempotency-Key"] = record.idempotency_key
+            return await get_tenant_gateway().post(
+                "/change_emails",
+                json={"changes": record.changes},
+                headers=headers,
+                idempotent=True,
+            )
 
-        if result.returncode == 0:
-            data = json.loads(result.stdout)
-            if (
-                "message" in data
-                and data["message"] == "Email changed successfully"
-            ):
-                print(
-                    f"[MCP] Step 3: Email changed successfully - {data['account_id']} -> {data['new_email']}",
-                    file=sys.stderr,
-                )
-                return {
-                    "status": "success",
-                    "message": f"Email changed successfully! Account {data['account_id']} now has email: {data['new_email']}",
-                    "account_id": data['account_id'],
-                    "new_email": data['new_email']
-                }
-            else:
-                error_msg = data.get("message", "Unknown error")
-                print(f"[MCP] API error: {error_msg}", file=sys.stderr)
-                return {"status": "error", "message": error_msg}
-        else:
-            print(f"[MCP] Curl error: {result.stderr}", file=sys.stderr)
-            return {"status": "error", "message": f"Failed to call API: {result.stderr}"}
+        status_code, data = await call_upstream(jwt_token, tenant_id, send)
+    except CircuitOpenError as e:
+        log.info("change_emails.circuit_open", count=len(record.changes), retry_after=e.retry_after)
+        return upstream_unavailable(e), False
     except Exception as e:
-        print(f"[MCP] Connection error: {str(e)}", file=sys.stderr)
-        return {"status": "error", "message": f"Failed to connect to API server: {str(e)}"}
+        log.error("change_emails.connection_error", count=len(record.changes), error=str(e))
+        return {"status": "error", "message": f"Failed to connect to API server: {str(e)}"}, False
+
+    if status_code != 200 or not isinstance(data.get("results"), list):
+        error_msg = data.get("message", f"Unknown error (HTTP {status_code})")
+        log.warning("change_emails.api_error", count=len(record.changes), status_code=status_code, message=error_msg)
+        return {"status": "error", "message": error_msg}, status_code < 500
+
+    upstream = {item.get("account_id"): item for item in data["results"]}
+    results = []
+    for change in record.changes:
+        account_id = change["account_id"]
+        item = upstream.get(account_id)
+        if item is None:
+            results.append({"account_id": account_id, "status": "error", "message": "No result from API server"})
+        elif item.get("status") == "success":
+            results.append({"account_id": account_id, "status": "success", "new_email": item["new_email"]})
+            await update_email_cache(jwt_token, tenant_id, account_id, item["new_email"])
+            audit_email_change(record, "change_emails", account_id, item.get("old_email"), item["new_email"])
+        else:
+            results.append({
+                "account_id": account_id,
+                "status": "error",
+                "message": item.get("message", "Unknown error"),
+            })
+
+    result = batch_result(results)
+    log.info("change_emails.finished", succeeded=result["succeeded"], failed=result["failed"])
+    return result, True
+
+
+def chart_content(name: str) -> ImageContent:
+    """Pre-encoded image content for a registered chart"""
+    asset = chart_assets.get(name)
+    return ImageContent(type="image", data=asset.b64, mimeType=asset.mime_type)
+
+
+def chart_meta(asset) -> dict:
+    """Content hash and chunking info advertised with a chart resource"""
+    chunk_uri = f"chart://{asset.name}/{asset.sha256}/chunks/{{index}}"
+    return {
+        "sha256": asset.sha256,
+        "chunk_size": CHART_CHUNK_SIZE,
+        "chunks": max(1, math.ceil(asset.size / CHART_CHUNK_SIZE)),
+        "chunk_uri_template": chunk_uri,
+    }
+
+
+def chart_link(name: str) -> ResourceLink:
+    """Reference to a chart resource; the client reads the bytes only if it needs them"""
+    asset = chart_assets.get(name)
+    return ResourceLink(
+        type="resource_link",
+        uri=f"chart://{name}",
+        name=name,
+        description=f"Chart image ({asset.size} bytes, sha256 {asset.sha256[:12]})",
+        mimeType=asset.mime_type,
+        size=asset.size,
+        _meta=chart_meta(asset),
+    )
+
+
+class ChartResource(Resource):
+    """A chart served from the preloaded asset registry"""
+
+    asset_name: str
+
+    async def read(self) -> bytes:
+        # EncodedBytes: read_resource_handler sends its stored base64 as is
+        return chart_assets.get(self.asset_name).data
+
+    def to_mcp_resource(self, **overrides) -> MCPResource:
+        # Size and hash come from the registry so a reloaded file is reflected
+        asset = chart_assets.get(self.asset_name)
+        resource = super().to_mcp_resource(**overrides)
+        resource.size = asset.size
+        resource.meta = {**(resource.meta or {}), **chart_meta(asset)}
+        return resource
+
+
+for _chart in CHART_FILES:
+    mcp.add_resource(
+        ChartResource(
+            uri=f"chart://{_chart}",
+            name=_chart,
+            description="Sample chart image",
+            mime_type=chart_assets.get(_chart).mime_type,
+            asset_name=_chart,
+        )
+    )
+
+
+async def read_resource_handler(request: ReadResourceRequest) -> ServerResult:
+    """resources/read without re-encoding payloads that are already base64 (EncodedBytes)
+
+    Same as the SDK's default handler, which base64-encodes every bytes result
+    on each read; reads still go through the FastMCP middleware (auth, metrics).
+    """
+    uri = request.params.uri
+    contents = []
+    for item in await mcp._read_resource_mcp(uri):
+        if isinstance(item.content, str):
+            contents.append(TextResourceContents(uri=uri, text=item.content, mimeType=item.mime_type or "text/plain"))
+            continue
+        blob = getattr(item.content, "b64", "") or base64.b64encode(item.content).decode("ascii")
+        contents.append(BlobResourceContents(uri=uri, blob=blob, mimeType=item.mime_type or "application/octet-stream"))
+    return ServerResult(ReadResourceResult(contents=contents))
+
+
+# Private FastMCP hooks (pinned in requirements.txt, covered by test_resources.py):
+# if they move, keep the default handler rather than break resources/read
+if hasattr(mcp, "_read_resource_mcp") and ReadResourceRequest in mcp._mcp_server.request_handlers:
+    mcp._mcp_server.request_handlers[ReadResourceRequest] = read_resource_handler
+else:
+    log.warning("resources.default_read_handler", reason="fastmcp internals changed")
+
+
+@mcp.resource(
+    "chart://{name}/{sha256}/chunks/{index}",
+    mime_type="application/octet-stream",
+    description="One CHART_CHUNK_SIZE slice of a chart, pinned to its content hash",
+)
+def read_chart_chunk(name: str, sha256: str, index: str) -> bytes:
+    """Return one chunk of a chart (see chunk_uri_template in the chart's _meta)"""
+    if name not in chart_assets.names():
+        raise ResourceError(f"Unknown chart: {name}")
+    asset = chart_assets.get(name)
+    if sha256 != asset.sha256:
+        raise ResourceError(f"Chart {name} has changed; fetch chart://{name} again")
+    start = int(index) * CHART_CHUNK_SIZE
+    if start < 0 or start >= max(asset.size, 1):
+        raise ResourceError(f"Chunk index out of range: {index}")
+    return asset.data[start:start + CHART_CHUNK_SIZE]
+
 
 @mcp.tool
-def get_chart() -> Image:
-    """Generate a chart image."""
-    return Image(path="image01.png")
+def get_chart(inline: bool = False) -> ResourceLink | ImageContent:
+    """Generate a chart image.
+
+    Returns a resource link to chart://image01.png; read the resource to get
+    the bytes. Pass inline=True to embed the base64 image instead.
+    """
+    if inline:
+        return chart_content("image01.png")
+    return chart_link("image01.png")
 
 @mcp.tool
-def get_multiple_charts() -> list[Image]:
-    """Return multiple charts."""
-    return [Image(path="image01.png"), Image(path="image02.png")]
+def get_multiple_charts(inline: bool = False) -> list[ResourceLink | ImageContent]:
+    """Return multiple charts.
+
+    Returns resource links (chart://...) unless inline=True.
+    """
+    if inline:
+        return [chart_content(name) for name in CHART_FILES]
+    return [chart_link(name) for name in CHART_FILES]
+
+def create_app():
+    """ASGI app factory used by each worker in multi-worker mode
+
+    Workers share the listening port, and a client's requests may land on
+    any of them, so the streamable HTTP transport runs stateless (no
+    per-worker MCP session lookup). The server lifespan still runs once per
+    worker, warming up that worker's own upstream pool. Each worker writes
+    its own audit file (audit-<pid>.jsonl), so rotation never races.
+    """
+    stem, suffix = os.path.splitext(audit_log.path)
+    audit_log.path = f"{stem}-{os.getpid()}{suffix}"
+    return mcp.http_app(stateless_http=True)
+
 
 if __name__ == "__main__":
-    print(f"[MCP] Starting MCP Server on port {PORT}...", file=sys.stderr)
-    print(f"[MCP] Transport: SSE", file=sys.stderr)
-    print(f"[MCP] API Server: {API_BASE_URL}", file=sys.stderr)
-    mcp.run(transport="http", host="localhost", port=PORT)
+    parser = argparse.ArgumentParser(description="ThaiInternalMCP server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=MCP_WORKERS,
+        help="Number of worker processes sharing the port (default: MCP_WORKERS or 1)",
+    )
+    args = parser.parse_args()
+
+    log.info(
+        "server.starting",
+        port=args.port,
+        transport="http",
+        workers=args.workers,
+        api_server=API_BASE_URL,
+        upstream_auth_mode=UPSTREAM_AUTH_MODE,
+    )
+    if args.workers > 1:
+        # Workers inherit the environment, so they all open the same file and a
+        # cancel on one is final on the others
+        state_file = None
+        if "PENDING_CHANGE_STATE_FILE" not in os.environ:
+            state_file = os.path.join(tempfile.gettempdir(), f"thai-mcp-pending-{os.getpid()}.sqlite3")
+            os.environ["PENDING_CHANGE_STATE_FILE"] = state_file
+        try:
+            uvicorn.run(
+                "server:create_app",
+                factory=True,
+                host=args.host,
+                port=args.port,
+                workers=args.workers,
+                app_dir=os.path.dirname(os.path.abspath(__file__)),
+                timeout_graceful_shutdown=0,
+            )
+        finally:
+            if state_file:
+                for path in (state_file, state_file + "-wal", state_file + "-shm"):
+                    if os.path.exists(path):
+                        os.remove(path)
+    else:
+        mcp.run(transport="http", host=args.host, port=args.port)
@@ -0,0 +1,344 @@
+"""
+Thai Phung - Per-tenant routing across sharded API Server backends
+
+The routing table (SHARDS_FILE) lists the upstream shards and optional
+explicit tenant assignments:
+
+    {
+        "shards": [
+            {"name": "shard-a", "base_url": "http://localhost:3006"},
+            {"name": "shard-b", "base_url": "http://localhost:3016", "weight": 2,
+             "replicas": ["http://localhost:3017"]}
+        ],
+        "assignments": {"test123": "shard-b"}
+    }
+
+An assigned tenant always goes to its shard. Every other tenant is placed on
+a consistent-hash ring (SHARD_VNODES points per unit of weight, keyed by
+shard name), so adding or removing a shard only moves the tenants of that
+shard. Each shard gets its own pooled gateway (upstream.get_gateway).
+`replicas` are other base URLs serving the same data; hedged reads
+(hedging.py) send their second attempt there.
+
+A background task probes the health endpoint of every base URL (primary and
+replicas) and re-reads the file when it changes. A tenant always stays on the
+shard that owns its data. With SHARD_FAILOVER, a read whose primary is
+unhealthy goes to a healthy replica of the same shard; writes always go to
+the primary. Removed base URLs have their connection pool closed after
+in-flight requests had time to end.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+
+import httpx
+
+from mcp_logging import get_logger
+from upstream import UPSTREAM_TIMEOUT, close_gateway, get_gateway
+
+log = get_logger("shards")
+
+# Configuration
+# Routing table; empty means every tenant uses API_BASE_URL
+SHARDS_FILE = os.environ.get("SHARDS_FILE", "")
+SHARD_VNODES = int(os.environ.get("SHARD_VNODES", "100"))
+# Seconds between health probes (and checks for changes to SHARDS_FILE)
+SHARD_CHECK_INTERVAL = float(os.environ.get("SHARD_CHECK_INTERVAL", "5"))
+SHARD_HEALTH_PATH = os.environ.get("SHARD_HEALTH_PATH", "/health")
+SHARD_HEALTH_TIMEOUT = float(os.environ.get("SHARD_HEALTH_TIMEOUT", "2"))
+# Consecutive failed probes before a shard is marked unhealthy
+SHARD_UNHEALTHY_THRESHOLD = int(os.environ.get("SHARD_UNHEALTHY_THRESHOLD", "2"))
+# Send reads to a healthy replica while the shard's primary is unhealthy
+SHARD_FAILOVER = os.environ.get("SHARD_FAILOVER", "0") == "1"
+
+
+class ShardConfigError(Exception):
+    """Raised when the shards file cannot be parsed"""
+
+
+class Shard:
+    """One upstream API Server (with its replicas) and their health state"""
+
+    __slots__ = ("name", "base_url", "weight", "replicas", "failures", "down")
+
+    def __init__(self, name: str, base_url: str, weight: int = 1, replicas: Optional[list] = None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.weight = weight
+        self.replicas = [url.rstrip("/") for url in replicas or ()]
+        # Consecutive failed health probes, per base URL
+        self.failures = {url: 0 for url in self.base_urls}
+        # Base URLs marked unhealthy
+        self.down: set[str] = set()
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Shard":
+        name = data.get("name")
+        if not isinstance(name, str) or not name:
+            raise ShardConfigError(f"Shard without a name: {data!r}")
+        base_url = data.get("base_url")
+        if not isinstance(base_url, str) or not base_url.startswith(("http://", "https://")):
+            raise ShardConfigError(f"Shard {name}: base_url must be an http(s) URL")
+        weight = data.get("weight", 1)
+        if not isinstance(weight, int) or weight < 1:
+            raise ShardConfigError(f"Shard {name}: weight must be a positive integer")
+        replicas = data.get("replicas") or []
+        if not isinstance(replicas, list) or not all(
+            isinstance(url, str) and url.startswith(("http://", "https://")) for url in replicas
+        ):
+            raise ShardConfigError(f"Shard {name}: replicas must be a list of http(s) URLs")
+        return cls(name, base_url, weight, replicas)
+
+    @property
+    def base_urls(self) -> list[str]:
+        """Primary base URL first, then the replicas"""
+        return [self.base_url, *self.replicas]
+
+    @property
+    def healthy(self) -> bool:
+        """Whether the primary passes its health checks"""
+        return self.base_url not in self.down
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring of shards with weighted virtual nodes"""
+
+    def __init__(self, shards: list[Shard], vnodes: int = SHARD_VNODES):
+        points = sorted(
+            (_hash(f"{shard.name}#{i}"), shard)
+            for shard in shards
+            for i in range(vnodes * shard.weight)
+        )
+        self._points = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def lookup(self, key: str) -> Optional[Shard]:
+        """Shard owning key"""
+        if not self._points:
+            return None
+        return self._owners[bisect.bisect(self._points, _hash(key)) % len(self._points)]
+
+
+def load_shards(path: str) -> tuple[dict[str, Shard], dict[str, str]]:
+    """Parse the shards file into (name -> Shard, tenant_id -> shard name)"""
+    try:
+        with open(path, "rb") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ShardConfigError(f"Cannot read {path}: {e}") from e
+    entries = data.get("shards") if isinstance(data, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise ShardConfigError(f"{path}: expected {{\"shards\": [...]}} with at least one shard")
+
+    shards = {}
+    for entry in entries:
+        shard = Shard.from_dict(entry)
+        if shard.name in shards:
+            raise ShardConfigError(f"{path}: duplicate shard {shard.name}")
+        shards[shard.name] = shard
+    assignments = data.get("assignments") or {}
+    if not isinstance(assignments, dict):
+        raise ShardConfigError(f"{path}: assignments must be an object")
+    for tenant_id, name in assignments.items():
+        if name not in shards:
+            raise ShardConfigError(f"{path}: tenant {tenant_id} assigned to unknown shard {name!r}")
+    return shards, dict(assignments)
+
+
+class ShardRouter:
+    """Tenant -> shard routing table, health-checked and hot-reloaded in the background"""
+
+    def __init__(
+        self,
+        path: str = SHARDS_FILE,
+        vnodes: int = SHARD_VNODES,
+        check_interval: float = SHARD_CHECK_INTERVAL,
+        health_path: str = SHARD_HEALTH_PATH,
+        health_timeout: float = SHARD_HEALTH_TIMEOUT,
+        unhealthy_threshold: int = SHARD_UNHEALTHY_THRESHOLD,
+        failover: bool = SHARD_FAILOVER,
+    ):
+        self.path = path
+        self.vnodes = vnodes
+        self.check_interval = check_interval
+        self.health_path = health_path
+        self.health_timeout = health_timeout
+        self.unhealthy_threshold = unhealthy_threshold
+        self.failover = failover
+        self._shards: dict[str, Shard] = {}
+        self._assignments: dict[str, str] = {}
+        self._ring = HashRing([])
+        self._mtime_ns = -1
+        self._size = -1
+        self._task: Optional[asyncio.Task] = None
+        # Pending _retire() tasks (referenced so they are not garbage-collected)
+        self._retiring: set[asyncio.Task] = set()
+        self.reloads = 0
+        self.reload_failures = 0
+        self.failovers = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def load(self) -> None:
+        """Initial load; a missing or invalid file is fatal at startup"""
+        if not self.enabled:
+            return
+        stat = os.stat(self.path)
+        self._swap(*load_shards(self.path))
+        self._mtime_ns, self._size = stat.st_mtime_ns, stat.st_size
+        log.info("shards.loaded", path=self.path, shards=sorted(self._shards), assignments=len(self._assignments))
+
+    def route(self, tenant_id: str) -> Optional[Shard]:
+        """Shard owning tenant_id's data, or None when sharding is off"""
+        name = self._assignments.get(tenant_id)
+        if name is not None:
+            return self._shards[name]
+        return self._ring.lookup(tenant_id)
+
+    def base_urls(self, shard: Shard, read: bool = False) -> list[str]:
+        """shard's base URLs to use, primary first
+
+        With failover, a read whose primary is unhealthy is sent to a healthy
+        replica first. Writes stay on the primary: replicas may not take them.
+        """
+        if not read or not self.failover or shard.healthy:
+            return shard.base_urls
+        for url in shard.replicas:
+            if url not in shard.down:
+                self.failovers += 1
+                return [url, *(other for other in shard.base_urls if other != url)]
+        # No healthy replica: stay on the primary and let its circuit breakers decide
+        return shard.base_urls
+
+    def _swap(self, shards: dict[str, Shard], assignments: dict[str, str]) -> None:
+        # Base URLs still in the table keep their health state
+        previous = {
+            url: (shard.failures[url], url in shard.down)
+            for shard in self._shards.values()
+            for url in shard.base_urls
+        }
+        for shard in shards.values():
+            for url in shard.base_urls:
+                if url in previous:
+                    shard.failures[url], down = previous[url]
+                    if down:
+                        shard.down.add(url)
+        ring = HashRing(list(shards.values()), self.vnodes)
+        # Built fully off to the side, then swapped in; route() never sees a mix
+        self._shards, self._assignments, self._ring = shards, assignments, ring
+
+    async def _maybe_reload(self) -> None:
+        try:
+            stat = os.stat(self.path)
+        except OSError as e:
+            log.warning("shards.stat_failed", path=self.path, error=str(e))
+            return
+        if stat.st_mtime_ns == self._mtime_ns and stat.st_size == self._size:
+            return
+        self._mtime_ns, self._size = stat.st_mtime_ns, stat.st_size
+        try:
+            shards, assignments = await asyncio.to_thread(load_shards, self.path)
+        except ShardConfigError as e:
+            # Keep routing with the last good table until the file is fixed
+            self.reload_failures += 1
+            log.error("shards.reload_failed", path=self.path, error=str(e))
+            return
+        previous = {url for shard in self._shards.values() for url in shard.base_urls}
+        self._swap(shards, assignments)
+        self.reloads += 1
+        log.info("shards.reloaded", path=self.path, shards=sorted(shards), assignments=len(assignments))
+        for base_url in previous - {url for shard in shards.values() for url in shard.base_urls}:
+            task = asyncio.create_task(self._retire(base_url))
+            self._retiring.add(task)
+            task.add_done_callback(self._retiring.discard)
+
+    async def _retire(self, base_url: str) -> None:
+        """Close a removed shard's pool once its in-flight requests have timed out at the latest"""
+        await asyncio.sleep(UPSTREAM_TIMEOUT)
+        if all(base_url not in shard.base_urls for shard in self._shards.values()):
+            await close_gateway(base_url)
+            log.info("shards.retired", base_url=base_url)
+
+    async def check_health(self) -> None:
+        """Probe every base URL of every shard once (concurrently)"""
+        await asyncio.gather(*(
+            self._probe(shard, url) for shard in list(self._shards.values()) for url in shard.base_urls
+        ))
+
+    async def _probe(self, shard: Shard, base_url: str) -> None:
+        start = time.perf_counter()
+        try:
+            response = await get_gateway(base_url).client.get(
+                self.health_path, timeout=self.health_timeout
+            )
+            ok = response.status_code < 500
+            reason = f"HTTP {response.status_code}"
+        except httpx.HTTPError as e:
+            ok = False
+            reason = type(e).__name__
+        if ok:
+            shard.failures[base_url] = 0
+            if base_url in shard.down:
+                shard.down.discard(base_url)
+                log.info(
+                    "shards.healthy",
+                    shard=shard.name,
+                    base_url=base_url,
+                    latency=round(time.perf_counter() - start, 3),
+                )
+            return
+        shard.failures[base_url] += 1
+        if base_url not in shard.down and shard.failures[base_url] >= self.unhealthy_threshold:
+            shard.down.add(base_url)
+            log.warning("shards.unhealthy", shard=shard.name, base_url=base_url, reason=reason)
+
+    async def _check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self._maybe_reload()
+            await self.check_health()
+
+    async def start(self) -> None:
+        """Probe (and warm up) every shard, then start the background checks"""
+        if not self.enabled or self._task is not None:
+            return
+        await self.check_health()
+        self._task = asyncio.create_task(self._check_loop())
+
+    async def stop(self) -> None:
+        # Pools of retiring base URLs are closed with every other pool on shutdown
+        for task in list(self._retiring):
+            task.cancel()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def healthy_count(self) -> int:
+        return sum(1 for shard in self._shards.values() if shard.healthy)
+
+    def stats(self) -> dict:
+        return {
+            "shards": {name: shard.healthy for name, shard in self._shards.items()},
+            "assignments": len(self._assignments),
+            "reloads": self.reloads,
+            "reload_failures": self.reload_failures,
+            "failovers": self.failovers,
+        }
+
+    def __len__(self) -> int:
+        return len(self._shards)
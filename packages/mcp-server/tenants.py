@@ -0,0 +1,173 @@
+"""
+Thai Phung - Tenant registry for the MCP Server
+
+Tenant definitions (status, allowed tools, upstream base URL, limits) are
+loaded from a JSON file into a dict keyed by tenant ID, so each lookup is a
+single hash probe regardless of how many tenants exist. When the file
+changes, the whole index is rebuilt on a background thread and swapped in,
+so lookups never wait on parsing and see either the old or the new set of
+tenants, never a mix.
+
+    {"tenants": [{"tenant_id": "test123", "status": "active"}]}
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from mcp_logging import get_logger
+
+log = get_logger("tenants")
+
+# Configuration
+TENANTS_FILE = os.environ.get(
+    "TENANTS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tenants.json")
+)
+# Minimum seconds between stat() checks of the tenants file
+TENANTS_CHECK_INTERVAL = float(os.environ.get("TENANTS_CHECK_INTERVAL", "2"))
+
+TENANT_STATUSES = ("active", "suspended")
+
+
+class TenantConfigError(Exception):
+    """Raised when the tenants file cannot be parsed"""
+
+
+class Tenant:
+    """One tenant definition (read-only once loaded)"""
+
+    __slots__ = ("tenant_id", "status", "allowed_tools", "upstream_base_url", "limits")
+
+    def __init__(
+        self,
+        tenant_id: str,
+        status: str = "active",
+        allowed_tools: Optional[frozenset] = None,
+        upstream_base_url: Optional[str] = None,
+        limits: Optional[dict] = None,
+    ):
+        self.tenant_id = tenant_id
+        self.status = status
+        # None means every tool is allowed
+        self.allowed_tools = allowed_tools
+        self.upstream_base_url = upstream_base_url
+        self.limits = limits or {}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Tenant":
+        tenant_id = data.get("tenant_id")
+        if not isinstance(tenant_id, str) or not tenant_id:
+            raise TenantConfigError(f"Tenant without a tenant_id: {data!r}")
+        status = data.get("status", "active")
+        if status not in TENANT_STATUSES:
+            raise TenantConfigError(f"Tenant {tenant_id}: unknown status {status!r}")
+        allowed_tools = data.get("allowed_tools")
+        if allowed_tools is not None and not isinstance(allowed_tools, list):
+            raise TenantConfigError(f"Tenant {tenant_id}: allowed_tools must be a list")
+        limits = data.get("limits") or {}
+        if not isinstance(limits, dict):
+            raise TenantConfigError(f"Tenant {tenant_id}: limits must be an object")
+        return cls(
+            tenant_id=tenant_id,
+            status=status,
+            allowed_tools=frozenset(allowed_tools) if allowed_tools is not None else None,
+            upstream_base_url=data.get("upstream_base_url") or None,
+            limits=limits,
+        )
+
+    @property
+    def is_active(self) -> bool:
+        return self.status == "active"
+
+    def allows_tool(self, tool: str) -> bool:
+        return self.allowed_tools is None or tool in self.allowed_tools
+
+
+def load_tenants(path: str) -> dict[str, Tenant]:
+    """Parse the tenants file into a tenant_id -> Tenant index"""
+    try:
+        with open(path, "rb") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise TenantConfigError(f"Cannot read {path}: {e}") from e
+    entries = data.get("tenants") if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        raise TenantConfigError(f"{path}: expected {{\"tenants\": [...]}}")
+
+    index = {}
+    for entry in entries:
+        tenant = Tenant.from_dict(entry)
+        if tenant.tenant_id in index:
+            raise TenantConfigError(f"{path}: duplicate tenant_id {tenant.tenant_id}")
+        index[tenant.tenant_id] = tenant
+    return index
+
+
+class TenantRegistry:
+    """Tenant index loaded from a file and hot-reloaded when it changes"""
+
+    def __init__(self, path: str = TENANTS_FILE, check_interval: float = TENANTS_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._tenants: dict[str, Tenant] = {}
+        self._lock = threading.Lock()
+        self._mtime_ns = -1
+        self._size = -1
+        self._checked_at = 0.0
+        self._reloading = False
+        self.reloads = 0
+        self.reload_failures = 0
+
+    def load(self) -> None:
+        """Initial load; a missing or invalid file is fatal at startup"""
+        stat = os.stat(self.path)
+        self._tenants = load_tenants(self.path)
+        self._mtime_ns, self._size = stat.st_mtime_ns, stat.st_size
+        self._checked_at = time.monotonic()
+        log.info("tenants.loaded", path=self.path, tenants=len(self._tenants))
+
+    def get(self, tenant_id: Optional[str]) -> Optional[Tenant]:
+        """Tenant record for tenant_id, or None if it is not registered"""
+        if not tenant_id:
+            return None
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._maybe_reload()
+        return self._tenants.get(tenant_id)
+
+    def _maybe_reload(self) -> None:
+        """Stat the file; if it changed, rebuild the index on a background thread"""
+        with self._lock:
+            now = time.monotonic()
+            if self._reloading or now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except OSError as e:
+                log.warning("tenants.stat_failed", path=self.path, error=str(e))
+                return
+            if stat.st_mtime_ns == self._mtime_ns and stat.st_size == self._size:
+                return
+            self._mtime_ns, self._size = stat.st_mtime_ns, stat.st_size
+            self._reloading = True
+        threading.Thread(target=self._reload, name="tenant-reload", daemon=True).start()
+
+    def _reload(self) -> None:
+        try:
+            tenants = load_tenants(self.path)
+        except TenantConfigError as e:
+            # Keep serving the last good index until the file is fixed
+            self.reload_failures += 1
+            log.error("tenants.reload_failed", path=self.path, error=str(e))
+        else:
+            # Built fully off to the side, then swapped in with one assignment
+            self._tenants = tenants
+            self.reloads += 1
+            log.info("tenants.reloaded", path=self.path, tenants=len(tenants))
+        finally:
+            self._reloading = False
+
+    def __len__(self) -> int:
+        return len(self._tenants)
@@ -0,0 +1,76 @@
+"""Behaviour tests for the adaptive concurrency limit (python -m pytest test_admission.py)"""
+from admission import AdaptiveLimiter
+
+
+def new_limiter(**kwargs) -> AdaptiveLimiter:
+    # window=0: every observation closes a window
+    options = dict(initial_limit=10, min_limit=2, max_limit=20, window=0, tolerance=2, backoff=0.9)
+    options.update(kwargs)
+    return AdaptiveLimiter(**options)
+
+
+def test_sheds_over_limit_and_readmits_after_release():
+    limiter = new_limiter(initial_limit=2, min_limit=1, min_retry_after=0.5)
+    assert limiter.try_acquire() is None
+    assert limiter.try_acquire() is None
+    shed = limiter.try_acquire()
+    assert shed.to_dict() == {
+        "status": "error",
+        "error": "overloaded",
+        "limit": 2,
+        "retry_after": 0.5,
+        "message": "Server overloaded, retry after 0.5s",
+    }
+    limiter.release()
+    assert limiter.try_acquire() is None
+    assert limiter.shed == 1
+
+
+def test_failures_cut_the_limit():
+    limiter = new_limiter()
+    limiter.observe(0.01, ok=True)
+    limiter.observe(0.01, ok=False)
+    assert limiter.limit == 9.0
+    assert limiter.decreases == 1
+
+
+def test_cut_deepens_with_latency_but_at_most_halves():
+    mild = new_limiter()
+    mild.observe(0.01, ok=True)
+    mild.observe(0.025, ok=True)
+    # Threshold 0.02 / mean 0.025 = 0.8
+    assert round(mild.limit, 6) == 8.0
+    severe = new_limiter()
+    severe.observe(0.01, ok=True)
+    severe.observe(1.0, ok=True)
+    assert severe.limit == 5.0
+
+
+def test_limit_stays_within_bounds():
+    limiter = new_limiter()
+    limiter.observe(0.01, ok=True)
+    for _ in range(50):
+        limiter.observe(0.01, ok=False)
+    assert limiter.limit == 2
+
+
+def test_grows_only_when_calls_press_the_limit():
+    limiter = new_limiter(initial_limit=5)
+    limiter.observe(0.01, ok=True)
+    assert limiter.limit == 5
+    for _ in range(4):
+        limiter.try_acquire()
+    limiter.observe(0.01, ok=True)
+    assert limiter.limit == 6
+
+
+def test_baseline_follows_a_lasting_slowdown():
+    limiter = new_limiter(baseline_drift=0.5)
+    limiter.observe(0.01, ok=True)
+    for _ in range(20):
+        limiter.observe(0.1, ok=True)
+    # Slower upstream became the new normal: no more cuts
+    decreases = limiter.decreases
+    limiter.observe(0.1, ok=True)
+    assert limiter.decreases == decreases
+    assert limiter.baseline > 0.05
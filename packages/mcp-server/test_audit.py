@@ -0,0 +1,92 @@
+"""Behaviour tests for the audit log writer (python -m pytest test_audit.py)"""
+import json
+import time
+
+from audit import AuditLog
+
+
+def new_log(tmp_path, **kwargs) -> AuditLog:
+    options = dict(flush_interval=0.01, rotate_bytes=0, rotate_interval=0, enabled=True)
+    options.update(kwargs)
+    return AuditLog(str(tmp_path / "audit.jsonl"), **options)
+
+
+def read_lines(path) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_records_are_written_in_order(tmp_path):
+    audit = new_log(tmp_path)
+    audit.start()
+    for i in range(3):
+        audit.record("email.changed", account_id=str(i))
+    audit.stop()
+    lines = read_lines(audit.path)
+    assert [line["account_id"] for line in lines] == ["0", "1", "2"]
+    assert lines[0]["event"] == "email.changed"
+    assert lines[0]["ts"].endswith("Z")
+    assert audit.stats()["written"] == 3
+
+
+def test_queued_records_share_one_batch(tmp_path):
+    audit = new_log(tmp_path, flush_interval=0.5)
+    audit.start()
+    for i in range(10):
+        audit.record("email.changed", account_id=str(i))
+    audit.stop()
+    assert audit.batches == 1
+    assert len(read_lines(audit.path)) == 10
+
+
+def test_dedupe_key_is_recorded_once(tmp_path):
+    audit = new_log(tmp_path, dedupe_size=1)
+    audit.start()
+    audit.record("email.changed", dedupe_key="k1:12345")
+    audit.record("email.changed", dedupe_key="k1:12345")
+    audit.record("email.changed", dedupe_key="k2:12345")
+    # k1 fell out of the bounded window
+    audit.record("email.changed", dedupe_key="k1:12345")
+    audit.stop()
+    assert audit.duplicates == 1
+    assert len(read_lines(audit.path)) == 3
+
+
+def test_rotates_by_size(tmp_path):
+    audit = new_log(tmp_path, rotate_bytes=1)
+    audit.start()
+    audit.record("email.changed", account_id="1")
+    time.sleep(0.05)
+    audit.record("email.changed", account_id="2")
+    audit.stop()
+    assert audit.rotations == 1
+    rotated = [p for p in tmp_path.iterdir() if p.name != "audit.jsonl"]
+    assert len(rotated) == 1
+    assert read_lines(rotated[0])[0]["account_id"] == "1"
+    assert read_lines(audit.path)[0]["account_id"] == "2"
+
+
+def test_closed_file_is_reopened(tmp_path):
+    audit = new_log(tmp_path)
+    audit.start()
+    # As after a rotation whose reopen failed
+    audit._file.close()
+    audit.record("email.changed", account_id="1")
+    audit.stop()
+    assert audit.write_failures == 0
+    assert len(read_lines(audit.path)) == 1
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    audit = new_log(tmp_path, queue_size=1)
+    audit.record("email.changed")
+    audit.record("email.changed")
+    assert audit.dropped == 1
+
+
+def test_disabled_log_records_nothing(tmp_path):
+    audit = new_log(tmp_path, enabled=False)
+    audit.start()
+    audit.record("email.changed")
+    audit.stop()
+    assert not (tmp_path / "audit.jsonl").exists()
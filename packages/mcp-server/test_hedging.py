@@ -0,0 +1,82 @@
+"""Behaviour tests for hedged requests (python -m pytest test_hedging.py)"""
+import asyncio
+
+import pytest
+
+from hedging import Hedger
+
+
+def primed(**kwargs) -> Hedger:
+    """Hedger that hedges after 10ms, with budget for every request"""
+    options = dict(min_samples=1, min_delay=0.01, max_delay=0.01, budget_ratio=1.0, budget_min_per_second=1)
+    options.update(kwargs)
+    hedger = Hedger("test", **options)
+    hedger.observe(0.01)
+    return hedger
+
+
+def answer(value, delay: float = 0.0, error: Exception = None, log: list = None):
+    async def call():
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if log is not None:
+                log.append(f"{value} cancelled")
+            raise
+        if error is not None:
+            raise error
+        return value
+    return call
+
+
+def test_no_hedge_before_enough_samples():
+    hedger = Hedger("test", min_samples=3)
+    hedger.observe(0.01)
+    assert hedger.delay() is None
+    assert asyncio.run(hedger.run(answer("primary", 0.02), answer("hedge"))) == "primary"
+    assert hedger.hedged == 0
+
+
+def test_delay_is_clamped_percentile():
+    hedger = Hedger("test", percentile=90, min_samples=10, min_delay=0.0, max_delay=1.0)
+    for i in range(10):
+        hedger.observe(i / 100)
+    assert hedger.delay() == 0.09
+    capped = Hedger("test", min_samples=1, max_delay=0.5)
+    capped.observe(3.0)
+    assert capped.delay() == 0.5
+
+
+def test_fast_primary_is_not_hedged():
+    hedger = primed()
+    assert asyncio.run(hedger.run(answer("primary"), answer("hedge"))) == "primary"
+    assert hedger.hedged == 0
+
+
+def test_hedge_wins_and_primary_is_cancelled():
+    hedger = primed()
+    log = []
+    result = asyncio.run(hedger.run(answer("primary", 1.0, log=log), answer("hedge")))
+    assert result == "hedge"
+    assert (hedger.hedged, hedger.hedge_wins) == (1, 1)
+    assert log == ["primary cancelled"]
+
+
+def test_failed_hedge_does_not_win():
+    hedger = primed()
+    result = asyncio.run(hedger.run(answer("primary", 0.05), answer("hedge", error=RuntimeError("hedge"))))
+    assert result == "primary"
+    assert hedger.hedge_wins == 0
+
+
+def test_both_failing_raise_the_primary_error():
+    hedger = primed()
+    with pytest.raises(ValueError):
+        asyncio.run(hedger.run(answer("primary", 0.05, error=ValueError()), answer("hedge", error=RuntimeError())))
+
+
+def test_spent_budget_stops_hedging():
+    hedger = primed(budget_ratio=0.0, budget_min_per_second=0.0)
+    assert asyncio.run(hedger.run(answer("primary", 0.03), answer("hedge"))) == "primary"
+    assert hedger.hedged == 0
+    assert hedger.budget.exhausted == 1
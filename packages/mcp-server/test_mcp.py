@@ -101,16 +101,14 @@ async def main():
                     }
                 )
                 print(f"✅ Result: {result.content}")
+                confirmation_token = (result.structuredContent or {}).get("confirmation_token")
                 
                 # Step 7: Test change_email (Step 3 - confirmed)
                 print("\n[7] Testing change_email - Step 3 (confirmed Y)...")
                 result = await session.call_tool(
                     "change_email",
                     arguments={
-                        "account_id": "12345",
-                        "jwt_token": token,
-                        "tenant_id": tenant_id,
-                        "new_email": "newemail@example.com",
+                        "confirmation_token": confirmation_token,
                         "user_confirmation": "Y"
                     }
                 )
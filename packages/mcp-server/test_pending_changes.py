@@ -0,0 +1,271 @@
+"""Behaviour tests for the change_email pending-change store (python -m pytest test_pending_changes.py)"""
+import asyncio
+import time
+
+from pending_changes import COMPLETED, PendingChangeStore, SqliteDecisionStore, changes_digest
+
+SECRET = "test-secret"
+
+
+def new_store(**kwargs) -> PendingChangeStore:
+    return PendingChangeStore(SECRET, sweep_interval=0, **kwargs)
+
+
+def sender(calls: list, result=None, final=True):
+    async def send(record):
+        calls.append(record.idempotency_key)
+        return dict(result or {"status": "success"}), final
+    return send
+
+
+def test_get_only_for_creator():
+    store = new_store()
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    assert store.get(record.token, "t1", "alice") is record
+    assert store.get(record.token, "t1", "bob") is None
+    assert store.get(record.token, "t2", "alice") is None
+
+
+def test_cancel_is_final():
+    store = new_store()
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    store.discard(record)
+    assert store.get(record.token, "t1", "alice") is None
+    # Still rejected once the tombstone is the only trace of it
+    assert store.get(record.token, "t1", "alice") is None
+    assert store.restored == 0
+
+
+def test_expired_token_is_not_restored():
+    store = new_store()
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    record.expires_at = time.time() - 1
+    assert store.get(record.token, "t1", "alice") is None
+    assert store.get(record.token, "t1", "alice") is None
+    assert store.abandoned == 1
+    assert store.restored == 0
+
+
+def test_swept_token_is_not_restored():
+    store = new_store()
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    record.expires_at = time.time() - 1
+    assert store.sweep() == 1
+    assert store.get(record.token, "t1", "alice") is None
+
+
+def test_tombstones_are_pruned():
+    store = new_store(ttl=0.05)
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    store.discard(record)
+    time.sleep(0.06)
+    store.create("t1", "alice", "12346", "other@example.com")
+    assert record.token not in store._tombstones
+
+
+def test_confirm_replays_result():
+    store = new_store()
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    calls = []
+
+    async def run():
+        first = await store.confirm(record, sender(calls))
+        second = await store.confirm(record, sender(calls))
+        return first, second
+
+    (first, replayed_first), (second, replayed_second) = asyncio.run(run())
+    assert calls == [record.idempotency_key]
+    assert first == second == {"status": "success"}
+    assert (replayed_first, replayed_second) == (False, True)
+    assert record.state == COMPLETED
+
+
+def test_concurrent_confirmations_share_one_call():
+    store = new_store()
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    calls = []
+
+    async def slow(r):
+        calls.append(r.idempotency_key)
+        await asyncio.sleep(0.01)
+        return {"status": "success"}, True
+
+    async def run():
+        return await asyncio.gather(*(store.confirm(record, slow) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert [replayed for _, replayed in results].count(False) == 1
+
+
+def test_non_final_result_stays_pending():
+    store = new_store()
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    calls = []
+    asyncio.run(store.confirm(record, sender(calls, {"status": "error"}, final=False)))
+    assert record.state != COMPLETED
+    asyncio.run(store.confirm(record, sender(calls)))
+    # The retry reuses the idempotency key
+    assert calls == [record.idempotency_key, record.idempotency_key]
+
+
+def test_cancel_after_confirmation_keeps_result():
+    store = new_store()
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    asyncio.run(store.confirm(record, sender([])))
+    assert store.discard(record) is False
+    assert store.get(record.token, "t1", "alice") is record
+
+
+def test_restore_on_another_worker():
+    issuer = new_store()
+    record = issuer.create("t1", "alice", "12345", "new@example.com")
+    other = new_store()
+    restored = other.get(record.token, "t1", "alice")
+    assert restored is not None
+    assert (restored.account_id, restored.new_email, restored.idempotency_key) == (
+        "12345", "new@example.com", record.idempotency_key
+    )
+    assert other.restored == 1
+    assert new_store().get(record.token, "t1", "bob") is None
+    assert PendingChangeStore("other-secret", sweep_interval=0).get(record.token, "t1", "alice") is None
+
+
+def test_evicted_record_is_restored():
+    store = new_store(max_entries=1)
+    first = store.create("t1", "alice", "12345", "new@example.com")
+    store.create("t1", "alice", "12346", "other@example.com")
+    restored = store.get(first.token, "t1", "alice")
+    assert restored is not None and restored.account_id == "12345"
+
+
+def test_evicted_prompt_is_not_restored():
+    store = new_store(max_entries=1)
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    store.prompt(record, "reconfirm")
+    store.create("t1", "alice", "12346", "other@example.com")
+    assert store.get(record.token, "t1", "alice") is None
+
+
+def test_evicted_completed_record_is_not_restored():
+    store = new_store(max_entries=1)
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    calls = []
+    asyncio.run(store.confirm(record, sender(calls)))
+    store.create("t1", "alice", "12346", "other@example.com")
+    assert store.get(record.token, "t1", "alice") is None
+    assert calls == [record.idempotency_key]
+
+
+def test_prompt_reissues_token():
+    store = new_store()
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    first_token = record.token
+    store.prompt(record, "reconfirm")
+    assert record.token != first_token
+    assert store.get(record.token, "t1", "alice") is record
+    # The confirmation-step token cannot be rebuilt behind the follow-up
+    assert store.get(first_token, "t1", "alice") is None
+
+
+def test_expired_prompt_is_not_restored():
+    store = new_store(prompt_timeout=0.01)
+    record = store.create("t1", "alice", "12345", "new@example.com")
+    store.prompt(record, "reconfirm")
+    time.sleep(0.02)
+    assert store.get(record.token, "t1", "alice") is None
+    assert store.get(record.token, "t1", "alice") is None
+    # Another worker reads the sealed deadline
+    assert new_store().get(record.token, "t1", "alice") is None
+
+
+def test_restore_keeps_prompt_step():
+    issuer = new_store()
+    record = issuer.create("t1", "alice", "12345", "new@example.com")
+    issuer.prompt(record, "reconfirm")
+    restored = new_store().get(record.token, "t1", "alice")
+    assert restored is not None
+    assert restored.step == "reconfirm"
+    assert abs(restored.expires_at - record.expires_at) < 1e-6
+
+
+def test_purge_follows_shortened_deadline():
+    store = new_store(prompt_timeout=0.01)
+    store.create("t1", "alice", "12345", "new@example.com")
+    record = store.create("t1", "alice", "12346", "other@example.com")
+    store.prompt(record, "reconfirm")
+    time.sleep(0.02)
+    store.create("t1", "alice", "12347", "third@example.com")
+    assert record.token not in store._entries
+    assert store.abandoned == 1
+    assert len(store) == 2
+
+
+def test_batch_token_seals_digest():
+    changes = [
+        {"account_id": "12345", "new_email": "a@example.com"},
+        {"account_id": "12346", "new_email": "b@example.com"},
+    ]
+    issuer = new_store()
+    record = issuer.create_batch("t1", "alice", changes)
+    restored = new_store().get(record.token, "t1", "alice")
+    assert restored is not None
+    assert restored.changes is None
+    assert restored.digest == changes_digest(changes)
+    assert restored.idempotency_key == record.idempotency_key
+    assert changes_digest(changes[::-1]) != restored.digest
+
+
+def worker_stores(tmp_path, count=2) -> list:
+    """Stores of separate workers sharing one decision file"""
+    path = str(tmp_path / "decisions.sqlite3")
+    return [new_store(decisions=SqliteDecisionStore(path)) for _ in range(count)]
+
+
+def test_cancel_is_final_on_other_workers(tmp_path):
+    issuer, other = worker_stores(tmp_path)
+    record = issuer.create("t1", "alice", "12345", "new@example.com")
+    first_token = record.token
+    issuer.prompt(record, "reconfirm")
+    assert issuer.discard(record) is True
+    assert other.get(first_token, "t1", "alice") is None
+    assert other.get(record.token, "t1", "alice") is None
+
+
+def test_cancel_reaches_a_rebuilt_record(tmp_path):
+    issuer, other = worker_stores(tmp_path)
+    record = issuer.create("t1", "alice", "12345", "new@example.com")
+    rebuilt = other.get(record.token, "t1", "alice")
+    assert issuer.discard(record) is True
+    calls = []
+    result, _ = asyncio.run(other.confirm(rebuilt, sender(calls)))
+    assert result["status"] == "cancelled"
+    assert calls == []
+    assert other.get(record.token, "t1", "alice") is None
+
+
+def test_confirmation_on_another_worker_wins_over_cancel(tmp_path):
+    issuer, other = worker_stores(tmp_path)
+    record = issuer.create("t1", "alice", "12345", "new@example.com")
+    rebuilt = other.get(record.token, "t1", "alice")
+    calls = []
+    asyncio.run(other.confirm(rebuilt, sender(calls)))
+    assert issuer.discard(record) is False
+    assert calls == [record.idempotency_key]
+
+
+def test_confirmed_while_in_flight_and_on_other_workers(tmp_path):
+    issuer, other = worker_stores(tmp_path)
+    record = issuer.create("t1", "alice", "12345", "new@example.com")
+    rebuilt = other.get(record.token, "t1", "alice")
+    seen = []
+
+    async def slow(r):
+        seen.append((issuer.confirmed(record), other.confirmed(rebuilt)))
+        await asyncio.sleep(0.01)
+        return {"status": "success"}, True
+
+    assert issuer.confirmed(record) is False
+    asyncio.run(issuer.confirm(record, slow))
+    assert seen == [(True, True)]
+    assert other.confirmed(rebuilt) is True
@@ -0,0 +1,61 @@
+"""Behaviour tests for the tenant and principal quotas (python -m pytest test_quotas.py)"""
+from quotas import QuotaLimiter, TokenBucket
+
+LIMITS = {
+    "rate_limit": 0,
+    "max_in_flight": 0,
+    "principal_rate_limit": 0,
+    "principal_max_in_flight": 0,
+}
+
+
+def limits(**overrides) -> dict:
+    return {**LIMITS, **overrides}
+
+
+def test_new_bucket_admits_exactly_burst():
+    bucket = TokenBucket(rate=1.0, burst=3.0, now=100.0)
+    assert [bucket.take(100.0) for _ in range(4)] == [0.0, 0.0, 0.0, 1.0]
+
+
+def test_earlier_now_does_not_drain_bucket():
+    bucket = TokenBucket(rate=10.0, burst=1.0, now=100.0)
+    assert bucket.take(99.9) == 0.0
+
+
+def test_first_call_of_a_principal_with_burst_one():
+    limiter = QuotaLimiter()
+    quota = limits(principal_rate_limit=0.001, principal_burst=1)
+    assert limiter.acquire("t1", "alice", quota) is None
+    rejected = limiter.acquire("t1", "alice", quota)
+    assert (rejected.scope, rejected.limit) == ("principal", "rate")
+    # Another principal has its own bucket
+    assert limiter.acquire("t1", "bob", quota) is None
+
+
+def test_limiter_admits_burst_then_rejects():
+    limiter = QuotaLimiter()
+    quota = limits(rate_limit=0.001, burst=5)
+    admitted = [limiter.acquire("t1", f"p{i}", quota) is None for i in range(6)]
+    assert admitted == [True] * 5 + [False]
+    assert limiter.rejections == 1
+
+
+def test_principal_rejection_refunds_tenant_token():
+    limiter = QuotaLimiter()
+    quota = limits(rate_limit=0.001, burst=2, principal_rate_limit=0.001, principal_burst=1)
+    assert limiter.acquire("t1", "alice", quota) is None
+    assert limiter.acquire("t1", "alice", quota) is not None
+    # The tenant token taken by the rejected call was given back
+    assert limiter.acquire("t1", "bob", quota) is None
+
+
+def test_in_flight_cap_and_release():
+    limiter = QuotaLimiter()
+    quota = limits(principal_max_in_flight=1)
+    assert limiter.acquire("t1", "alice", quota) is None
+    rejected = limiter.acquire("t1", "alice", quota)
+    assert rejected.to_dict()["error"] == "too_many_in_flight"
+    limiter.release("t1", "alice")
+    assert limiter.acquire("t1", "alice", quota) is None
+    assert limiter.in_flight("t1") == 1
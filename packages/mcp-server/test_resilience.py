@@ -0,0 +1,99 @@
+"""Behaviour tests for the circuit breaker, retries and retry budget (python -m pytest test_resilience.py)"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from metrics import UPSTREAM_CIRCUIT_STATE
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, RetryBudget, RetryPolicy
+from upstream import CircuitOpenError, UpstreamGateway
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker("GET /x", failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert 0 < breaker.retry_after() <= 60
+
+
+def test_half_open_admits_one_probe():
+    breaker = CircuitBreaker("GET /x", failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # The probe has not reported back yet
+    breaker.reset_timeout = 60
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker("GET /x", failure_threshold=5, reset_timeout=0.01)
+    for _ in range(5):
+        breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+
+def test_retry_delay_is_capped_full_jitter():
+    policy = RetryPolicy(max_attempts=5, base_delay=0.1, max_delay=0.3)
+    assert all(0.0 <= policy.delay(1) <= 0.1 for _ in range(100))
+    assert all(0.0 <= policy.delay(4) <= 0.3 for _ in range(100))
+
+
+def test_retry_budget_is_a_fraction_of_requests():
+    budget = RetryBudget(ratio=0.1, min_per_second=0.1, window=10)
+    for _ in range(100):
+        budget.record_request()
+    # 1 retry from the floor plus 10% of 100 requests
+    granted = sum(budget.try_withdraw() for _ in range(20))
+    assert granted == 11
+    assert budget.exhausted == 9
+
+
+def gateway(base_url: str, handler) -> UpstreamGateway:
+    gateway = UpstreamGateway(base_url)
+    gateway._client = httpx.AsyncClient(base_url=base_url, transport=httpx.MockTransport(handler))
+    return gateway
+
+
+def test_circuit_state_gauge_per_base_url():
+    labels = {"method": "GET", "endpoint": "/probe"}
+    status = {"code": 500}
+    seen_during_probe = []
+
+    def flaky(request):
+        seen_during_probe.append(UPSTREAM_CIRCUIT_STATE.value(base_url="http://flaky.test", **labels))
+        return httpx.Response(status["code"], json={})
+
+    flaky_gateway = gateway("http://flaky.test", flaky)
+    ok_gateway = gateway("http://ok.test", lambda request: httpx.Response(200, json={}))
+    breaker = flaky_gateway.breaker("GET", "/probe")
+    breaker.failure_threshold, breaker.reset_timeout = 1, 60
+
+    async def run():
+        await flaky_gateway.get("/probe", endpoint="/probe")
+        assert UPSTREAM_CIRCUIT_STATE.value(base_url="http://flaky.test", **labels) == 2
+        # Another upstream's breaker for the same endpoint doesn't overwrite it
+        await ok_gateway.get("/probe", endpoint="/probe")
+        assert UPSTREAM_CIRCUIT_STATE.value(base_url="http://flaky.test", **labels) == 2
+        with pytest.raises(CircuitOpenError):
+            await flaky_gateway.get("/probe", endpoint="/probe")
+        # Once the timeout has passed the probe runs half-open, then closes the circuit
+        breaker.reset_timeout = 0
+        status["code"] = 200
+        seen_during_probe.clear()
+        await flaky_gateway.get("/probe", endpoint="/probe")
+        assert seen_during_probe == [1]
+        assert UPSTREAM_CIRCUIT_STATE.value(base_url="http://flaky.test", **labels) == 0
+
+    asyncio.run(run())
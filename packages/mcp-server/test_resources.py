@@ -0,0 +1,64 @@
+"""resources/read through the HTTP app: auth and pre-encoded blobs (python -m pytest test_resources.py)"""
+import asyncio
+import base64
+import time
+
+import httpx
+import jwt
+from fastmcp import Client
+from fastmcp.client.transports import StreamableHttpTransport
+from mcp.shared.exceptions import McpError
+from mcp.types import ReadResourceRequest
+
+import server
+
+TENANT_ID = "test123"
+CHART = "image01.png"
+
+
+def read_chart(headers: dict):
+    """Read chart://CHART over streamable HTTP against the in-process app (the McpError if refused)"""
+    app = server.mcp.http_app(stateless_http=True)
+
+    def client_factory(**kwargs):
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), **kwargs)
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            transport = StreamableHttpTransport(
+                "http://mcp.test/mcp", headers=headers, httpx_client_factory=client_factory
+            )
+            async with Client(transport) as client:
+                try:
+                    return await client.read_resource(f"chart://{CHART}")
+                except McpError as e:
+                    # Returned, not raised: the app's task group would wrap it
+                    return e
+
+    return asyncio.run(run())
+
+
+def test_read_requires_auth():
+    error = read_chart({})
+    assert isinstance(error, McpError)
+    assert "Access denied" in str(error)
+
+
+def test_read_rejects_invalid_token():
+    error = read_chart({"X-JWT-TOKEN": "not-a-jwt", "X-TENANT-ID": TENANT_ID})
+    assert isinstance(error, McpError)
+    assert "Access denied" in str(error)
+
+
+def test_read_handler_is_installed():
+    # Falls back to the SDK handler if the FastMCP internals it hooks have moved
+    assert server.mcp._mcp_server.request_handlers[ReadResourceRequest] is server.read_resource_handler
+
+
+def test_read_returns_stored_blob():
+    token = jwt.encode({"userId": "test", "exp": int(time.time()) + 60}, server.JWT_SECRET, algorithm="HS256")
+    contents = read_chart({"X-JWT-TOKEN": token, "X-TENANT-ID": TENANT_ID})
+    asset = server.chart_assets.get(CHART)
+    assert len(contents) == 1
+    assert contents[0].blob == asset.data.b64
+    assert base64.b64decode(contents[0].blob) == bytes(asset.data)
@@ -0,0 +1,67 @@
+"""Behaviour tests for the get_email result cache (python -m pytest test_result_cache.py)"""
+import asyncio
+import time
+
+from result_cache import InMemoryResultCache, email_account_tag, email_cache_key
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_keys_are_scoped_by_tenant_and_principal():
+    keys = {
+        email_cache_key("t1", "alice", "12345"),
+        email_cache_key("t1", "bob", "12345"),
+        email_cache_key("t2", "alice", "12345"),
+        # Separators inside an ID cannot forge another key
+        email_cache_key("t1:alice", "x", "12345"),
+    }
+    assert len(keys) == 4
+
+
+def test_get_returns_a_copy_until_ttl():
+    cache = InMemoryResultCache()
+    run(cache.set("k", {"email": "a@example.com"}, ttl=0.05))
+    value = run(cache.get("k"))
+    value["email"] = "changed"
+    assert run(cache.get("k")) == {"email": "a@example.com"}
+    time.sleep(0.06)
+    assert run(cache.get("k")) is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_dropped():
+    cache = InMemoryResultCache(max_size=2)
+    run(cache.set("a", {}, ttl=60))
+    run(cache.set("b", {}, ttl=60))
+    run(cache.get("a"))
+    run(cache.set("c", {}, ttl=60))
+    assert run(cache.get("b")) is None
+    assert run(cache.get("a")) == {}
+    assert run(cache.get("c")) == {}
+
+
+def test_invalidate_tag_clears_every_principal():
+    cache = InMemoryResultCache()
+    tag = email_account_tag("t1", "12345")
+    for principal in ("alice", "bob"):
+        run(cache.set(email_cache_key("t1", principal, "12345"), {"email": "old"}, ttl=60, tags=[tag]))
+    other = email_cache_key("t1", "alice", "99999")
+    run(cache.set(other, {"email": "other"}, ttl=60, tags=[email_account_tag("t1", "99999")]))
+    before = run(cache.tag_generation(tag))
+    run(cache.invalidate_tag(tag))
+    assert run(cache.get(email_cache_key("t1", "alice", "12345"))) is None
+    assert run(cache.get(email_cache_key("t1", "bob", "12345"))) is None
+    assert run(cache.get(other)) == {"email": "other"}
+    assert run(cache.tag_generation(tag)) != before
+
+
+def test_dropped_generation_never_goes_back():
+    cache = InMemoryResultCache(max_size=1)
+    run(cache.invalidate_tag("a"))
+    seen = run(cache.tag_generation("a"))
+    # "a" falls out of the bounded generation table
+    run(cache.invalidate_tag("b"))
+    assert run(cache.tag_generation("a")) >= seen
@@ -0,0 +1,111 @@
+"""Behaviour tests for tenant routing across shards (python -m pytest test_shards.py)"""
+import asyncio
+import json
+
+import pytest
+
+import shards
+from shards import HashRing, Shard, ShardConfigError, ShardRouter, load_shards
+
+TABLE = {
+    "shards": [
+        {"name": "shard-a", "base_url": "http://a.test", "replicas": ["http://a2.test"]},
+        {"name": "shard-b", "base_url": "http://b.test"},
+    ],
+    "assignments": {"pinned": "shard-b"},
+}
+
+
+def write_table(tmp_path, table=TABLE) -> str:
+    path = tmp_path / "shards.json"
+    path.write_text(json.dumps(table))
+    return str(path)
+
+
+def new_router(tmp_path, table=TABLE, **kwargs) -> ShardRouter:
+    router = ShardRouter(write_table(tmp_path, table), **kwargs)
+    router.load()
+    return router
+
+
+def tenant_on(router: ShardRouter, name: str) -> str:
+    return next(f"t{i}" for i in range(1000) if router.route(f"t{i}").name == name)
+
+
+def test_assigned_tenant_goes_to_its_shard(tmp_path):
+    router = new_router(tmp_path)
+    assert router.route("pinned").name == "shard-b"
+
+
+def test_ring_moves_only_tenants_of_a_removed_shard():
+    a, b, c = Shard("a", "http://a.test"), Shard("b", "http://b.test"), Shard("c", "http://c.test")
+    before = HashRing([a, b, c], vnodes=50)
+    after = HashRing([a, b], vnodes=50)
+    for i in range(500):
+        owner = before.lookup(f"t{i}")
+        if owner is not c:
+            assert after.lookup(f"t{i}") is owner
+
+
+def test_unhealthy_shard_keeps_its_tenants(tmp_path):
+    router = new_router(tmp_path, failover=True)
+    tenant = tenant_on(router, "shard-b")
+    router._shards["shard-b"].down.add("http://b.test")
+    # No replica: reads and writes stay on the shard that owns the data
+    shard = router.route(tenant)
+    assert shard.name == "shard-b"
+    assert router.base_urls(shard, read=True) == ["http://b.test"]
+    assert router.failovers == 0
+
+
+def test_reads_fail_over_to_a_replica(tmp_path):
+    router = new_router(tmp_path, failover=True)
+    shard = router.route(tenant_on(router, "shard-a"))
+    shard.down.add("http://a.test")
+    assert router.base_urls(shard, read=True) == ["http://a2.test", "http://a.test"]
+    assert router.base_urls(shard) == ["http://a.test", "http://a2.test"]
+    assert router.failovers == 1
+
+
+def test_failover_is_off_by_default(tmp_path):
+    router = new_router(tmp_path, failover=shards.SHARD_FAILOVER)
+    shard = router._shards["shard-a"]
+    shard.down.add("http://a.test")
+    assert router.base_urls(shard, read=True)[0] == "http://a.test"
+
+
+def test_reload_keeps_health_and_retires_removed_urls(tmp_path, monkeypatch):
+    closed = []
+
+    async def close_gateway(base_url):
+        closed.append(base_url)
+
+    monkeypatch.setattr(shards, "UPSTREAM_TIMEOUT", 0)
+    monkeypatch.setattr(shards, "close_gateway", close_gateway)
+    router = new_router(tmp_path)
+    router._shards["shard-a"].down.add("http://a.test")
+    smaller = {"shards": [TABLE["shards"][0]]}
+
+    async def run():
+        write_table(tmp_path, smaller)
+        router._mtime_ns = -1
+        await router._maybe_reload()
+        assert len(router._retiring) == 1
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert sorted(router._shards) == ["shard-a"]
+    assert not router._shards["shard-a"].healthy
+    assert closed == ["http://b.test"]
+    assert not router._retiring
+
+
+def test_invalid_tables_are_rejected(tmp_path):
+    for table in (
+        {"shards": []},
+        {"shards": [{"name": "a", "base_url": "ftp://a.test"}]},
+        {"shards": [{"name": "a", "base_url": "http://a.test"}], "assignments": {"t": "missing"}},
+        {"shards": [{"name": "a", "base_url": "http://a.test", "replicas": "http://a2.test"}]},
+    ):
+        with pytest.raises(ShardConfigError):
+            load_shards(write_table(tmp_path, table))
@@ -0,0 +1,96 @@
+"""
+Thai Phung - Verified JWT cache for the MCP Server middleware
+
+Sessions resend the same x-jwt-token on every tool call, so verified claims
+are kept in a bounded LRU keyed by the token's SHA-256 digest. Valid entries
+expire at the token's `exp` claim; tokens that failed verification are
+remembered for a short negative TTL.
+"""
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Configuration
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_MAX_TTL = float(os.environ.get("TOKEN_CACHE_MAX_TTL", "3600"))
+TOKEN_CACHE_NEGATIVE_TTL = float(os.environ.get("TOKEN_CACHE_NEGATIVE_TTL", "60"))
+
+
+def token_digest(token: str) -> bytes:
+    """Cache key for a raw token (the token itself is never stored)"""
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of verified claims (positive) and rejected tokens (negative)"""
+
+    def __init__(
+        self,
+        max_size: int = TOKEN_CACHE_SIZE,
+        max_ttl: float = TOKEN_CACHE_MAX_TTL,
+        negative_ttl: float = TOKEN_CACHE_NEGATIVE_TTL,
+    ):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        # digest -> (expires_at, claims or None for a known-bad token)
+        self._entries: OrderedDict[bytes, tuple[float, Optional[dict]]] = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> tuple[bool, Optional[dict]]:
+        """Return (found, claims); claims is None for a cached rejection"""
+        key = token_digest(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+
+        expires_at, claims = entry
+        if time.time() >= expires_at:
+            del self._entries[key]
+            self.misses += 1
+            return False, None
+
+        self._entries.move_to_end(key)
+        if claims is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return True, claims
+
+    def put_valid(self, token: str, claims: dict) -> None:
+        """Cache verified claims until the token's exp (capped at max_ttl)"""
+        expires_at = time.time() + self.max_ttl
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, float(exp))
+        self._store(token_digest(token), expires_at, claims)
+
+    def put_invalid(self, token: str) -> None:
+        """Remember a token that failed verification"""
+        self._store(token_digest(token), time.time() + self.negative_ttl, None)
+
+    def _store(self, key: bytes, expires_at: float, claims: Optional[dict]) -> None:
+        self._entries[key] = (expires_at, claims)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """Hit/miss counters for monitoring"""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
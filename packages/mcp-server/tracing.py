@@ -0,0 +1,109 @@
+"""
+Thai Phung - OpenTelemetry tracing for the MCP Server (optional)
+
+Spans are created through the OpenTelemetry API when `opentelemetry-api` is
+installed and are no-ops otherwise. Exporting needs `opentelemetry-sdk`:
+MCP_TRACE_EXPORTER=console prints finished spans to stderr, =file appends
+one JSON span per line to MCP_TRACE_FILE.
+
+Trace context follows W3C `traceparent` / `tracestate`: it is read from the
+tools/call request's `_meta` (set by the MCP client) or the HTTP headers,
+and written onto every upstream request.
+"""
+
+import atexit
+import os
+import sys
+from contextlib import contextmanager
+from typing import Iterator, Mapping, Optional
+
+from mcp_logging import get_logger
+
+log = get_logger("tracing")
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.trace import SpanKind
+except ImportError:  # tracing is optional
+    trace = None
+
+# Configuration
+MCP_TRACE_EXPORTER = os.environ.get("MCP_TRACE_EXPORTER", "").lower()  # "", console, file
+MCP_TRACE_FILE = os.environ.get("MCP_TRACE_FILE", "traces.jsonl")
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "thai-internal-mcp")
+
+TRACE_HEADERS = ("traceparent", "tracestate")
+
+_tracer = None
+
+
+def setup_tracing(exporter: str = MCP_TRACE_EXPORTER) -> None:
+    """Install an SDK tracer provider with a console / file exporter (idempotent)"""
+    global _tracer
+    if trace is None or _tracer is not None:
+        return
+    if exporter:
+        try:
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+        except ImportError:
+            log.warning("tracing.sdk_unavailable", exporter=exporter)
+        else:
+            if exporter == "file":
+                out = open(MCP_TRACE_FILE, "a", buffering=1)
+                span_exporter = ConsoleSpanExporter(
+                    out=out, formatter=lambda span: span.to_json(indent=None) + "\n"
+                )
+            else:
+                span_exporter = ConsoleSpanExporter(out=sys.stderr)
+            provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+            provider.add_span_processor(BatchSpanProcessor(span_exporter))
+            trace.set_tracer_provider(provider)
+            atexit.register(provider.shutdown)
+            log.info("tracing.enabled", exporter=exporter, service=SERVICE_NAME)
+    _tracer = trace.get_tracer("mcp_server")
+
+
+@contextmanager
+def span(
+    name: str,
+    kind: str = "internal",
+    attributes: Optional[dict] = None,
+    carrier: Optional[Mapping[str, str]] = None,
+) -> Iterator[Optional[object]]:
+    """Start a span as the current span; `carrier` holds an incoming traceparent"""
+    if _tracer is None:
+        yield None
+        return
+    parent = propagate.extract(carrier) if carrier else None
+    with _tracer.start_as_current_span(
+        name, context=parent, kind=getattr(SpanKind, kind.upper()), attributes=attributes
+    ) as current:
+        yield current
+
+
+def set_attributes(current: Optional[object], **attributes) -> None:
+    if current is not None:
+        current.set_attributes({k: v for k, v in attributes.items() if v is not None})
+
+
+def inject_headers(headers: dict) -> dict:
+    """Add traceparent / tracestate for the current span to outgoing headers"""
+    if trace is not None:
+        propagate.inject(headers)
+    return headers
+
+
+def trace_carrier(meta: Optional[object], headers: Mapping[str, str]) -> dict:
+    """Incoming trace context: request `_meta` first, then HTTP headers"""
+    carrier = {}
+    extra = getattr(meta, "model_extra", None) or {}
+    for name in TRACE_HEADERS:
+        value = extra.get(name) or headers.get(name)
+        if value:
+            carrier[name] = value
+    return carrier
+
+
+setup_tracing()
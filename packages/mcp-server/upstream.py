@@ -0,0 +1,325 @@
+"""
+Thai Phung - Upstream API gateway for the MCP Server tools
+
+Keeps one long-lived async HTTP client per API base URL so tool calls reuse
+pooled keep-alive connections instead of spawning a curl process per request.
+Every request passes through a per-endpoint circuit breaker; idempotent
+requests are retried with jittered backoff while the retry budget allows.
+"""
+
+import asyncio
+import os
+import time
+from typing import Callable, Optional
+
+import httpx
+
+from mcp_logging import get_logger
+from metrics import (
+    UPSTREAM_REQUESTS,
+    UPSTREAM_DURATION,
+    UPSTREAM_RETRIES,
+    UPSTREAM_SHORT_CIRCUITS,
+    UPSTREAM_CIRCUIT_STATE,
+)
+from resilience import CircuitBreaker, RetryBudget, RetryPolicy, STATE_VALUES
+from tracing import inject_headers, set_attributes, span
+
+log = get_logger("upstream")
+
+# Configuration
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", "10"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "3"))
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_HTTP2 = os.environ.get("UPSTREAM_HTTP2", "0") == "1"
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+# Every 5xx response counts as a breaker failure; only these may be retried
+RETRYABLE_STATUSES = frozenset({502, 503, 504})
+# Transport errors where a retry can help; read/pool timeouts are not retried
+# because they only stack more waiting onto an overloaded upstream
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError, httpx.RemoteProtocolError)
+
+
+class UpstreamError(Exception):
+    """Raised when the upstream API returns a response that cannot be used"""
+
+
+class CircuitOpenError(UpstreamError):
+    """Raised without calling upstream while the endpoint's circuit is open"""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(
+            f"Upstream endpoint {endpoint} is unavailable (circuit open), retry after {retry_after:.1f}s"
+        )
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package (pip install httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class UpstreamGateway:
+    """Pooled async HTTP client bound to a single API base URL"""
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = UPSTREAM_TIMEOUT,
+        connect_timeout: float = UPSTREAM_CONNECT_TIMEOUT,
+        max_connections: int = UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive: int = UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry: float = UPSTREAM_KEEPALIVE_EXPIRY,
+        http2: bool = UPSTREAM_HTTP2,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        if http2 and not _http2_available():
+            log.warning("upstream.http2_unavailable", base_url=self.base_url)
+            http2 = False
+        self.http2 = http2
+        self._client: Optional[httpx.AsyncClient] = None
+        self.retry_policy = RetryPolicy()
+        self.retry_budget = RetryBudget()
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Create the pooled client on first use"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+            )
+        return self._client
+
+    def breaker(self, method: str, endpoint: str) -> CircuitBreaker:
+        """Circuit breaker for one endpoint of this upstream"""
+        name = f"{method} {endpoint}"
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = self._breakers[name] = CircuitBreaker(name)
+        return breaker
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[dict] = None,
+        json: Optional[dict] = None,
+        data: Optional[dict] = None,
+        endpoint: Optional[str] = None,
+        idempotent: Optional[bool] = None,
+        observe: bool = True,
+    ) -> tuple[int, dict]:
+        """Send a request and return (status_code, decoded JSON body)
+
+        `endpoint` is the low-cardinality route used as the metrics label
+        (e.g. "/get_email/{account_id}"); it defaults to the path.
+        `idempotent` overrides the method-based decision whether a failed
+        attempt may be retried. `observe=False` keeps the request out of the
+        latency observer (JWKS and token fetches are not tool traffic).
+        Raises CircuitOpenError while the endpoint's circuit is open.
+        """
+        endpoint = endpoint or path
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        breaker = self.breaker(method, endpoint)
+        self.retry_budget.record_request()
+
+        attempt = 1
+        while True:
+            previous = breaker.state
+            allowed = breaker.allow()
+            # allow() moves an open circuit to half-open once the timeout passed
+            self._publish_state(breaker, method, endpoint, previous)
+            if not allowed:
+                UPSTREAM_SHORT_CIRCUITS.inc(method=method, endpoint=endpoint)
+                raise CircuitOpenError(f"{method} {endpoint}", breaker.retry_after())
+            try:
+                response = await self._send(method, path, headers, json, data, endpoint, observe)
+            except httpx.TransportError as e:
+                self._record(breaker, method, endpoint, ok=False)
+                if isinstance(e, RETRYABLE_ERRORS) and self._may_retry(idempotent, attempt):
+                    await self._backoff(method, endpoint, attempt, type(e).__name__)
+                    attempt += 1
+                    continue
+                raise
+            self._record(breaker, method, endpoint, ok=response.status_code < 500)
+            if response.status_code in RETRYABLE_STATUSES and self._may_retry(idempotent, attempt):
+                await self._backoff(method, endpoint, attempt, str(response.status_code))
+                attempt += 1
+                continue
+            break
+
+        try:
+            data = response.json()
+        except ValueError as e:
+            raise UpstreamError(
+                f"Invalid JSON from {method} {path} (HTTP {response.status_code})"
+            ) from e
+        if not isinstance(data, dict):
+            raise UpstreamError(f"Unexpected response from {method} {path}")
+        return response.status_code, data
+
+    async def _send(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[dict],
+        json: Optional[dict],
+        data: Optional[dict],
+        endpoint: str,
+        observe: bool = True,
+    ) -> httpx.Response:
+        """One attempt, recorded in the upstream metrics and as a client span"""
+        start = time.perf_counter()
+        status = "error"
+        attributes = {
+            "http.request.method": method,
+            "url.full": f"{self.base_url}{path}",
+            "mcp.upstream.endpoint": endpoint,
+        }
+        try:
+            with span(f"HTTP {method}", kind="client", attributes=attributes) as current:
+                response = await self.client.request(
+                    method, path, headers=inject_headers(dict(headers or {})), json=json, data=data
+                )
+                status = str(response.status_code)
+                set_attributes(current, **{"http.response.status_code": response.status_code})
+                return response
+        except asyncio.CancelledError:
+            # e.g. the losing attempt of a hedged request: not an upstream failure
+            status = "cancelled"
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            UPSTREAM_DURATION.observe(elapsed, method=method, endpoint=endpoint)
+            UPSTREAM_REQUESTS.inc(method=method, endpoint=endpoint, status=status)
+            if observe and _latency_observer is not None and status != "cancelled":
+                _latency_observer(elapsed, status.isdigit() and int(status) < 500)
+
+    def _record(self, breaker: CircuitBreaker, method: str, endpoint: str, ok: bool) -> None:
+        previous = breaker.state
+        if ok:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        self._publish_state(breaker, method, endpoint, previous)
+
+    def _publish_state(self, breaker: CircuitBreaker, method: str, endpoint: str, previous: str) -> None:
+        """Log and export the breaker's state if it changed from previous"""
+        if breaker.state == previous:
+            return
+        log.warning(
+            "upstream.circuit_state",
+            base_url=self.base_url,
+            endpoint=breaker.name,
+            state=breaker.state,
+            failures=breaker.failures,
+        )
+        UPSTREAM_CIRCUIT_STATE.set(
+            STATE_VALUES[breaker.state], base_url=self.base_url, method=method, endpoint=endpoint
+        )
+
+    def _may_retry(self, idempotent: bool, attempt: int) -> bool:
+        return (
+            idempotent
+            and attempt < self.retry_policy.max_attempts
+            and self.retry_budget.try_withdraw()
+        )
+
+    async def _backoff(self, method: str, endpoint: str, attempt: int, reason: str) -> None:
+        UPSTREAM_RETRIES.inc(method=method, endpoint=endpoint)
+        delay = self.retry_policy.delay(attempt)
+        log.info("upstream.retry", endpoint=endpoint, attempt=attempt, reason=reason, delay=round(delay, 3))
+        await asyncio.sleep(delay)
+
+    async def get(
+        self,
+        path: str,
+        headers: Optional[dict] = None,
+        endpoint: Optional[str] = None,
+        observe: bool = True,
+    ) -> tuple[int, dict]:
+        return await self.request("GET", path, headers=headers, endpoint=endpoint, observe=observe)
+
+    async def post(
+        self,
+        path: str,
+        json: dict,
+        headers: Optional[dict] = None,
+        endpoint: Optional[str] = None,
+        idempotent: Optional[bool] = None,
+        observe: bool = True,
+    ) -> tuple[int, dict]:
+        return await self.request(
+            "POST",
+            path,
+            headers=headers,
+            json=json,
+            endpoint=endpoint,
+            idempotent=idempotent,
+            observe=observe,
+        )
+
+    async def warm_up(self) -> None:
+        """Open the first pooled connection ahead of the first tool call"""
+        try:
+            await self.client.get("/")
+        except httpx.HTTPError as e:
+            log.warning("upstream.warm_up_failed", base_url=self.base_url, error=str(e))
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# One gateway per API base URL, shared by every tool call in this process
+_gateways: dict[str, UpstreamGateway] = {}
+# Called with (seconds, ok) after every observed upstream attempt (server.py: adaptive limiter)
+_latency_observer: Optional[Callable[[float, bool], None]] = None
+
+
+def set_latency_observer(observer: Optional[Callable[[float, bool], None]]) -> None:
+    global _latency_observer
+    _latency_observer = observer
+
+
+def get_gateway(base_url: str) -> UpstreamGateway:
+    """Return the shared gateway for an API base URL"""
+    key = base_url.rstrip("/")
+    gateway = _gateways.get(key)
+    if gateway is None:
+        gateway = _gateways[key] = UpstreamGateway(key)
+    return gateway
+
+
+async def close_gateway(base_url: str) -> None:
+    """Close and forget the gateway for one base URL (e.g. a removed shard)"""
+    gateway = _gateways.pop(base_url.rstrip("/"), None)
+    if gateway is not None:
+        await gateway.aclose()
+
+
+async def close_gateways() -> None:
+    """Close every pooled client (called on server shutdown)"""
+    for gateway in list(_gateways.values()):
+        await gateway.aclose()
+    _gateways.clear()